@@ -0,0 +1,611 @@
+"""
+Offline backtest: analyze_symbol karar mantığını yerel geçmiş üzerinde tekrar oynatır
+ve her kapı (gate) için isabet oranı + ileri getiri raporlar. Ağ kullanmaz.
+
+Dosya düzeni (--history-dir, varsayılan CACHE_DIR):
+  candles/<instId>_<bar>.json   → CandleCache biçimi (kapanmış mumlar); <bar> dosyası
+                                  yoksa RESAMPLE_FROM dosyasından yerelde üretilir;
+                                  CONFIRM_BAR dosyası alt TF onayı (MTF_CONFIRM) içindir
+  trades/<instId>.jsonl         → satır başına bir OKX trade dict'i
+  books/<instId>.jsonl          → {"ts", "bids", "asks"} orderbook snapshot'ı
+  mcap.json                     → McapCache snapshot'ı (opsiyonel)
+
+trades / books dosyaları kayıtlardan üretilir: --import-stream ham WS akış
+kaydını (STREAM_RECORD_PATH), --import-fixture RecordingSource fixture'ını
+(trades / books / candles yanıtları) içe aktarır. Bir barın trade veya book
+verisi yoksa o barda delta / orderbook / whale / signal kapıları
+değerlendirilemez; rapor atlanan bar sayısını ayrıca yazar.
+
+Yapı (MSB / FVG / mesafe) tüm barlar için tek vektörel geçişte hesaplanır ve
+canlı bot gibi CONFIRM_BAR yapısıyla onaylanır (--mtf-confirm, varsayılan
+MTF_CONFIRM); order-flow şartları sadece yapısı oluşan barlarda, canlı bot ile aynı
+fonksiyonlarla değerlendirilir. Semboller process havuzunda paralel koşar.
+
+Kullanım:
+  python backtest.py --history-dir .cache --workers 8 --horizons 1,3,6
+  python backtest.py --import-stream ws.jsonl.gz --import-fixture fixtures/scan.json.gz
+  python backtest.py --set MAX_STRUCTURE_DISTANCE=0.02 --set MIN_CONDITIONS_STRICT=2
+"""
+
+import argparse
+import contextlib
+import gzip
+import json
+import os
+from bisect import bisect_right
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import parse_qsl
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+import main
+
+GATES = ("structure_raw", "structure", "delta", "orderbook", "whale", "signal")
+SIDES = ("LONG", "SHORT")
+
+# Backtest'te --set ile değiştirilebilen parametreler
+TUNABLE_PARAMS = (
+    "STRUCT_LOOKBACK",
+    "ZONE_BUFFER",
+    "MIN_CONDITIONS_STRICT",
+    "MAX_STRUCTURE_DISTANCE",
+    "MAX_WHALE_DISTANCE",
+    "MAX_WHALE_AGE_MIN",
+    "OB_IMBALANCE_FACTOR",
+)
+
+# Akış kaydından sembol başına en fazla bu aralıkta bir book snapshot'ı yazılır
+BOOK_SNAPSHOT_MS = 60_000
+
+
+# ------------ Geçmiş Verisi ------------
+
+def list_history_symbols(history_dir, bar=main.BAR):
+    cdir = os.path.join(history_dir, "candles")
+    suffixes = [f"_{bar}.json"]
+    if main._resample_ratio(bar):
+        suffixes.append(f"_{main.RESAMPLE_FROM}.json")
+    try:
+        names = os.listdir(cdir)
+    except FileNotFoundError:
+        return []
+    found = set()
+    for suffix in suffixes:
+        found.update(n[: -len(suffix)] for n in names if n.endswith(suffix))
+    return sorted(found)
+
+
+def _load_candle_rows(history_dir, inst_id, bar):
+    """bar dosyası yoksa RESAMPLE_FROM mumlarından tam kapanmış barlar üretilir."""
+    path = os.path.join(history_dir, "candles", f"{inst_id}_{bar}.json")
+    if os.path.exists(path) or not main._resample_ratio(bar):
+        with open(path) as f:
+            return json.load(f)["rows"]
+
+    with open(os.path.join(history_dir, "candles", f"{inst_id}_{main.RESAMPLE_FROM}.json")) as f:
+        base = json.load(f)["rows"]
+    candles = main.resample_candles(
+        [{"ts": r[0], "open": r[1], "high": r[2], "low": r[3], "close": r[4]} for r in base], bar
+    )
+    # sondaki grup eksikse henüz kapanmamış bardır
+    if candles and base and base[-1][0] < candles[-1]["ts"] + main.bar_to_ms(bar) - main.bar_to_ms(main.RESAMPLE_FROM):
+        candles.pop()
+    return [[c["ts"], c["open"], c["high"], c["low"], c["close"]] for c in candles]
+
+
+def _read_jsonl(path):
+    rows = []
+    try:
+        with open(path) as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    rows.append(json.loads(line))
+    except FileNotFoundError:
+        pass
+    return rows
+
+
+def _write_jsonl(path, rows):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        for row in rows:
+            f.write(json.dumps(row, separators=(",", ":")) + "\n")
+    os.replace(tmp, path)
+
+
+def load_confirm_history(history_dir, inst_id, confirm_bar=main.CONFIRM_BAR):
+    """Alt TF onay mumları (CandleArray); dosya yoksa None (canlı botta onay verisi yok gibi)."""
+    try:
+        rows = _load_candle_rows(history_dir, inst_id, confirm_bar)
+    except FileNotFoundError:
+        return None
+    return main.CandleArray(*zip(*rows)) if rows else None
+
+
+def load_symbol_history(history_dir, inst_id, bar=main.BAR):
+    """(CandleArray, trades (ts sıralı), books (ts sıralı)) döndürür."""
+    rows = _load_candle_rows(history_dir, inst_id, bar)
+    arr = main.CandleArray(*zip(*rows)) if rows else main.CandleArray([], [], [], [], [])
+
+    trades = _read_jsonl(os.path.join(history_dir, "trades", f"{inst_id}.jsonl"))
+    trades.sort(key=lambda t: int(t.get("ts") or 0))
+    books = _read_jsonl(os.path.join(history_dir, "books", f"{inst_id}.jsonl"))
+    books.sort(key=lambda b: int(b.get("ts") or 0))
+    return arr, trades, books
+
+
+# ------------ Kayıtları İçe Aktarma ------------
+
+def _merge_rows(path, rows, key):
+    """jsonl dosyasıyla birleştirir (key tekil, ts sıralı); eklenen satır sayısı."""
+    merged = {key(r): r for r in _read_jsonl(path)}
+    before = len(merged)
+    for r in rows:
+        merged.setdefault(key(r), r)
+    if len(merged) > before:
+        _write_jsonl(path, sorted(merged.values(), key=lambda r: int(r.get("ts") or 0)))
+    return len(merged) - before
+
+
+def _merge_candles(history_dir, inst_id, bar, candles):
+    """Kapanmış mumları CandleCache biçimindeki dosyayla birleştirir; eklenen mum sayısı."""
+    path = os.path.join(history_dir, "candles", f"{inst_id}_{bar}.json")
+    try:
+        with open(path) as f:
+            rows = {r[0]: r for r in json.load(f)["rows"]}
+    except FileNotFoundError:
+        rows = {}
+    before = len(rows)
+    for c in candles:
+        rows.setdefault(c["ts"], [c["ts"], c["open"], c["high"], c["low"], c["close"]])
+    if len(rows) > before:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump({"instId": inst_id, "bar": bar, "rows": [rows[k] for k in sorted(rows)]}, f,
+                      separators=(",", ":"))
+        os.replace(tmp, path)
+    return len(rows) - before
+
+
+def _save_imported(history_dir, trades, books, candles=None):
+    counts = {"trades": 0, "books": 0, "candles": 0}
+    for inst_id, rows in trades.items():
+        path = os.path.join(history_dir, "trades", f"{inst_id}.jsonl")
+        counts["trades"] += _merge_rows(path, rows, lambda t: t.get("tradeId"))
+    for inst_id, rows in books.items():
+        path = os.path.join(history_dir, "books", f"{inst_id}.jsonl")
+        counts["books"] += _merge_rows(path, rows, lambda b: int(b.get("ts") or 0))
+    for (inst_id, bar), rows in (candles or {}).items():
+        counts["candles"] += _merge_candles(history_dir, inst_id, bar, rows)
+    counts["symbols"] = len(set(trades) | set(books))
+    return counts
+
+
+def _book_rows(levels, depth=main.ORDERBOOK_DEPTH):
+    return [[lvl[0], lvl[1]] for lvl in levels[:depth]]
+
+
+def import_stream_record(path, history_dir):
+    """
+    MarketStream ham mesaj kaydı (gzip JSONL) → trades/ ve books/ dosyaları.
+    books / books5 mesajları L2Book'a uygulanır (checksum dahil); geçerli
+    defterin ilk ORDERBOOK_DEPTH seviyesi BOOK_SNAPSHOT_MS aralığının son
+    hali olarak yazılır.
+    """
+    trades, books = {}, {}
+    l2, pending = {}, {}
+
+    def flush(inst_id):
+        snap = pending.pop(inst_id, None)
+        if snap is not None:
+            books.setdefault(inst_id, []).append(snap)
+
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line == "pong":
+                continue
+            try:
+                msg = json.loads(line)
+            except ValueError:
+                continue
+            arg = msg.get("arg") or {}
+            inst_id = arg.get("instId")
+            channel = arg.get("channel", "")
+            data = msg.get("data") or []
+            if "event" in msg or not inst_id or not data:
+                continue
+            if channel == "trades":
+                trades.setdefault(inst_id, []).extend(data)
+            elif channel.startswith("books"):
+                book = l2.setdefault(inst_id, main.L2Book())
+                if not book.apply(msg.get("action"), data[0]):
+                    continue
+                prev = pending.get(inst_id)
+                if prev is not None and prev["ts"] // BOOK_SNAPSHOT_MS != book.ts // BOOK_SNAPSHOT_MS:
+                    flush(inst_id)
+                bids, asks = book.top(main.ORDERBOOK_DEPTH)
+                pending[inst_id] = {"ts": book.ts, "bids": _book_rows(bids), "asks": _book_rows(asks)}
+    for inst_id in list(pending):
+        flush(inst_id)
+    return _save_imported(history_dir, trades, books)
+
+
+def import_fixture(path, history_dir):
+    """RecordingSource fixture'ı → trades/, books/ ve kapanmış mumlar (candles/)."""
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        records = json.load(f).get("okx", {})
+    trades, books, candles = {}, {}, {}
+    for key, data in records.items():
+        if not data:
+            continue
+        target, _, query = key.partition("?")
+        params = dict(parse_qsl(query))
+        inst_id = params.get("instId")
+        if not inst_id:
+            continue
+        if target in ("/api/v5/market/trades", "/api/v5/market/history-trades"):
+            trades.setdefault(inst_id, []).extend(data)
+        elif target == "/api/v5/market/books":
+            b = data[0]
+            books.setdefault(inst_id, []).append(
+                {"ts": int(b.get("ts") or 0), "bids": _book_rows(b.get("bids", [])), "asks": _book_rows(b.get("asks", []))}
+            )
+        elif target == "/api/v5/market/candles" and "bar" in params:
+            parsed, confirmed = main.parse_candle_rows(data)
+            candles.setdefault((inst_id, params["bar"]), []).extend(c for c, ok in zip(parsed, confirmed) if ok)
+    return _save_imported(history_dir, trades, books, candles)
+
+
+def has_orderflow_history(history_dir, inst_id):
+    """Sembolün hem trades hem books dosyası var ve boş değil mi?"""
+    for kind in ("trades", "books"):
+        try:
+            if os.path.getsize(os.path.join(history_dir, kind, f"{inst_id}.jsonl")) == 0:
+                return False
+        except OSError:
+            return False
+    return True
+
+
+def load_mcap_index(history_dir):
+    try:
+        with open(os.path.join(history_dir, "mcap.json")) as f:
+            snap = json.load(f)
+        return main.McapIndex(snap["mcap"], snap["fetched_at"])
+    except Exception:
+        return main.McapIndex()
+
+
+# ------------ Vektörel Yapı (tüm barlar) ------------
+
+def structure_over_bars(arr, lookback=main.STRUCT_LOOKBACK):
+    """
+    Her bar t için analyze_structure sonucu (t son mum kabul edilerek).
+    Dönüş: bar uzunluğunda diziler; yetersiz geçmişli barlar False / NaN.
+    """
+    n = len(arr)
+    width = lookback + 2          # MSB ve FVG için gereken en kısa pencere
+    out_len = max(0, n - width + 1)
+    keys = ("bullish_msb", "bearish_msb", "bullish_fvg_reject", "bearish_fvg_reject",
+            "structure_long", "structure_short")
+    res = {k: np.zeros(n, dtype=bool) for k in keys}
+    res["bull_level"] = np.full(n, np.nan)
+    res["bear_level"] = np.full(n, np.nan)
+    if out_len == 0:
+        return res
+
+    win = [sliding_window_view(col, width) for col in (arr.open, arr.high, arr.low, arr.close)]
+    last_idx = np.arange(width - 1, n)
+    # evaluate_symbol: en az lookback + 3 mum gerekir
+    valid = last_idx + 1 >= lookback + 3
+    batch = main.analyze_structure_batch(*win, lookback=lookback, valid=valid)
+    for k in keys + ("bull_level", "bear_level"):
+        res[k][width - 1:] = batch[k]
+    return res
+
+
+def confirm_masks(ts, confirm, lookback, rule, bar=main.BAR, confirm_bar=main.CONFIRM_BAR):
+    """
+    Her bar için alt TF onayının izin verdiği yönler (confirm_structure ile aynı
+    kural): bar t, BAR ile aynı anda kapanan son CONFIRM_BAR mumuna kadarki alt TF
+    yapısıyla onaylanır. Alt TF verisi yetersizse "align" geçirir, "both" engeller.
+    Dönüş: (allow_long, allow_short) bool dizileri.
+    """
+    n = len(ts)
+    if rule == "off" or confirm_bar == bar:
+        return np.ones(n, dtype=bool), np.ones(n, dtype=bool)
+
+    low_long = np.zeros(n, dtype=bool)
+    low_short = np.zeros(n, dtype=bool)
+    if confirm is not None and len(confirm):
+        low = structure_over_bars(confirm, lookback)
+        last_open = np.asarray(ts) + main.bar_to_ms(bar) - main.bar_to_ms(confirm_bar)
+        j = np.searchsorted(confirm.ts, last_open, side="right") - 1
+        have = j >= 0
+        jj = np.where(have, j, 0)
+        low_long = have & low["structure_long"][jj]
+        low_short = have & low["structure_short"][jj]
+
+    if rule == "both":
+        return low_long, low_short
+    return ~low_short, ~low_long
+
+
+def forward_returns(close, horizons):
+    """(len(horizons) × n) ileri getiri; geleceği olmayan barlar NaN."""
+    n = len(close)
+    out = np.full((len(horizons), n), np.nan)
+    for i, h in enumerate(horizons):
+        if h < n:
+            out[i, : n - h] = close[h:] / close[: n - h] - 1
+    return out
+
+
+# ------------ Sembol Backtest'i ------------
+
+def _empty_stats(n_h):
+    stats = {
+        side: {g: {"count": 0, "hits": [0] * n_h, "ret_sum": [0.0] * n_h, "ret_n": [0] * n_h} for g in GATES}
+        for side in SIDES
+    }
+    # yapıyı geçip trade / book verisi olmadığı için order-flow kapılarına giremeyen barlar
+    stats["flow_missing"] = {side: 0 for side in SIDES}
+    return stats
+
+
+def _record(stats, side, gate, fwd, t):
+    g = stats[side][gate]
+    g["count"] += 1
+    sign = 1.0 if side == "LONG" else -1.0
+    for i in range(fwd.shape[0]):
+        r = fwd[i, t]
+        if np.isnan(r):
+            continue
+        r *= sign
+        g["ret_n"][i] += 1
+        g["ret_sum"][i] += r
+        if r > 0:
+            g["hits"][i] += 1
+
+
+def bar_orderflow_inputs(trades, trade_ts, books, book_ts, bar_open, bar_ms):
+    """Barın trade'leri ve bar kapanışındaki son orderbook özeti."""
+    lo = bisect_right(trade_ts, bar_open - 1)
+    hi = bisect_right(trade_ts, bar_open + bar_ms - 1)
+    bar_trades = trades[lo:hi]
+    j = bisect_right(book_ts, bar_open + bar_ms) - 1
+    book = None
+    if j >= 0:
+        b = books[j]
+        book = main.summarize_book(b.get("bids", [])[: main.ORDERBOOK_DEPTH], b.get("asks", [])[: main.ORDERBOOK_DEPTH])
+    return bar_trades, book
+
+
+def backtest_arrays(inst_id, arr, trades, books, mcap_map, horizons, bar=main.BAR, lookback=None,
+                    confirm=None, mtf_confirm=None):
+    """Tek sembolün gate istatistikleri (bellekteki veriyle); confirm: CONFIRM_BAR mumları."""
+    if lookback is None:
+        lookback = main.STRUCT_LOOKBACK
+    stats = _empty_stats(len(horizons))
+    n = len(arr)
+    if n == 0:
+        return stats
+
+    st = structure_over_bars(arr, lookback)
+    allow_long, allow_short = confirm_masks(arr.ts, confirm, lookback, mtf_confirm or main.MTF_CONFIRM, bar)
+    st["structure_long"] &= allow_long
+    st["structure_short"] &= allow_short
+    fwd = forward_returns(arr.close, horizons)
+    raw_long = st["bullish_msb"] | st["bullish_fvg_reject"]
+    raw_short = st["bearish_msb"] | st["bearish_fvg_reject"]
+
+    base = inst_id.split("-")[0]
+    mcap_class = main.classify_mcap(base, mcap_map)
+    thr = main.whale_thresholds(mcap_class)
+    nd_pos_thr, nd_neg_thr = main.net_delta_thresholds(mcap_class)
+
+    trade_ts = [int(t.get("ts") or 0) for t in trades]
+    book_ts = [int(b.get("ts") or 0) for b in books]
+    bar_ms = main.bar_to_ms(bar)
+
+    for t in np.flatnonzero(raw_long | raw_short):
+        for side, raw, struct in (("LONG", raw_long, st["structure_long"]),
+                                  ("SHORT", raw_short, st["structure_short"])):
+            if not raw[t]:
+                continue
+            _record(stats, side, "structure_raw", fwd, t)
+            if not struct[t]:
+                continue
+            _record(stats, side, "structure", fwd, t)
+
+            bar_trades, book = bar_orderflow_inputs(trades, trade_ts, books, book_ts, int(arr.ts[t]), bar_ms)
+            # canlı bot trade / book yoksa sinyal üretmez
+            if not bar_trades or not book:
+                stats["flow_missing"][side] += 1
+                continue
+            of = main.analyze_trades_orderflow(bar_trades, *thr)
+            last_close = float(arr.close[t])
+            last_ts = int(arr.ts[t])
+            if side == "LONG":
+                conds = main.long_flow_conditions(last_close, last_ts, of, book, nd_pos_thr)
+            else:
+                conds = main.short_flow_conditions(last_close, last_ts, of, book, nd_neg_thr)
+
+            for gate, ok in zip(("delta", "orderbook", "whale"), conds):
+                if ok:
+                    _record(stats, side, gate, fwd, t)
+            if 1 + sum(conds) >= main.MIN_CONDITIONS_STRICT:
+                _record(stats, side, "signal", fwd, t)
+    return stats
+
+
+def merge_stats(total, part):
+    for side in SIDES:
+        for gate in GATES:
+            a, b = total[side][gate], part[side][gate]
+            a["count"] += b["count"]
+            for i in range(len(a["hits"])):
+                a["hits"][i] += b["hits"][i]
+                a["ret_sum"][i] += b["ret_sum"][i]
+                a["ret_n"][i] += b["ret_n"][i]
+        total["flow_missing"][side] += part["flow_missing"][side]
+    return total
+
+
+# ------------ Process Havuzu ------------
+
+_WORKER = {}
+
+
+@contextlib.contextmanager
+def override_params(params):
+    """main parametrelerini geçici olarak ezer; çıkışta eski değerler geri yüklenir."""
+    saved = {k: getattr(main, k) for k in params}
+    try:
+        for k, v in params.items():
+            setattr(main, k, v)
+        yield
+    finally:
+        for k, v in saved.items():
+            setattr(main, k, v)
+
+
+def _init_worker(history_dir, bar, horizons, params, mtf_confirm):
+    # havuz process'i işi bitince kapanır; ezilen değerlerin geri yüklenmesi gerekmez
+    for k, v in params.items():
+        setattr(main, k, v)
+    _WORKER.update(
+        history_dir=history_dir,
+        bar=bar,
+        horizons=horizons,
+        mtf_confirm=mtf_confirm,
+        mcap=load_mcap_index(history_dir),
+    )
+
+
+def _run_symbol(inst_id):
+    w = _WORKER
+    try:
+        arr, trades, books = load_symbol_history(w["history_dir"], inst_id, w["bar"])
+        confirm = load_confirm_history(w["history_dir"], inst_id) if w["mtf_confirm"] != "off" else None
+    except Exception as e:
+        print(f"  {inst_id} geçmişi okunamadı:", e)
+        return _empty_stats(len(w["horizons"]))
+    return backtest_arrays(inst_id, arr, trades, books, w["mcap"], w["horizons"], w["bar"],
+                           confirm=confirm, mtf_confirm=w["mtf_confirm"])
+
+
+def run_backtest(history_dir, symbols=None, bar=main.BAR, horizons=(1, 3, 6), params=None, workers=None,
+                 mtf_confirm=None):
+    """Tüm semboller için birleşik gate istatistikleri (mtf_confirm varsayılanı MTF_CONFIRM)."""
+    params = params or {}
+    mtf_confirm = mtf_confirm or main.MTF_CONFIRM
+    if symbols is None:
+        symbols = list_history_symbols(history_dir, bar)
+    total = _empty_stats(len(horizons))
+    if not symbols:
+        return total
+
+    init = (history_dir, bar, tuple(horizons), params, mtf_confirm)
+    if workers == 1:
+        # aynı process: parametreler bu çağrıyla sınırlı kalmalı (sweep / testler sızıntı görmesin)
+        with override_params(params):
+            _init_worker(history_dir, bar, tuple(horizons), {}, mtf_confirm)
+            try:
+                for inst_id in symbols:
+                    merge_stats(total, _run_symbol(inst_id))
+            finally:
+                _WORKER.clear()
+        return total
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=init) as pool:
+        for part in pool.map(_run_symbol, symbols, chunksize=max(1, len(symbols) // 64)):
+            merge_stats(total, part)
+    return total
+
+
+def format_report(stats, horizons):
+    head = f"{'Yön':<6} {'Kapı':<14} {'Adet':>7}"
+    for h in horizons:
+        head += f" {'isabet@' + str(h):>10} {'getiri@' + str(h):>10}"
+    lines = [head, "-" * len(head)]
+    for side in SIDES:
+        for gate in GATES:
+            g = stats[side][gate]
+            row = f"{side:<6} {gate:<14} {g['count']:>7}"
+            for i in range(len(horizons)):
+                n = g["ret_n"][i]
+                if n:
+                    row += f" {g['hits'][i] / n:>10.1%} {g['ret_sum'][i] / n:>10.3%}"
+                else:
+                    row += f" {'-':>10} {'-':>10}"
+            lines.append(row)
+
+    missing = stats["flow_missing"]
+    if any(missing.values()):
+        n_struct = sum(stats[side]["structure"]["count"] for side in SIDES)
+        lines.append("")
+        lines.append(
+            f"UYARI: yapıyı geçen {n_struct} bardan {sum(missing.values())} tanesinde "
+            f"(LONG {missing['LONG']} / SHORT {missing['SHORT']}) trade / orderbook geçmişi yok; "
+            "delta / orderbook / whale / signal kapıları bu barlarda değerlendirilmedi."
+        )
+        lines.append("Order-flow geçmişi için kayıtları --import-stream / --import-fixture ile içe aktarın.")
+    return "\n".join(lines)
+
+
+def parse_param(text):
+    key, _, val = text.partition("=")
+    if key not in TUNABLE_PARAMS:
+        raise argparse.ArgumentTypeError(f"{key} ayarlanamaz; seçenekler: {', '.join(TUNABLE_PARAMS)}")
+    cast = type(getattr(main, key))
+    return key, cast(val)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="analyze_symbol offline backtest")
+    parser.add_argument("--history-dir", default=main.CACHE_DIR)
+    parser.add_argument("--bar", default=main.BAR)
+    parser.add_argument("--symbols", help="virgülle ayrılmış instId listesi (varsayılan: hepsi)")
+    parser.add_argument("--horizons", default="1,3,6", help="ileri getiri ufukları (bar)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--mtf-confirm", choices=("off", "align", "both"), default=main.MTF_CONFIRM,
+                        help="alt TF (CONFIRM_BAR) onay kuralı (varsayılan: canlı MTF_CONFIRM)")
+    parser.add_argument("--set", dest="params", action="append", type=parse_param, default=[],
+                        help="parametre ezme, örn. MAX_STRUCTURE_DISTANCE=0.02")
+    parser.add_argument("--json", help="sonuçları JSON olarak bu dosyaya yaz")
+    parser.add_argument("--import-stream", action="append", default=[], metavar="PATH",
+                        help="ham WS akış kaydını (STREAM_RECORD_PATH) trades/ ve books/ altına aktar")
+    parser.add_argument("--import-fixture", action="append", default=[], metavar="PATH",
+                        help="RecordingSource fixture'ını trades/, books/ ve candles/ altına aktar")
+    return parser.parse_args(argv)
+
+
+def cli(argv=None):
+    args = parse_args(argv)
+    horizons = tuple(int(h) for h in args.horizons.split(","))
+    symbols = args.symbols.split(",") if args.symbols else None
+    params = dict(args.params)
+
+    for kind, paths, fn in (("akış kaydı", args.import_stream, import_stream_record),
+                            ("fixture", args.import_fixture, import_fixture)):
+        for path in paths:
+            c = fn(path, args.history_dir)
+            print(f"{kind} içe aktarıldı ({path}): {c['symbols']} sembol, {c['trades']} yeni trade, "
+                  f"{c['books']} yeni book, {c['candles']} yeni mum")
+
+    stats = run_backtest(args.history_dir, symbols, args.bar, horizons, params, args.workers, args.mtf_confirm)
+    print(format_report(stats, horizons))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"horizons": horizons, "params": params, "mtf_confirm": args.mtf_confirm, "stats": stats},
+                      f, indent=2)
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,278 @@
+"""
+Benchmark paketi: tarama hattı ve sıcak fonksiyonlar için ağsız ölçüm.
+
+Sentetik (deterministik) OKX verisi veya --fixture ile kaydedilmiş bir
+replay dosyası kullanılır. Her ölçüm için throughput (öğe/sn) ve tepe
+bellek (tracemalloc) raporlanır; kayıtlı bir baseline ile karşılaştırılıp
+tolerans üstü yavaşlamalar REGRESYON olarak işaretlenir (çıkış kodu 1).
+
+Kullanım:
+  python bench.py                                  # ölç ve yazdır
+  python bench.py --save-baseline bench_baseline.json
+  python bench.py --baseline bench_baseline.json --tolerance 0.2
+  python bench.py --scan-sizes 150,1000,5000 --quick
+"""
+
+import argparse
+import contextlib
+import gc
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import main
+
+BAR_MS = main.bar_to_ms(main.BAR)
+CONFIRM_BAR_MS = main.bar_to_ms(main.CONFIRM_BAR)
+
+
+# ------------ Sentetik Veri ------------
+
+def synth_candle_rows(rnd, px, now_ms, bar_ms, n_bars=main.CANDLE_LIMIT):
+    """OKX biçiminde mum satırları (en yeni en üstte) ve son kapanış."""
+    rows = []
+    for i in range(n_bars):
+        o = px
+        c = px * (1 + rnd.gauss(0, 0.02))
+        h = max(o, c) * (1 + abs(rnd.gauss(0, 0.01)))
+        l = min(o, c) * (1 - abs(rnd.gauss(0, 0.01)))
+        ts_ms = now_ms - (n_bars - 1 - i) * bar_ms
+        confirm = "1" if i < n_bars - 1 else "0"
+        rows.append([str(ts_ms), f"{o:.6g}", f"{h:.6g}", f"{l:.6g}", f"{c:.6g}", "1", "1", "1", confirm])
+        px = c
+    rows.reverse()  # OKX: en yeni en üstte
+    return rows, px
+
+
+def synth_symbol(rnd, inst_id, now_ms, n_bars=main.CANDLE_LIMIT, n_trades=main.TRADES_LIMIT,
+                 depth=main.ORDERBOOK_DEPTH):
+    """Tek sembol için OKX biçiminde (candles, confirm candles, trades, books) yanıtları."""
+    px = rnd.uniform(0.05, 500)
+    confirm_rows, _ = synth_candle_rows(rnd, px, now_ms, CONFIRM_BAR_MS, n_bars)
+    rows, px = synth_candle_rows(rnd, px, now_ms, BAR_MS, n_bars)
+
+    trades = []
+    for j in range(n_trades):
+        tpx = px * (1 + rnd.gauss(0, 0.002))
+        trades.append({
+            "instId": inst_id,
+            "tradeId": str(10_000_000 + j),
+            "px": f"{tpx:.6g}",
+            "sz": f"{rnd.expovariate(1 / (40_000 / px)):.6g}",
+            "side": rnd.choice(("buy", "sell")),
+            "ts": str(now_ms - j * 1_000),
+        })
+
+    book = [{
+        "bids": [[f"{px * (1 - 0.001 * (k + 1)):.6g}", f"{rnd.uniform(1, 5_000) / px:.6g}", "0", "1"] for k in range(depth)],
+        "asks": [[f"{px * (1 + 0.001 * (k + 1)):.6g}", f"{rnd.uniform(1, 5_000) / px:.6g}", "0", "1"] for k in range(depth)],
+        "ts": str(now_ms),
+    }]
+    return rows, confirm_rows, trades, book
+
+
+class SyntheticSource(main.ReplaySource):
+    """Bellekte üretilmiş sentetik evren; ReplaySource arayüzüyle çalışır."""
+
+    def __init__(self, n_symbols, seed=42):
+        rnd = random.Random(seed)
+        now_ms = main.current_bar_open_ms()
+        okx = {}
+        tickers = []
+        mcaps = []
+        for k in range(n_symbols):
+            inst_id = f"S{k:05d}-USDT"
+            rows, confirm_rows, trades, book = synth_symbol(rnd, inst_id, now_ms)
+            # CANDLE_LIMIT: get_candles ölçümleri, SCAN_CANDLE_LIMIT: tarama (en yeni en üstte)
+            for limit in (main.CANDLE_LIMIT, main.SCAN_CANDLE_LIMIT):
+                okx[main.request_key("/api/v5/market/candles",
+                                     {"instId": inst_id, "bar": main.BAR, "limit": limit})] = rows[:limit]
+                okx[main.request_key("/api/v5/market/candles",
+                                     {"instId": inst_id, "bar": main.CONFIRM_BAR, "limit": limit})] = confirm_rows[:limit]
+            okx[main.request_key("/api/v5/market/trades", {"instId": inst_id, "limit": main.TRADES_LIMIT})] = trades
+            okx[main.request_key("/api/v5/market/books", {"instId": inst_id, "sz": main.ORDERBOOK_DEPTH})] = book
+            tickers.append({"instId": inst_id, "volCcy24h": str(n_symbols - k)})
+            mcaps.append({"symbol": f"s{k:05d}", "market_cap": rnd.choice((5e10, 5e9, 5e8, 5e7))})
+        for inst_id in ("BTC-USDT", "ETH-USDT"):
+            rows, _, trades, _ = synth_symbol(rnd, inst_id, now_ms)
+            okx[main.request_key("/api/v5/market/candles",
+                                 {"instId": inst_id, "bar": main.BAR, "limit": main.CANDLE_LIMIT})] = rows
+            okx[main.request_key("/api/v5/market/trades", {"instId": inst_id, "limit": main.TRADES_LIMIT})] = trades
+        okx[main.request_key("/api/v5/market/tickers", {"instType": "SPOT"})] = tickers
+        params = {"vs_currency": "usd", "order": "market_cap_desc", "per_page": 250, "page": 1, "sparkline": "false"}
+        cg = {main.request_key(f"{main.COINGECKO_BASE}/coins/markets", params): mcaps}
+        super().__init__(f"<synthetic:{n_symbols}>", {"okx": okx, "json": cg})
+
+
+# ------------ Ölçüm ------------
+
+def measure(fn, items, repeat=5, min_time=0.2):
+    """
+    fn() en az min_time sürecek kadar tekrarlanır; repeat ölçümün en iyisi alınır.
+    Dönüş: {"items_per_s", "s_per_call", "peak_kb"}.
+    """
+    fn()  # ısınma
+    loops = 1
+    while True:
+        t = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        el = time.perf_counter() - t
+        if el >= min_time or loops >= 1_000_000:
+            break
+        loops *= 2
+
+    best = el / loops
+    for _ in range(repeat - 1):
+        gc.collect()
+        t = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        best = min(best, (time.perf_counter() - t) / loops)
+
+    gc.collect()
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"items_per_s": items / best, "s_per_call": best, "peak_kb": peak / 1024}
+
+
+@contextlib.contextmanager
+def using_source(source):
+    """
+    main'in veri kaynağını geçici olarak değiştirir (önbellekler kapalı).
+    Metrik raporları geçici klasöre yazılır, Telegram çağrılmaz: benchmark
+    gerçek çalışmaların metrics/ dosyalarını ezmez.
+    """
+    names = ("DATA_SOURCE", "CANDLE_STORE", "MCAP_CACHE", "INDICATORS", "TOP_LIMIT",
+             "METRICS_JSON", "PROMETHEUS_TEXTFILE", "telegram")
+    saved = {name: getattr(main, name) for name in names}
+    with tempfile.TemporaryDirectory(prefix="radar-bench-") as tmp:
+        main.DATA_SOURCE = source
+        main.CANDLE_STORE = None
+        main.MCAP_CACHE = main.DirectMcapSource()
+        main.INDICATORS = main.IndicatorStore(path=None)
+        main.METRICS_JSON = os.path.join(tmp, "last_run.json")
+        main.PROMETHEUS_TEXTFILE = os.path.join(tmp, "radar.prom") if saved["PROMETHEUS_TEXTFILE"] else ""
+        main.telegram = lambda msg: None
+        try:
+            yield source
+        finally:
+            for name, value in saved.items():
+                setattr(main, name, value)
+
+
+def run_benchmarks(scan_sizes=(150, 1_000, 5_000), repeat=5, min_time=0.2, fixture=None):
+    results = {}
+
+    def record(name, fn, items, **kw):
+        r = measure(fn, items, kw.get("repeat", repeat), kw.get("min_time", min_time))
+        results[name] = r
+        print(f"  {name:<34} {r['items_per_s']:>14,.0f} öğe/sn  {r['s_per_call'] * 1e3:>10.3f} ms  "
+              f"{r['peak_kb']:>10,.0f} KB", flush=True)
+
+    src = main.ReplaySource(fixture) if fixture else SyntheticSource(150)
+    with using_source(src):
+        symbols = main.get_spot_usdt_top_symbols(limit=150) or []
+        inst_id = symbols[0]
+        candles = main.get_candles(inst_id)
+        trades = main.get_trades(inst_id)
+        closes = [c["close"] for c in candles]
+        mcap_map = main.McapIndex(main.load_mcap_map()[0])
+        thr = main.whale_thresholds("MID")
+
+        print("Fonksiyon ölçümleri:")
+        record("analyze_trades_orderflow", lambda: main.analyze_trades_orderflow(trades, *thr), len(trades))
+        record("find_recent_fvg", lambda: main.find_recent_fvg(candles), 1)
+        record("detect_bullish_msb", lambda: main.detect_bullish_msb(candles), 1)
+        record("detect_bearish_msb", lambda: main.detect_bearish_msb(candles), 1)
+        record("ema(12)", lambda: main.ema(closes, 12), len(closes))
+        record("ema(200)", lambda: main.ema(closes, 200), len(closes))
+        ind_state = main.IndicatorState()
+        for c in candles[:-1]:
+            ind_state.update(c)
+        record("IndicatorState.peek", lambda: ind_state.peek(candles[-1]), 1)
+        rolling = main.RollingStructure()
+        rolling.extend(candles[:-1])
+
+        def rolling_update():
+            # son mumu bir sonraki bar olarak yeniden besle
+            rolling.update(dict(candles[-1], ts=rolling.last_ts + BAR_MS))
+
+        record("RollingStructure.update", rolling_update, 1)
+        record("analyze_structure", lambda: main.analyze_structure(candles), 1)
+        record("get_candles (parse)", lambda: main.get_candles(inst_id), len(candles))
+        record("get_orderbook (parse)", lambda: main.get_orderbook(inst_id), 1)
+        record("analyze_symbol", lambda: main.analyze_symbol(inst_id, mcap_map), 1)
+
+    print("Tam tarama (main):")
+    for n in scan_sizes:
+        src = main.ReplaySource(fixture) if fixture else SyntheticSource(n)
+        with using_source(src):
+            main.TOP_LIMIT = n
+
+            def scan():
+                with contextlib.redirect_stdout(io.StringIO()):
+                    main.main()
+
+            record(f"main() scan {n}", scan, n, repeat=min(repeat, 2), min_time=0)
+        if fixture:
+            break
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Baseline'a göre yavaşlama oranı; tolerans üstü olanlar regresyon."""
+    regressions = []
+    print(f"\nBaseline karşılaştırması (tolerans %{tolerance * 100:.0f}):")
+    for name, r in results.items():
+        b = baseline.get(name)
+        if not b:
+            print(f"  {name:<34} (baseline yok)")
+            continue
+        ratio = b["items_per_s"] / r["items_per_s"] - 1   # + → yavaşladı
+        mem = r["peak_kb"] / b["peak_kb"] - 1 if b["peak_kb"] else 0.0
+        flag = "REGRESYON" if ratio > tolerance else "ok"
+        if ratio > tolerance:
+            regressions.append(name)
+        print(f"  {name:<34} hız {-ratio:>+8.1%}  bellek {mem:>+8.1%}  {flag}")
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Radar benchmark paketi (ağsız)")
+    parser.add_argument("--scan-sizes", default="150,1000,5000")
+    parser.add_argument("--fixture", help="sentetik yerine kayıtlı replay fixture'ı kullan")
+    parser.add_argument("--quick", action="store_true", help="daha az tekrar (CI için)")
+    parser.add_argument("--baseline", help="karşılaştırılacak baseline JSON")
+    parser.add_argument("--save-baseline", help="sonuçları baseline olarak yaz")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    return parser.parse_args(argv)
+
+
+def cli(argv=None):
+    args = parse_args(argv)
+    sizes = tuple(int(x) for x in args.scan_sizes.split(","))
+    repeat, min_time = (2, 0.05) if args.quick else (5, 0.2)
+    results = run_benchmarks(sizes, repeat, min_time, args.fixture)
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print(f"Baseline yazıldı: {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    cli()
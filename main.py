@@ -1,7 +1,26 @@
+import argparse
+import gzip
+import importlib.util
+import json
 import os
+import signal
+import threading
 import time
+import zlib
+from bisect import bisect_left, bisect_right, insort
+from collections import deque
+from contextlib import contextmanager
+
 import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime, timezone
+from urllib.parse import urlencode, urlparse
+
+try:
+    import numpy as np  # opsiyonel: kolonsal / vektörel hesaplar için
+except ImportError:
+    np = None
 
 OKX_BASE = "https://www.okx.com"
 COINGECKO_BASE = "https://api.coingecko.com/api/v3"
@@ -16,54 +35,826 @@ CANDLE_LIMIT = 200
 TRADES_LIMIT = 200
 ORDERBOOK_DEPTH = 20
 
+# Çoklu zaman dilimi: BAR kurulum, CONFIRM_BAR onay zaman dilimi.
+# MTF_CONFIRM: "off" → sadece BAR, "align" → alt TF ters yönde kırılım
+# vermemeli, "both" → alt TF de aynı yönde yapı vermeli.
+CONFIRM_BAR = os.getenv("CONFIRM_BAR", "1H")
+MTF_CONFIRM = os.getenv("MTF_CONFIRM", "align")
+# Mum önbelleği açıkken üst zaman dilimleri bu bardan yerelde üretilir
+# (ek REST çağrısı yok). Boş → her bar ayrı çekilir.
+RESAMPLE_FROM = os.getenv("RESAMPLE_FROM", "1H")
+OKX_CANDLES_PAGE_LIMIT = 300      # /market/candles sayfa başına max
+
 # Fiyat yapısı
 STRUCT_LOOKBACK = 20          # MSB ve FVG için bakılacak mum sayısı
+# Tarama turunda BAR / CONFIRM_BAR başına çekilen mum: yapı ve alt TF onayı
+# STRUCT_LOOKBACK + 3 mum ister (indikatörler kendi kalıcı durumuyla ısınır).
+# (60 + 1) × 4 1H mum soğuk önbellekte de tek /candles sayfasına sığar.
+SCAN_CANDLE_LIMIT = 60
 ZONE_BUFFER = 0.002           # %0.2 marj ile bölge (FVG/MSB değerlendirmesinde)
 
 # Strateji modu: 4 koşuldan en az 3'ü
 MIN_CONDITIONS_STRICT = 3
 
+# Orderbook baskısı: bid notional > ask notional * 1.3 (SHORT için tersi)
+OB_IMBALANCE_FACTOR = 1.3
+
 # --- Ek güvenlik parametreleri (senin zarardan bıktığın kısımlar için) ---
 MAX_STRUCTURE_DISTANCE = 0.01     # MSB/FVG seviyesinden max %1 uzaklık
 MAX_WHALE_DISTANCE = 0.008        # Whale fiyatından max %0.8 uzaklık
 MAX_WHALE_AGE_MIN = 240           # Whale işlemi max 240 dakika (4H) eski olabilir
 
+# Order-flow trade kaynağı: "recent" → son TRADES_LIMIT trade (/market/trades),
+# "history" → mevcut barın tamamı (/market/history-trades, sayfalı)
+TRADES_SOURCE = os.getenv("TRADES_SOURCE", "recent")
+HISTORY_TRADES_PAGE_LIMIT = 100   # OKX sayfa başına max 100
+HISTORY_TRADES_MAX_PAGES = int(os.getenv("HISTORY_TRADES_MAX_PAGES", "20"))   # sembol başına sayfa sınırı
+
+# Çalışma metrikleri: her turun JSON raporu + opsiyonel Prometheus textfile (node exporter)
+METRICS_JSON = os.getenv("METRICS_JSON", "metrics/last_run.json")
+PROMETHEUS_TEXTFILE = os.getenv("PROMETHEUS_TEXTFILE", "")      # boş → yazılmaz
+METRICS_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)   # saniye
+
+# Daemon modu (python main.py --daemon): bar kapanışlarına hizalı sıcak döngü
+DAEMON_BARS = os.getenv("DAEMON_BARS", "1H")                  # tetik barları, örn. "1H" veya "4H"
+DAEMON_CLOSE_DELAY = float(os.getenv("DAEMON_CLOSE_DELAY", "2"))   # kapanıştan sonra bekleme (sn)
+UNIVERSE_REFRESH_S = int(os.getenv("UNIVERSE_REFRESH_S", str(6 * 3600)))
+
+# Veri kaynağı: "live" (HTTP), "record" (HTTP + fixture'a yaz), "replay" (sadece fixture'dan)
+DATA_SOURCE_MODE = os.getenv("DATA_SOURCE", "live")
+FIXTURE_PATH = os.getenv("FIXTURE_PATH", "fixtures/scan.json.gz")
+
+# Tur içi istek önbelleği: aynı path+params tek istek (0 → kapalı)
+REQUEST_CACHE_ENABLED = os.getenv("REQUEST_CACHE", "1") != "0"
+
+# Ticker ön filtresi: MSB/FVG mesafesine giremeyecek semboller için trades /
+# orderbook çekilmez (0 → kapalı). Marj: ticker ile mum arası fiyat kayması payı.
+PREFILTER_ENABLED = os.getenv("PREFILTER", "1") != "0"
+PREFILTER_MARGIN = 0.002
+
+# Eşzamanlı tarama: aynı anda analiz edilecek sembol sayısı (1 → eski seri tarama)
+SCAN_WORKERS = int(os.getenv("SCAN_WORKERS", "4"))
+
+# HTTP bağlantı havuzu (keep-alive); HTTP2=1 ve httpx[http2] kuruluysa HTTP/2
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", str(max(10, SCAN_WORKERS * 3))))
+HTTP_KEEPALIVE = os.getenv("HTTP_KEEPALIVE", "1") != "0"
+HTTP2 = os.getenv("HTTP2", "0") == "1"
+
+# Yerel önbellek (mum deposu vs). Workflow bu klasörü actions/cache ile saklar.
+CACHE_DIR = os.getenv("CACHE_DIR", ".cache")
+CANDLE_CACHE_ENABLED = os.getenv("CANDLE_CACHE", "1") != "0"
+CANDLE_CACHE_MAX_BARS = 1000      # sembol/bar başına diskte tutulacak kapanmış mum sayısı
+# Artımlı indikatör durumu (EMA / MACD / ATR / RSI) CACHE_DIR/indicators.json'da;
+# durum yoksa bir kerelik ısınma için bu kadar bar çekilir (OKX /candles en fazla 1440)
+INDICATOR_WARMUP_BARS = int(os.getenv("INDICATOR_WARMUP_BARS", "1000"))
+
+# CoinGecko MCAP önbelleği: TTL dolunca eski veri kullanılır, arkada yenilenir
+MCAP_CACHE_TTL = int(os.getenv("MCAP_CACHE_TTL", str(6 * 3600)))   # saniye
+MCAP_MIN_GOOD_RATIO = 0.5         # yeni çekim eskinin %50'sinden küçükse bozuk say
+
+# WebSocket akış modu (python main.py --stream) — websocket-client gerekli
+OKX_WS_URL = os.getenv("OKX_WS_URL", "wss://ws.okx.com:8443/ws/v5/public")
+OKX_WS_BUSINESS_URL = os.getenv("OKX_WS_BUSINESS_URL", "wss://ws.okx.com:8443/ws/v5/business")  # candle kanalları
+STREAM_BOOK_CHANNEL = os.getenv("STREAM_BOOK_CHANNEL", "books")    # books (400 seviye, checksum) veya books5
+STREAM_RECORD_PATH = os.getenv("STREAM_RECORD_PATH", "")            # ham WS mesajlarını kaydet (gzip JSONL)
+OKX_BOOK_CHECKSUM_LEVELS = 25             # OKX CRC32: her taraftan ilk 25 seviye
+STREAM_WINDOW_MS = 4 * 60 * 60 * 1000     # akışta tutulan trade penceresi (4H)
+STREAM_WARMUP = int(os.getenv("STREAM_WARMUP", "60"))              # ilk taramadan önce bekleme (sn)
+STREAM_SCAN_INTERVAL = int(os.getenv("STREAM_SCAN_INTERVAL", "3600"))
+# Bar kapanışı modu: aynı anda kapanan CONFIRM_BAR mumunun push'u için en fazla bekleme (sn)
+BAR_CLOSE_CONFIRM_WAIT = float(os.getenv("BAR_CLOSE_CONFIRM_WAIT", "0.5"))
+WS_SUBSCRIBE_BATCH = 100                  # tek subscribe mesajındaki kanal sayısı
+WS_PING_INTERVAL = 25                     # OKX 30 sn sessizlikte bağlantıyı keser
+
 
 def ts():
     return datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S UTC")
 
 
+# ------------ Rate Limit (OKX) ------------
+
+# OKX public market uçları: (istek sayısı, saniye) — IP bazlı limitler
+OKX_RATE_LIMITS = {
+    "/api/v5/market/candles": (40, 2.0),
+    "/api/v5/market/trades": (100, 2.0),
+    "/api/v5/market/books": (40, 2.0),
+    "/api/v5/market/tickers": (20, 2.0),
+    "/api/v5/market/history-trades": (20, 2.0),
+}
+OKX_DEFAULT_RATE_LIMIT = (20, 2.0)
+RATE_LIMIT_SAFETY = 0.9           # limitin %90'ı kadar kullan
+RATE_BACKOFF_BASE = 1.0           # 429 / 50011 sonrası ilk bekleme (sn)
+RATE_BACKOFF_MAX = 16.0
+
+
+class TokenBucket:
+    """
+    Basit token bucket: saniyede `rate` token dolar, en fazla `capacity` birikir
+    (burst). acquire() token yoksa bekler; backoff aktifse onu da bekler.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.backoff = 0.0
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        """Token alınana kadar bekler, beklenen süreyi (sn) döndürür."""
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now < self.blocked_until:
+                    delay = self.blocked_until - now
+                elif self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                else:
+                    delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+    def penalize(self):
+        """429 / 50011 görüldü → üstel backoff, biriken burst sıfırlanır."""
+        with self.lock:
+            self.backoff = min(RATE_BACKOFF_MAX, self.backoff * 2 or RATE_BACKOFF_BASE)
+            self.blocked_until = time.monotonic() + self.backoff
+            self.tokens = 0.0
+            return self.backoff
+
+    def reward(self):
+        with self.lock:
+            self.backoff = 0.0
+
+
+class RateLimiter:
+    """
+    Uç bazlı token bucket'lar + sayaçlar. Tüm thread'ler tek örneği paylaşır.
+    """
+
+    def __init__(self, limits=OKX_RATE_LIMITS, default=OKX_DEFAULT_RATE_LIMIT, safety=RATE_LIMIT_SAFETY):
+        self.limits = limits
+        self.default = default
+        self.safety = safety
+        self.buckets = {}
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    def _bucket(self, path):
+        with self.lock:
+            b = self.buckets.get(path)
+            if b is None:
+                count, per = self.limits.get(path, self.default)
+                capacity = max(1.0, count * self.safety)
+                b = TokenBucket(capacity / per, capacity)
+                self.buckets[path] = b
+                self.counters[path] = {"requests": 0, "waits": 0, "wait_s": 0.0, "throttled": 0}
+            return b
+
+    def acquire(self, path):
+        """Token alınana kadar bekler, beklenen süreyi (sn) döndürür."""
+        b = self._bucket(path)
+        waited = b.acquire()
+        with self.lock:
+            c = self.counters[path]
+            c["requests"] += 1
+            if waited > 0:
+                c["waits"] += 1
+                c["wait_s"] += waited
+        return waited
+
+    def penalize(self, path):
+        delay = self._bucket(path).penalize()
+        with self.lock:
+            self.counters[path]["throttled"] += 1
+        return delay
+
+    def reward(self, path):
+        self._bucket(path).reward()
+
+    def stats(self):
+        with self.lock:
+            return {p: dict(c) for p, c in self.counters.items()}
+
+    def stats_line(self):
+        parts = []
+        for path, c in sorted(self.stats().items()):
+            name = path.rsplit("/", 1)[-1]
+            parts.append(
+                f"{name}: {c['requests']} istek, {c['waits']} bekleme ({c['wait_s']:.1f}s), {c['throttled']} throttle"
+            )
+        return "Rate limit → " + (" | ".join(parts) if parts else "istek yok")
+
+
+OKX_LIMITER = RateLimiter()
+
+
+# ------------ HTTP Bağlantı Havuzu ------------
+
+class HttpPool:
+    """
+    Tüm HTTP çağrıları için paylaşılan oturum (keep-alive + bağlantı havuzu).
+    Varsayılan requests.Session; HTTP2 açıksa ve httpx kuruluysa httpx.Client.
+    stats() → istek / yeni bağlantı / yeniden kullanım sayıları.
+    """
+
+    def __init__(self, pool_size=HTTP_POOL_SIZE, keepalive=HTTP_KEEPALIVE, http2=HTTP2):
+        self.pool_size = pool_size
+        self.keepalive = keepalive
+        self.http2 = False
+        self.requests = 0
+        self.lock = threading.Lock()
+        self.client = None
+
+        if http2:
+            try:
+                import httpx
+                self.client = httpx.Client(
+                    http2=True,
+                    limits=httpx.Limits(
+                        max_connections=pool_size,
+                        max_keepalive_connections=pool_size if keepalive else 0,
+                    ),
+                )
+                self.http2 = True
+            except Exception as e:
+                print("⚠ HTTP/2 açılamadı (httpx[http2] gerekli), HTTP/1.1 ile devam:", e)
+
+        if self.client is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, pool_block=True)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            if not keepalive:
+                session.headers["Connection"] = "close"
+            self.client = session
+            self._adapter = adapter
+
+    def _count(self):
+        with self.lock:
+            self.requests += 1
+
+    def get(self, url, params=None, timeout=10):
+        self._count()
+        return self.client.get(url, params=params, timeout=timeout)
+
+    def post(self, url, data=None, timeout=10):
+        self._count()
+        return self.client.post(url, data=data, timeout=timeout)
+
+    def connections_opened(self):
+        """Açılan toplam bağlantı sayısı (bilinmiyorsa None)."""
+        if self.http2:
+            pool = getattr(getattr(self.client, "_transport", None), "_pool", None)
+            conns = getattr(pool, "connections", None)
+            return len(conns) if conns is not None else None
+        pools = self._adapter.poolmanager.pools
+        total = 0
+        for key in pools.keys():
+            try:
+                total += pools[key].num_connections
+            except KeyError:
+                continue
+        return total
+
+    def stats(self):
+        opened = self.connections_opened()
+        reused = (self.requests - opened) if opened is not None else None
+        return {
+            "protocol": "HTTP/2" if self.http2 else "HTTP/1.1",
+            "requests": self.requests,
+            "connections": opened,
+            "reused": reused,
+        }
+
+    def stats_line(self):
+        st = self.stats()
+        conn = "?" if st["connections"] is None else st["connections"]
+        reused = "?" if st["reused"] is None else st["reused"]
+        return f"HTTP ({st['protocol']}) → {st['requests']} istek, {conn} bağlantı, {reused} yeniden kullanım"
+
+    def close(self):
+        self.client.close()
+
+
+HTTP = HttpPool()
+
+
+# ------------ Metrikler ------------
+
+class Histogram:
+    """Prometheus uyumlu kümülatif histogram (sum / count / bucket)."""
+
+    def __init__(self, buckets=METRICS_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, v):
+        self.sum += v
+        self.count += 1
+        for i, b in enumerate(self.buckets):
+            if v <= b:
+                self.counts[i] += 1
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "avg": self.sum / self.count if self.count else None,
+            "buckets": {str(b): c for b, c in zip(self.buckets, self.counts)},
+        }
+
+
+class Metrics:
+    """
+    Tur başına metrikler: uç bazlı ağ gecikmesi (deneme başına, sadece HTTP
+    çağrısı) ve rate limiter bekleme histogramları, retry / byte sayaçları,
+    parse süreleri, sembol başına analiz süresi, aşama süreleri ve
+    analyze_symbol değerlendirme aşamalarının geçti / kaldı sayıları.
+    write_json() → JSON rapor, write_prometheus() → textfile collector dosyası.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.started = time.time()
+            self.latency = {}
+            self.limiter_wait = {}
+            self.requests = {}
+            self.retries = {}
+            self.failures = {}
+            self.bytes = {}
+            self.parse = {}
+            self.symbols = {}
+            self.analysis = Histogram((0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0))
+            self.stages = {}
+            self.gates = {}
+            self.gauges = {}
+
+    def observe_request(self, endpoint, latencies, nbytes, retries, ok, limiter_wait=None):
+        """
+        latencies: deneme başına sadece HTTP çağrısının süresi (limiter
+        beklemesi ve retry arası uyku hariç); limiter_wait: toplam limiter beklemesi.
+        """
+        with self.lock:
+            hist = self.latency.setdefault(endpoint, Histogram())
+            for seconds in latencies:
+                hist.observe(seconds)
+            if limiter_wait is not None:
+                self.limiter_wait.setdefault(endpoint, Histogram()).observe(limiter_wait)
+            self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+            self.retries[endpoint] = self.retries.get(endpoint, 0) + retries
+            self.bytes[endpoint] = self.bytes.get(endpoint, 0) + nbytes
+            if not ok:
+                self.failures[endpoint] = self.failures.get(endpoint, 0) + 1
+
+    def observe_parse(self, kind, seconds):
+        with self.lock:
+            self.parse[kind] = self.parse.get(kind, 0.0) + seconds
+
+    def observe_symbol(self, inst_id, seconds):
+        with self.lock:
+            self.symbols[inst_id] = seconds
+            self.analysis.observe(seconds)
+
+    def observe_gate(self, name, passed):
+        """Değerlendirme aşaması sonucu; passed'ı aynen döndürür."""
+        passed = bool(passed)
+        with self.lock:
+            g = self.gates.setdefault(name, {"pass": 0, "fail": 0})
+            g["pass" if passed else "fail"] += 1
+        return passed
+
+    def gates_line(self):
+        with self.lock:
+            gates = {k: dict(v) for k, v in self.gates.items()}
+        if not gates:
+            return "Değerlendirme aşamaları → veri yok"
+        parts = [f"{name} {g['pass']}/{g['pass'] + g['fail']}" for name, g in gates.items()]
+        # trades / book çağrısı yapılmadan elenen semboller
+        saved_trades = gates.get("candles", {}).get("fail", 0) + gates.get("structure", {}).get("fail", 0)
+        saved_book = (saved_trades + gates.get("trades", {}).get("fail", 0)
+                      - gates.get("book_prefetch", {}).get("fail", 0))
+        return (
+            f"Değerlendirme aşamaları (geçen/giren) → {', '.join(parts)}; "
+            f"kaçınılan çağrı: {saved_trades} trades, {saved_book} orderbook"
+        )
+
+    def set_gauge(self, name, value):
+        with self.lock:
+            self.gauges[name] = value
+
+    @contextmanager
+    def stage(self, name):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - t0
+
+    def report(self):
+        with self.lock:
+            slowest = sorted(self.symbols.items(), key=lambda x: x[1], reverse=True)[:10]
+            return {
+                "started": datetime.fromtimestamp(self.started, timezone.utc).isoformat(),
+                "duration_s": time.time() - self.started,
+                "stages_s": dict(self.stages),
+                "eval_gates": {k: dict(v) for k, v in self.gates.items()},
+                "http": {
+                    ep: {
+                        "requests": self.requests[ep],
+                        "retries": self.retries.get(ep, 0),
+                        "failures": self.failures.get(ep, 0),
+                        "bytes": self.bytes.get(ep, 0),
+                        "latency_s": self.latency[ep].to_dict(),
+                        "limiter_wait_s": self.limiter_wait[ep].to_dict() if ep in self.limiter_wait else None,
+                    }
+                    for ep in sorted(self.requests)
+                },
+                "parse_s": dict(self.parse),
+                "analysis_s": self.analysis.to_dict(),
+                "slowest_symbols_s": dict(slowest),
+                "gauges": dict(self.gauges),
+                "rate_limit": OKX_LIMITER.stats(),
+                "connections": HTTP.stats(),
+            }
+
+    def write_json(self, path=None):
+        path = METRICS_JSON if path is None else path
+        if not path:
+            return
+        try:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            with open(path, "w") as f:
+                json.dump(self.report(), f, indent=2, ensure_ascii=False)
+        except Exception as e:
+            print("Metrik raporu yazılamadı:", e)
+
+    def prometheus_text(self):
+        rep = self.report()
+        out = []
+
+        def metric(name, mtype, help_txt):
+            out.append(f"# HELP {name} {help_txt}")
+            out.append(f"# TYPE {name} {mtype}")
+
+        def hist(name, labels, h):
+            lbl = f"{labels}," if labels else ""
+            for b, c in h["buckets"].items():
+                out.append(f'{name}_bucket{{{lbl}le="{b}"}} {c}')
+            out.append(f'{name}_bucket{{{lbl}le="+Inf"}} {h["count"]}')
+            wrap = f"{{{labels}}}" if labels else ""
+            out.append(f"{name}_sum{wrap} {h['sum']}")
+            out.append(f"{name}_count{wrap} {h['count']}")
+
+        metric("radar_http_request_seconds", "histogram", "HTTP deneme başına ağ gecikmesi")
+        for ep, h in rep["http"].items():
+            hist("radar_http_request_seconds", f'endpoint="{ep}"', h["latency_s"])
+        metric("radar_http_limiter_wait_seconds", "histogram", "İstek başına rate limiter beklemesi")
+        for ep, h in rep["http"].items():
+            if h["limiter_wait_s"]:
+                hist("radar_http_limiter_wait_seconds", f'endpoint="{ep}"', h["limiter_wait_s"])
+        for key, name, help_txt in (
+            ("retries", "radar_http_retries_total", "Tekrar denenen istek sayısı"),
+            ("failures", "radar_http_failures_total", "Başarısız istek sayısı"),
+            ("bytes", "radar_http_bytes_total", "İndirilen byte"),
+        ):
+            metric(name, "counter", help_txt)
+            for ep, h in rep["http"].items():
+                out.append(f'{name}{{endpoint="{ep}"}} {h[key]}')
+
+        metric("radar_parse_seconds_total", "counter", "Yanıt parse süresi")
+        for kind, v in rep["parse_s"].items():
+            out.append(f'radar_parse_seconds_total{{kind="{kind}"}} {v}')
+        metric("radar_symbol_analysis_seconds", "histogram", "Sembol başına analiz süresi")
+        hist("radar_symbol_analysis_seconds", "", rep["analysis_s"])
+        metric("radar_stage_seconds", "gauge", "Son turda aşama süreleri")
+        for st, v in rep["stages_s"].items():
+            out.append(f'radar_stage_seconds{{stage="{st}"}} {v}')
+        metric("radar_eval_gate_total", "counter", "analyze_symbol aşama sonuçları")
+        for gate, g in rep["eval_gates"].items():
+            for result, v in g.items():
+                out.append(f'radar_eval_gate_total{{gate="{gate}",result="{result}"}} {v}')
+        for name, v in rep["gauges"].items():
+            metric(f"radar_{name}", "gauge", name)
+            out.append(f"radar_{name} {v}")
+        metric("radar_last_run_timestamp_seconds", "gauge", "Son tur başlangıcı")
+        out.append(f"radar_last_run_timestamp_seconds {self.started}")
+        return "\n".join(out) + "\n"
+
+    def write_prometheus(self, path=None):
+        path = PROMETHEUS_TEXTFILE if path is None else path
+        if not path:
+            return
+        try:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            tmp = f"{path}.tmp"
+            with open(tmp, "w") as f:
+                f.write(self.prometheus_text())
+            os.replace(tmp, path)   # node exporter yarım dosya görmesin
+        except Exception as e:
+            print("Prometheus dosyası yazılamadı:", e)
+
+
+METRICS = Metrics()
+
+
+def endpoint_label(url):
+    """Metrik etiketi: host + yol (query hariç)."""
+    u = urlparse(url)
+    return f"{u.netloc}{u.path}"
+
+
 # ------------ HTTP Yardımcıları ------------
 
-def jget_okx(path, params=None, retries=3, timeout=10):
+def _timed_get(url, params, timeout, latencies):
+    """HTTP.get; sadece ağ süresi latencies'e eklenir (hata / timeout dahil)."""
+    t0 = time.perf_counter()
+    try:
+        return HTTP.get(url, params=params, timeout=timeout)
+    finally:
+        latencies.append(time.perf_counter() - t0)
+
+
+def http_get_okx(path, params=None, retries=3, timeout=10):
     url = f"{OKX_BASE}{path}"
+    latencies = []
+    waited = 0.0
+    nbytes = 0
+    attempts = 0
+    result = None
     for _ in range(retries):
+        attempts += 1
+        waited += OKX_LIMITER.acquire(path)
         try:
-            r = requests.get(url, params=params, timeout=timeout)
+            r = _timed_get(url, params, timeout, latencies)
+            nbytes += len(r.content)
+            if r.status_code == 429:
+                OKX_LIMITER.penalize(path)
+                continue
             if r.status_code == 200:
                 j = r.json()
+                if j.get("code") == "50011":  # Too Many Requests
+                    OKX_LIMITER.penalize(path)
+                    continue
+                OKX_LIMITER.reward(path)
                 if j.get("code") == "0" and j.get("data"):
-                    return j["data"]
+                    result = j["data"]
+                    break
         except Exception:
             time.sleep(0.5)
-    return None
+    METRICS.observe_request(path, latencies, nbytes, attempts - 1, result is not None, waited)
+    return result
 
 
-def jget_json(url, params=None, retries=3, timeout=10):
+def http_get_json(url, params=None, retries=3, timeout=10):
     """Genel amaçlı JSON GET (CoinGecko vs)"""
+    latencies = []
+    nbytes = 0
+    attempts = 0
+    result = None
     for _ in range(retries):
+        attempts += 1
         try:
-            r = requests.get(url, params=params, timeout=timeout)
+            r = _timed_get(url, params, timeout, latencies)
+            nbytes += len(r.content)
             if r.status_code == 200:
-                return r.json()
+                result = r.json()
+                break
         except Exception:
             time.sleep(0.5)
-    return None
+    METRICS.observe_request(endpoint_label(url), latencies, nbytes, attempts - 1, result is not None)
+    return result
+
+
+# ------------ Veri Kaynakları (live / record / replay) ------------
+
+def request_key(target, params=None):
+    """Fixture anahtarı: yol/URL + sıralı parametreler."""
+    if not params:
+        return target
+    return f"{target}?{urlencode(sorted((k, str(v)) for k, v in params.items()))}"
+
+
+class LiveSource:
+    """Canlı OKX / CoinGecko HTTP çağrıları."""
+
+    offline = False
+
+    def okx(self, path, params=None, retries=3, timeout=10):
+        return http_get_okx(path, params, retries, timeout)
+
+    def json(self, url, params=None, retries=3, timeout=10):
+        return http_get_json(url, params, retries, timeout)
+
+    def stats_line(self):
+        return "Veri kaynağı → live"
+
+
+class RecordingSource(LiveSource):
+    """
+    Canlı çağrıları yapar, yanıtları (başarısızlar dahil) hafızada toplar;
+    save() ile gzip'li JSON fixture dosyasına yazar.
+    """
+
+    def __init__(self, path=FIXTURE_PATH):
+        self.path = path
+        self.records = {"okx": {}, "json": {}}
+        self.lock = threading.Lock()
+
+    def okx(self, path, params=None, retries=3, timeout=10):
+        data = http_get_okx(path, params, retries, timeout)
+        with self.lock:
+            self.records["okx"][request_key(path, params)] = data
+        return data
+
+    def json(self, url, params=None, retries=3, timeout=10):
+        data = http_get_json(url, params, retries, timeout)
+        with self.lock:
+            self.records["json"][request_key(url, params)] = data
+        return data
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with self.lock:
+            payload = {"version": 1, "recorded_at": ts(), **self.records}
+        with gzip.open(self.path, "wt", encoding="utf-8") as f:
+            json.dump(payload, f, separators=(",", ":"))
+
+    def stats_line(self):
+        n = len(self.records["okx"]) + len(self.records["json"])
+        return f"Veri kaynağı → record ({n} yanıt → {self.path})"
+
+
+class ReplaySource:
+    """Sadece fixture dosyasından okur; ağ yok, kayıtta olmayan istek → None."""
+
+    offline = True
+
+    def __init__(self, path=FIXTURE_PATH, records=None):
+        self.path = path
+        if records is None:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                records = json.load(f)
+        self.records = {"okx": records.get("okx", {}), "json": records.get("json", {})}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def _get(self, kind, key):
+        table = self.records[kind]
+        with self.lock:
+            if key in table:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return table.get(key)
+
+    def okx(self, path, params=None, retries=3, timeout=10):
+        return self._get("okx", request_key(path, params))
+
+    def json(self, url, params=None, retries=3, timeout=10):
+        return self._get("json", request_key(url, params))
+
+    def stats_line(self):
+        return f"Veri kaynağı → replay ({self.path}: {self.hits} kayıt bulundu, {self.misses} eksik)"
+
+
+def make_data_source(mode=DATA_SOURCE_MODE, path=FIXTURE_PATH):
+    if mode == "record":
+        return RecordingSource(path)
+    if mode == "replay":
+        return ReplaySource(path)
+    return LiveSource()
+
+
+DATA_SOURCE = LiveSource()
+
+
+def use_data_source(mode, path=FIXTURE_PATH):
+    """
+    Veri kaynağını değiştirir. record / replay modlarında istekler zamana
+    bağlı olmamalı: mum önbelleği, MCAP disk önbelleği ve kalıcı indikatör
+    durumu devre dışı kalır, böylece kayıt ve tekrar aynı istekleri yapar.
+    """
+    global DATA_SOURCE, CANDLE_STORE, MCAP_CACHE, INDICATORS
+    DATA_SOURCE = make_data_source(mode, path)
+    if mode in ("record", "replay"):
+        CANDLE_STORE = None
+        MCAP_CACHE = DirectMcapSource()
+        INDICATORS = IndicatorStore(path=None)
+    return DATA_SOURCE
+
+
+class RequestCache:
+    """
+    Tur içi OKX yanıt önbelleği. Sadece scope() içinde aktiftir; anahtar
+    request_key(path, params). Aynı anda gelen aynı istekler tek HTTP
+    çağrısını bekler (in-flight birleştirme). Başarısız (None) yanıtlar
+    saklanmaz, sonraki çağrı yeniden dener.
+    Dönen yanıtlar paylaşılır, çağıranlar değiştirmemelidir.
+    """
+
+    def __init__(self, enabled=REQUEST_CACHE_ENABLED):
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.depth = 0
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.generation = 0     # her yeni tur +1 (başka önbellekler tur kimliği olarak kullanır)
+
+    @property
+    def active(self):
+        return self.enabled and self.depth > 0
+
+    @contextmanager
+    def scope(self):
+        with self.lock:
+            if self.depth == 0:
+                self.entries = {}
+                self.hits = self.misses = self.coalesced = 0
+                self.generation += 1
+            self.depth += 1
+        try:
+            yield self
+        finally:
+            with self.lock:
+                self.depth -= 1
+                if self.depth == 0:
+                    self.entries = {}
+
+    def get(self, path, params, fetch):
+        key = request_key(path, params)
+        with self.lock:
+            fut = self.entries.get(key)
+            owner = fut is None
+            if owner:
+                fut = self.entries[key] = Future()
+                self.misses += 1
+            else:
+                self.hits += 1
+                if not fut.done():
+                    self.coalesced += 1
+
+        if not owner:
+            return fut.result()
+
+        try:
+            data = fetch()
+        except BaseException as e:
+            with self.lock:
+                self.entries.pop(key, None)
+            fut.set_exception(e)
+            raise
+        if data is None:
+            with self.lock:
+                self.entries.pop(key, None)
+        fut.set_result(data)
+        return data
+
+    def stats_line(self):
+        total = self.hits + self.misses
+        ratio = self.hits / total if total else 0.0
+        return (
+            f"İstek önbelleği → {self.hits} isabet ({self.coalesced} eşzamanlı birleşti), "
+            f"{self.misses} ıska (%{ratio * 100:.0f} isabet)"
+        )
+
+
+REQUEST_CACHE = RequestCache()
+
+
+def jget_okx(path, params=None, retries=3, timeout=10):
+    if REQUEST_CACHE.active:
+        return REQUEST_CACHE.get(path, params, lambda: DATA_SOURCE.okx(path, params, retries, timeout))
+    return DATA_SOURCE.okx(path, params, retries, timeout)
+
+
+def jget_json(url, params=None, retries=3, timeout=10):
+    """Genel amaçlı JSON GET (CoinGecko vs) — aktif veri kaynağı üzerinden."""
+    return DATA_SOURCE.json(url, params, retries, timeout)
 
 
 def telegram(msg: str):
-    if not TELEGRAM_TOKEN or not CHAT_ID:
-        print("⚠ TELEGRAM_TOKEN veya CHAT_ID yok, mesaj gönderemem.")
+    if not TELEGRAM_TOKEN or not CHAT_ID or DATA_SOURCE.offline:
+        print("⚠ TELEGRAM_TOKEN / CHAT_ID yok veya replay modu, mesaj gönderilmiyor.")
         print("--- Mesaj içeriği ---")
         print(msg)
         print("---------------------")
@@ -72,7 +863,7 @@ def telegram(msg: str):
     url = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/sendMessage"
     payload = {"chat_id": CHAT_ID, "text": msg, "parse_mode": "Markdown"}
     try:
-        r = requests.post(url, data=payload, timeout=10)
+        r = HTTP.post(url, data=payload, timeout=10)
         if r.status_code != 200:
             print("Telegram hata:", r.text)
     except Exception as e:
@@ -83,10 +874,12 @@ def telegram(msg: str):
 
 def load_mcap_map(max_pages: int = 2):
     """
-    CoinGecko /coins/markets → symbol -> market_cap map
+    CoinGecko /coins/markets → (symbol -> market_cap map, complete)
     En yüksek mcap'i olan symbol kazanır (aynı sembolü kullananlar için).
+    complete=False: bir sayfa alınamadı (harita eksik; boş sayfa = veri sonu).
     """
     mcap_map = {}
+    complete = True
     for page in range(1, max_pages + 1):
         data = jget_json(
             f"{COINGECKO_BASE}/coins/markets",
@@ -98,6 +891,9 @@ def load_mcap_map(max_pages: int = 2):
                 "sparkline": "false",
             },
         )
+        if data is None:
+            complete = False
+            break
         if not data:
             break
         for row in data:
@@ -107,14 +903,11 @@ def load_mcap_map(max_pages: int = 2):
                 continue
             if sym not in mcap_map or mc > mcap_map[sym]:
                 mcap_map[sym] = mc
-    return mcap_map
+    return mcap_map, complete
 
 
-def classify_mcap(base: str, mcap_map: dict):
-    """
-    HIGH / MID / LOW / MICRO sınıflandırması
-    """
-    mc = mcap_map.get(base.upper())
+def mcap_class_of(mc):
+    """Ham market cap → HIGH / MID / LOW / MICRO (None → UNKNOWN)."""
     if mc is None:
         return "UNKNOWN"
     if mc >= 10_000_000_000:
@@ -126,37 +919,163 @@ def classify_mcap(base: str, mcap_map: dict):
     return "MICRO"
 
 
+class McapIndex(dict):
+    """
+    symbol -> market_cap map'i (dict gibi davranır) + önceden hesaplanmış
+    symbol -> sınıf indeksi. classify_mcap bunu görürse O(1) sözlük bakışı yapar.
+    """
+
+    def __init__(self, caps=None, fetched_at=None):
+        super().__init__(caps or {})
+        self.fetched_at = fetched_at
+        self.classes = {sym: mcap_class_of(mc) for sym, mc in self.items()}
+
+
+def classify_mcap(base: str, mcap_map: dict):
+    """
+    HIGH / MID / LOW / MICRO sınıflandırması
+    """
+    classes = getattr(mcap_map, "classes", None)
+    if classes is not None:
+        return classes.get(base.upper(), "UNKNOWN")
+    return mcap_class_of(mcap_map.get(base.upper()))
+
+
+# MCAP sınıfı → (S, M, X) whale eşikleri; S: orta, M: büyük, X: süper whale
+WHALE_THRESHOLDS = {
+    "HIGH": (500_000, 1_000_000, 1_500_000),   # BTC, ETH, BNB, SOL, XRP...
+    "MID": (200_000, 400_000, 800_000),        # AVAX, LINK, TON, ARB, SUI, HBAR...
+    "LOW": (100_000, 200_000, 400_000),        # 100M–1B arası
+}
+WHALE_THRESHOLDS_DEFAULT = (80_000, 150_000, 300_000)   # MICRO / UNKNOWN → biraz daha düşük
+
+# MCAP sınıfı → (pozitif, negatif) net delta eşikleri
+NET_DELTA_THRESHOLDS = {
+    "HIGH": (200_000, -200_000),
+    "MID": (100_000, -100_000),
+    "LOW": (50_000, -50_000),
+}
+NET_DELTA_THRESHOLDS_DEFAULT = (30_000, -30_000)
+
+
 def whale_thresholds(mcap_class: str):
     """
     MCAP sınıfına göre S/M/X whale eşikleri
     S: orta, M: büyük, X: süper whale
     """
-    if mcap_class == "HIGH":
-        # BTC, ETH, BNB, SOL, XRP...
-        return 500_000, 1_000_000, 1_500_000
-    elif mcap_class == "MID":
-        # AVAX, LINK, TON, ARB, SUI, HBAR...
-        return 200_000, 400_000, 800_000
-    elif mcap_class == "LOW":
-        # 100M–1B arası
-        return 100_000, 200_000, 400_000
-    else:
-        # MICRO / UNKNOWN → biraz daha düşük
-        return 80_000, 150_000, 300_000
+    return WHALE_THRESHOLDS.get(mcap_class, WHALE_THRESHOLDS_DEFAULT)
 
 
 def net_delta_thresholds(mcap_class: str):
     """
     Net delta eşikleri (MCAP'e göre ölçekli)
     """
-    if mcap_class == "HIGH":
-        return 200_000, -200_000
-    elif mcap_class == "MID":
-        return 100_000, -100_000
-    elif mcap_class == "LOW":
-        return 50_000, -50_000
-    else:
-        return 30_000, -30_000
+    return NET_DELTA_THRESHOLDS.get(mcap_class, NET_DELTA_THRESHOLDS_DEFAULT)
+
+
+class McapCache:
+    """
+    CoinGecko MCAP haritası için disk önbelleği (CACHE_DIR/mcap.json).
+    - TTL içinde: diskteki snapshot kullanılır, istek atılmaz
+    - TTL dolmuş: eski snapshot hemen döner, arkada yenilenir (stale-while-revalidate)
+    - Snapshot yok: senkron çekilir
+    - Çekim başarısız / eksikse (bir sayfa bile alınamadıysa): son iyi
+      snapshot korunur; snapshot hiç yoksa eksik harita diske yazılmadan
+      kullanılır ve bir sonraki get() yeniden dener
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, ttl=MCAP_CACHE_TTL):
+        self.path = os.path.join(cache_dir, "mcap.json")
+        self.ttl = ttl
+        self.index = None
+        self.lock = threading.Lock()
+        self.refresh_thread = None
+
+    def _load_snapshot(self):
+        try:
+            with open(self.path) as f:
+                snap = json.load(f)
+            return McapIndex(snap["mcap"], snap["fetched_at"])
+        except Exception:
+            return None
+
+    def _save_snapshot(self, index):
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp = f"{self.path}.tmp"
+            with open(tmp, "w") as f:
+                json.dump({"fetched_at": index.fetched_at, "mcap": dict(index)}, f, separators=(",", ":"))
+            os.replace(tmp, self.path)
+        except Exception as e:
+            print("MCAP snapshot yazılamadı:", e)
+
+    def refresh(self):
+        """CoinGecko'dan çeker; iyi ise indeksi ve snapshot'ı günceller."""
+        caps, complete = load_mcap_map()
+        old = self.index
+        if old and (not complete or not caps or len(caps) < len(old) * MCAP_MIN_GOOD_RATIO):
+            print(f"⚠ MCAP yenilenemedi ({len(caps)} sembol, eksik sayfa: {not complete}), "
+                  f"son iyi snapshot kullanılıyor.")
+            return old
+        if not caps:
+            return old
+        if not complete:
+            # ilk çekim eksik: bellekte kullan, kalıcı yazma; fetched_at=0 → sonraki get() yeniler
+            print(f"⚠ MCAP eksik çekildi ({len(caps)} sembol), snapshot yazılmıyor.")
+            index = McapIndex(caps, 0)
+            with self.lock:
+                self.index = index
+            return index
+        index = McapIndex(caps, time.time())
+        with self.lock:
+            self.index = index
+        self._save_snapshot(index)
+        return index
+
+    def _refresh_in_background(self):
+        with self.lock:
+            if self.refresh_thread and self.refresh_thread.is_alive():
+                return
+            self.refresh_thread = threading.Thread(target=self.refresh, daemon=True)
+            self.refresh_thread.start()
+
+    def get(self):
+        with self.lock:
+            index = self.index
+        if index is None:
+            index = self._load_snapshot()
+            with self.lock:
+                self.index = index
+
+        if index is None:
+            index = self.refresh()
+            if index is None:
+                print("⚠ MCAP verisi yok, tüm coinler UNKNOWN sayılacak.")
+                return McapIndex()
+            return index
+
+        if time.time() - index.fetched_at > self.ttl:
+            self._refresh_in_background()
+        return index
+
+    def wait(self, timeout=None):
+        """Arkadaki yenileme bitene kadar bekler (tek seferlik çalıştırmalar için)."""
+        t = self.refresh_thread
+        if t is not None:
+            t.join(timeout)
+
+
+class DirectMcapSource:
+    """Önbelleksiz MCAP: her get() load_mcap_map çağırır (record / replay için)."""
+
+    def get(self):
+        return McapIndex(load_mcap_map()[0], time.time())
+
+    def wait(self, timeout=None):
+        pass
+
+
+MCAP_CACHE = McapCache()
 
 
 def mcap_nice_label(mcap_class: str):
@@ -173,20 +1092,25 @@ def mcap_nice_label(mcap_class: str):
 
 # ------------ OKX Yardımcıları ------------
 
+def get_spot_usdt_tickers():
+    """OKX SPOT tickers → {instId: ticker dict} (sadece USDT pariteleri)."""
+    data = jget_okx("/api/v5/market/tickers", {"instType": "SPOT"})
+    if not data:
+        return {}
+    return {d.get("instId", ""): d for d in data if d.get("instId", "").endswith("-USDT")}
+
+
 def get_spot_usdt_top_symbols(limit=TOP_LIMIT):
     """
     OKX SPOT tickers → USDT pariteleri içinden en yüksek 24h notional hacme göre ilk 150'yi alır.
     instId formatı: BTC-USDT, HBAR-USDT vs.
     """
-    data = jget_okx("/api/v5/market/tickers", {"instType": "SPOT"})
-    if not data:
+    tickers = get_spot_usdt_tickers()
+    if not tickers:
         return []
 
     rows = []
-    for d in data:
-        inst_id = d.get("instId", "")
-        if not inst_id.endswith("-USDT"):
-            continue
+    for inst_id, d in tickers.items():
         volCcy24h = d.get("volCcy24h")  # quote currency volume
         try:
             vol_quote = float(volCcy24h)
@@ -199,17 +1123,21 @@ def get_spot_usdt_top_symbols(limit=TOP_LIMIT):
     return symbols
 
 
-def get_candles(inst_id, bar=BAR, limit=CANDLE_LIMIT):
-    data = jget_okx("/api/v5/market/candles", {"instId": inst_id, "bar": bar, "limit": limit})
-    if not data:
-        return []
+def bar_to_ms(bar):
+    """OKX bar string'i → milisaniye ("15m", "1H", "4H", "1D", "1W")."""
+    units = {"m": 60_000, "H": 3_600_000, "D": 86_400_000, "W": 604_800_000}
+    return int(bar[:-1]) * units[bar[-1]]
 
-    # OKX en yeni mum en üstte verir → kronolojik sıraya çevirelim
-    data = list(reversed(data))
 
+def parse_candle_rows(data):
+    """
+    OKX candle satırları (en yeni en üstte) → kronolojik dict listesi.
+    Dönüş: (candles, confirmed) — confirmed[i] False ise mum hâlâ oluşuyor.
+    """
     candles = []
-    for row in data:
-        # [ts, o, h, l, c, vol, volCcy, ...]
+    confirmed = []
+    for row in reversed(data):
+        # [ts, o, h, l, c, vol, volCcy, volCcyQuote, confirm]
         try:
             ts_ms = int(row[0])
             o = float(row[1])
@@ -227,7 +1155,251 @@ def get_candles(inst_id, bar=BAR, limit=CANDLE_LIMIT):
                 "close": c,
             }
         )
-    return candles
+        confirmed.append(row[8] != "0" if len(row) > 8 else True)
+
+    # confirm alanı yoksa en yeni mum oluşuyor kabul edilir
+    if confirmed and not any(len(r) > 8 for r in data):
+        confirmed[-1] = False
+    return candles, confirmed
+
+
+def fetch_candles(inst_id, bar=BAR, limit=CANDLE_LIMIT, before=None):
+    """
+    limit > OKX_CANDLES_PAGE_LIMIT ise eski sayfalar after=en_eski_ts ile
+    geriye doğru çekilip birleştirilir.
+    """
+    params = {"instId": inst_id, "bar": bar, "limit": min(limit, OKX_CANDLES_PAGE_LIMIT)}
+    if before is not None:
+        params["before"] = before
+    data = jget_okx("/api/v5/market/candles", params)
+    if not data:
+        return None
+
+    rows = list(data)
+    while before is None and len(rows) < limit and len(data) == params["limit"]:
+        page = {
+            "instId": inst_id,
+            "bar": bar,
+            "limit": min(limit - len(rows), OKX_CANDLES_PAGE_LIMIT),
+            "after": rows[-1][0],
+        }
+        data = jget_okx("/api/v5/market/candles", page)
+        if not data:
+            break
+        rows.extend(data)
+        params = page
+
+    t0 = time.perf_counter()
+    parsed = parse_candle_rows(rows)
+    METRICS.observe_parse("candles", time.perf_counter() - t0)
+    return parsed
+
+
+class CandleCache:
+    """
+    (instId, bar) → kapanmış mumlar. Diskte CACHE_DIR/candles altında saklanır.
+    Oluşmakta olan son mum asla kalıcı yazılmaz, her çağrıda yeniden çekilir.
+    İlk çağrıda tam (limit) çekim, sonrasında sadece son kapanmış ts'den
+    yeni mumlar (before=ts) istenir ve birleştirilir.
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, max_bars=CANDLE_CACHE_MAX_BARS):
+        self.dir = os.path.join(cache_dir, "candles")
+        self.max_bars = max_bars
+        self.mem = {}
+        self.fresh = {}     # (instId, bar) → (tur, limit, mumlar): aynı turda tekrar çekme
+        self.lock = threading.Lock()
+        self.stats = {"full": 0, "incremental": 0, "bars_fetched": 0}
+
+    def _path(self, inst_id, bar):
+        return os.path.join(self.dir, f"{inst_id}_{bar}.json")
+
+    def _load(self, inst_id, bar):
+        key = (inst_id, bar)
+        with self.lock:
+            if key in self.mem:
+                return self.mem[key]
+        rows = []
+        try:
+            with open(self._path(inst_id, bar)) as f:
+                rows = json.load(f)["rows"]
+        except Exception:
+            rows = []
+        candles = [
+            {"ts": r[0], "open": r[1], "high": r[2], "low": r[3], "close": r[4]} for r in rows
+        ]
+        with self.lock:
+            self.mem[key] = candles
+        return candles
+
+    def _save(self, inst_id, bar, candles):
+        with self.lock:
+            self.mem[(inst_id, bar)] = candles
+        rows = [[c["ts"], c["open"], c["high"], c["low"], c["close"]] for c in candles]
+        try:
+            os.makedirs(self.dir, exist_ok=True)
+            path = self._path(inst_id, bar)
+            tmp = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp, "w") as f:
+                json.dump({"instId": inst_id, "bar": bar, "rows": rows}, f, separators=(",", ":"))
+            os.replace(tmp, path)
+        except Exception as e:
+            print(f"  {inst_id} mum önbelleği yazılamadı:", e)
+
+    def _count(self, kind, n):
+        with self.lock:
+            self.stats[kind] += 1
+            self.stats["bars_fetched"] += n
+
+    def peek(self, inst_id, bar=BAR):
+        """Ağa çıkmadan kapanmış mumlar (bellek / disk)."""
+        return list(self._load(inst_id, bar))
+
+    def get(self, inst_id, bar=BAR, limit=CANDLE_LIMIT):
+        key = (inst_id, bar)
+        gen = REQUEST_CACHE.generation if REQUEST_CACHE.active else None
+        if gen is not None:
+            with self.lock:
+                hit = self.fresh.get(key)
+            if hit and hit[0] == gen and hit[1] >= limit:
+                return hit[2][-limit:]
+
+        closed = self._load(inst_id, bar)
+        bar_ms = bar_to_ms(bar)
+
+        fetched = None
+        if closed:
+            last_ts = closed[-1]["ts"]
+            # son kapanmış mumdan sonra beklenen mum sayısı (oluşan mum dahil)
+            expected = max(1, (int(time.time() * 1000) - last_ts) // bar_ms)
+            # birleşince limit'e yetecek kadar geçmiş varsa artımlı çekim
+            if expected < limit and len(closed) + expected >= limit:
+                fetched = fetch_candles(inst_id, bar, expected + 1, before=last_ts)
+                if fetched is None:
+                    return []
+                new, _ = fetched
+                # sayfa dolu geldiyse veya arada boşluk varsa → güvenli yol: tam çekim
+                if len(new) > expected or (new and new[0]["ts"] > last_ts + bar_ms):
+                    fetched = None
+                else:
+                    self._count("incremental", len(new))
+
+        if fetched is None:
+            fetched = fetch_candles(inst_id, bar, limit)
+            if fetched is None:
+                return []
+            self._count("full", len(fetched[0]))
+            closed = []
+
+        new, confirmed = fetched
+        merged = {c["ts"]: c for c in closed}
+        forming = []
+        for c, ok in zip(new, confirmed):
+            if ok:
+                merged[c["ts"]] = c
+            else:
+                forming.append(c)
+
+        closed = [merged[k] for k in sorted(merged)][-self.max_bars:]
+        self._save(inst_id, bar, closed)
+
+        if forming and closed and forming[-1]["ts"] <= closed[-1]["ts"]:
+            forming = []
+        result = (closed + forming[-1:])[-limit:]
+        if gen is not None:
+            with self.lock:
+                self.fresh[key] = (gen, limit, result)
+        return result
+
+    def stats_line(self):
+        st = self.stats
+        return (
+            f"Mum önbelleği → {st['full']} tam çekim, {st['incremental']} artımlı çekim, "
+            f"{st['bars_fetched']} mum indirildi"
+        )
+
+
+CANDLE_STORE = CandleCache() if CANDLE_CACHE_ENABLED else None
+
+
+def resample_candles(candles, bar):
+    """
+    Kronolojik mumları daha büyük bir bara toplar (OHLC). Gruplar UTC'ye
+    hizalıdır (OKX ≤4H barlarıyla aynı). Baştaki eksik grup atılır; sondaki
+    grup eksikse oluşmakta olan bar olarak kalır.
+    """
+    bar_ms = bar_to_ms(bar)
+    out = []
+    for c in candles:
+        start = c["ts"] - c["ts"] % bar_ms
+        if out and out[-1]["ts"] == start:
+            o = out[-1]
+            o["high"] = max(o["high"], c["high"])
+            o["low"] = min(o["low"], c["low"])
+            o["close"] = c["close"]
+        else:
+            out.append({"ts": start, "open": c["open"], "high": c["high"], "low": c["low"], "close": c["close"]})
+            if len(out) == 1 and c["ts"] != start:
+                out.pop()          # ilk grup ortasından başlıyor → eksik
+    return out
+
+
+def resample_closed_candles(candles, bar, base_bar=None):
+    """Kapanmış taban mumlarından sadece tamamlanmış üst TF barları."""
+    base_bar = base_bar or RESAMPLE_FROM
+    out = resample_candles(candles, bar)
+    if out and candles[-1]["ts"] < out[-1]["ts"] + bar_to_ms(bar) - bar_to_ms(base_bar):
+        out.pop()          # sondaki grup henüz kapanmadı
+    return out
+
+
+def _resample_ratio(bar):
+    if not RESAMPLE_FROM:
+        return None
+    base_ms, bar_ms = bar_to_ms(RESAMPLE_FROM), bar_to_ms(bar)
+    if bar_ms < base_ms or bar_ms % base_ms or bar_ms > bar_to_ms("4H"):
+        return None
+    return bar_ms // base_ms
+
+
+def get_mtf_candles(inst_id, bars=None, limit=SCAN_CANDLE_LIMIT):
+    """
+    {bar: mumlar}. Mum önbelleği açıksa ve tüm barlar RESAMPLE_FROM'un katıysa
+    tek bir taban çekimi yapılır, diğer zaman dilimleri yerelde üretilir.
+    Varsayılan limit tarama ihtiyacı kadardır; taban çekimi (limit + 1) × oran mum.
+    """
+    if bars is None:
+        bars = (BAR, CONFIRM_BAR) if MTF_CONFIRM != "off" else (BAR,)
+    ratios = {bar: _resample_ratio(bar) for bar in bars}
+
+    if CANDLE_STORE is None or None in ratios.values():
+        return {bar: get_candles(inst_id, bar, limit, resample=False) for bar in bars}
+
+    # +1 grup: baştaki eksik grup atılsa da limit dolsun
+    base = CANDLE_STORE.get(inst_id, RESAMPLE_FROM, (limit + 1) * max(ratios.values()))
+    return {bar: (base if r == 1 else resample_candles(base, bar))[-limit:] for bar, r in ratios.items()}
+
+
+def cached_closed_candles(inst_id, bar=BAR):
+    """Ağa çıkmadan mum önbelleğindeki kapanmış barlar (önbellek yoksa [])."""
+    if CANDLE_STORE is None:
+        return []
+    if _resample_ratio(bar):
+        base = CANDLE_STORE.peek(inst_id, RESAMPLE_FROM)
+        return resample_closed_candles(base, bar) if base else []
+    return CANDLE_STORE.peek(inst_id, bar)
+
+
+def get_candles(inst_id, bar=BAR, limit=CANDLE_LIMIT, resample=True):
+    if CANDLE_STORE is not None:
+        if resample and _resample_ratio(bar):
+            return get_mtf_candles(inst_id, (bar,), limit)[bar]
+        return CANDLE_STORE.get(inst_id, bar, limit)
+
+    fetched = fetch_candles(inst_id, bar, limit)
+    if not fetched:
+        return []
+    return fetched[0]
 
 
 def get_trades(inst_id, limit=TRADES_LIMIT):
@@ -235,14 +1407,62 @@ def get_trades(inst_id, limit=TRADES_LIMIT):
     return data or []
 
 
-def get_orderbook(inst_id, depth=ORDERBOOK_DEPTH):
-    data = jget_okx("/api/v5/market/books", {"instId": inst_id, "sz": depth})
-    if not data:
-        return None
+def current_bar_open_ms(bar=BAR, now_ms=None):
+    """Şu an oluşan barın açılış zamanı (ms). OKX ≤4H barları UTC'ye hizalıdır."""
+    if now_ms is None:
+        now_ms = int(time.time() * 1000)
+    bar_ms = bar_to_ms(bar)
+    return now_ms - now_ms % bar_ms
+
+
+def iter_history_trade_pages(inst_id, since_ms, max_pages=HISTORY_TRADES_MAX_PAGES):
+    """
+    /market/history-trades'i yeniden eskiye sayfa sayfa gezer (after=tradeId).
+    Her sayfayı geldiği anda yield eder; since_ms'ye ulaşınca veya
+    max_pages dolunca durur.
+    """
+    after = None
+    for _ in range(max_pages):
+        params = {"instId": inst_id, "limit": HISTORY_TRADES_PAGE_LIMIT}
+        if after is not None:
+            params["after"] = after
+        page = jget_okx("/api/v5/market/history-trades", params)
+        if not page:
+            return
+        yield page
+
+        oldest = page[-1]
+        try:
+            if int(oldest.get("ts")) < since_ms:
+                return
+        except (TypeError, ValueError):
+            return
+        if oldest.get("tradeId") is None or oldest.get("tradeId") == after:
+            return
+        after = oldest["tradeId"]
+
+
+def get_bar_trades(inst_id, bar=BAR, max_pages=HISTORY_TRADES_MAX_PAGES):
+    """
+    Mevcut barın trade'lerini sayfalı çeker ve sayfalar geldikçe
+    OrderFlowAggregator'a besler (tamamını bellekte biriktirmeden).
+    """
+    since_ms = current_bar_open_ms(bar)
+    agg = OrderFlowAggregator()
+    for page in iter_history_trade_pages(inst_id, since_ms, max_pages):
+        agg.add_many(t for t in page if int(t.get("ts") or 0) >= since_ms)
+    return agg
 
-    book = data[0]
-    bids = book.get("bids", [])
-    asks = book.get("asks", [])
+
+def get_orderflow_trades(inst_id):
+    """TRADES_SOURCE'a göre son trade listesi veya bar boyu aggregator."""
+    if TRADES_SOURCE == "history":
+        return get_bar_trades(inst_id)
+    return get_trades(inst_id)
+
+
+def summarize_book(bids, asks):
+    """[[px, sz, ...], ...] seviyeleri → notional toplamları + en iyi fiyatlar."""
 
     def sum_notional(levels):
         total = 0.0
@@ -269,6 +1489,405 @@ def get_orderbook(inst_id, depth=ORDERBOOK_DEPTH):
     }
 
 
+def get_orderbook(inst_id, depth=ORDERBOOK_DEPTH):
+    data = jget_okx("/api/v5/market/books", {"instId": inst_id, "sz": depth})
+    if not data:
+        return None
+
+    book = data[0]
+    t0 = time.perf_counter()
+    summary = summarize_book(book.get("bids", []), book.get("asks", []))
+    METRICS.observe_parse("books", time.perf_counter() - t0)
+    return summary
+
+
+# ------------ Yerel L2 Orderbook ------------
+
+class BookSide:
+    """
+    Tek taraf (bid veya ask) L2 seviyeleri. Fiyatlar artan sıralı listede,
+    seviye notional'ları aynı sırayla bir Fenwick ağacında tutulur:
+    fiyat aralığı / ilk k seviye notional toplamı O(log n). Mevcut seviyenin
+    boyutu değişince ağaç O(log n) güncellenir; seviye eklenip silinince
+    (liste zaten O(n) kayar) ağaç bir sonraki sorguda yeniden kurulur.
+    """
+
+    __slots__ = ("prices", "levels", "tree", "dirty")
+
+    def __init__(self):
+        self.prices = []        # artan float fiyatlar
+        self.levels = {}        # fiyat → (px_str, sz_str, notional)
+        self.tree = [0.0]
+        self.dirty = False
+
+    def __len__(self):
+        return len(self.prices)
+
+    def clear(self):
+        self.prices = []
+        self.levels = {}
+        self.tree = [0.0]
+        self.dirty = False
+
+    def set(self, px_s, sz_s):
+        px = float(px_s)
+        sz = float(sz_s)
+        old = self.levels.get(px)
+        if sz == 0:
+            if old is not None:
+                del self.levels[px]
+                del self.prices[bisect_left(self.prices, px)]
+                self.dirty = True
+            return
+
+        notional = px * sz
+        self.levels[px] = (px_s, sz_s, notional)
+        if old is None:
+            insort(self.prices, px)
+            self.dirty = True
+        elif not self.dirty:
+            i = bisect_left(self.prices, px) + 1
+            delta = notional - old[2]
+            tree = self.tree
+            while i < len(tree):
+                tree[i] += delta
+                i += i & -i
+
+    def _rebuild(self):
+        n = len(self.prices)
+        tree = [0.0] * (n + 1)
+        for i, px in enumerate(self.prices, start=1):
+            tree[i] += self.levels[px][2]
+            j = i + (i & -i)
+            if j <= n:
+                tree[j] += tree[i]
+        self.tree = tree
+        self.dirty = False
+
+    def prefix(self, k):
+        """En düşük k fiyat seviyesinin notional toplamı."""
+        if self.dirty:
+            self._rebuild()
+        total = 0.0
+        tree = self.tree
+        while k > 0:
+            total += tree[k]
+            k -= k & -k
+        return total
+
+    def range_notional(self, lo, hi):
+        """lo ≤ fiyat ≤ hi seviyelerinin notional toplamı."""
+        return self.prefix(bisect_right(self.prices, hi)) - self.prefix(bisect_left(self.prices, lo))
+
+    def level(self, px):
+        return self.levels[px]
+
+
+class L2Book:
+    """
+    OKX `books` (snapshot + delta) / `books5` mesajlarından yerel L2 defter.
+    Her mesaj seqId/prevSeqId sürekliliği ve OKX CRC32 checksum'ı ile
+    doğrulanır; tutarsızlıkta defter geçersiz olur (yeniden abonelik gerekir).
+    Sorgular: en iyi bid/ask O(1), ±% bant notional'ı ve imbalance O(log n).
+    """
+
+    __slots__ = ("bids", "asks", "seq", "ts", "valid")
+
+    def __init__(self):
+        self.bids = BookSide()
+        self.asks = BookSide()
+        self.seq = None
+        self.ts = 0
+        self.valid = False
+
+    def apply(self, action, data):
+        """
+        action "snapshot" / None → defter sıfırdan, "update" → delta (sz=0 → sil).
+        Dönüş: defter geçerli mi (False → yeniden snapshot gerekli).
+        """
+        if action == "update":
+            if not self.valid:
+                return False
+            prev = data.get("prevSeqId")
+            if prev is not None and self.seq is not None and int(prev) != self.seq:
+                self.valid = False
+                return False
+        else:
+            self.bids.clear()
+            self.asks.clear()
+
+        for side, levels in ((self.bids, data.get("bids", [])), (self.asks, data.get("asks", []))):
+            for lvl in levels:
+                side.set(lvl[0], lvl[1])
+
+        seq = data.get("seqId")
+        self.seq = int(seq) if seq is not None else None
+        self.ts = int(data.get("ts") or 0)
+
+        checksum = data.get("checksum")
+        self.valid = checksum is None or self.checksum() == int(checksum)
+        return self.valid
+
+    def top(self, n):
+        """(bids azalan, asks artan) ilk n seviye: [(px_str, sz_str, notional), ...]"""
+        bids = [self.bids.level(px) for px in reversed(self.bids.prices[-n:])] if n else []
+        asks = [self.asks.level(px) for px in self.asks.prices[:n]]
+        return bids, asks
+
+    def checksum(self):
+        """OKX CRC32: bid1px:bid1sz:ask1px:ask1sz:... (ilk 25 seviye, işaretli 32 bit)."""
+        bids, asks = self.top(OKX_BOOK_CHECKSUM_LEVELS)
+        parts = []
+        for i in range(max(len(bids), len(asks))):
+            if i < len(bids):
+                parts += bids[i][:2]
+            if i < len(asks):
+                parts += asks[i][:2]
+        crc = zlib.crc32(":".join(parts).encode())
+        return crc - (1 << 32) if crc >= 1 << 31 else crc
+
+    def best_bid(self):
+        return self.bids.prices[-1] if self.bids.prices else None
+
+    def best_ask(self):
+        return self.asks.prices[0] if self.asks.prices else None
+
+    def mid(self):
+        bid, ask = self.best_bid(), self.best_ask()
+        if bid is None or ask is None:
+            return None
+        return (bid + ask) / 2
+
+    def notional_within(self, pct):
+        """Mid'in ±pct (0.01 = %1) bandındaki (bid, ask) notional toplamları."""
+        mid = self.mid()
+        if mid is None:
+            return 0.0, 0.0
+        return (
+            self.bids.range_notional(mid * (1 - pct), mid),
+            self.asks.range_notional(mid, mid * (1 + pct)),
+        )
+
+    def imbalance(self, pct):
+        """(bid - ask) / (bid + ask), ±pct bandında; -1 (satış) … +1 (alış)."""
+        bid_n, ask_n = self.notional_within(pct)
+        total = bid_n + ask_n
+        return (bid_n - ask_n) / total if total else 0.0
+
+    def depth_notional(self, depth=ORDERBOOK_DEPTH):
+        """İlk depth seviyenin (bid, ask) notional toplamları — REST books?sz=depth ile aynı."""
+        n_bids = len(self.bids)
+        return (
+            self.bids.prefix(n_bids) - self.bids.prefix(max(0, n_bids - depth)),
+            self.asks.prefix(min(depth, len(self.asks))),
+        )
+
+    def summary(self, depth=ORDERBOOK_DEPTH):
+        """summarize_book ile aynı biçim (evaluate_symbol girdisi)."""
+        if not self.valid:
+            return None
+        bid_n, ask_n = self.depth_notional(depth)
+        return {
+            "bid_notional": bid_n,
+            "ask_notional": ask_n,
+            "best_bid": self.best_bid(),
+            "best_ask": self.best_ask(),
+        }
+
+
+# ------------ OKX WebSocket Akışı ------------
+
+class StreamSymbolState:
+    """Tek sembolün akış verisi: 4H order-flow penceresi + yerel L2 orderbook."""
+
+    def __init__(self):
+        self.flow = OrderFlowAggregator(window_ms=STREAM_WINDOW_MS)
+        self.l2 = L2Book()
+        self.lock = threading.Lock()
+
+    def add_trades(self, rows):
+        return self.flow.add_many(rows)
+
+    def set_book(self, action, data):
+        """books5: her mesaj tam görüntü. books: snapshot + update. False → yeniden senkron gerekli."""
+        with self.lock:
+            return self.l2.apply(action, data)
+
+    def get_book(self):
+        with self.lock:
+            return self.l2.summary()
+
+    def query_book(self, name, *args):
+        """L2Book sorgusu (notional_within, imbalance, top...) kilit altında; geçersiz defter → None."""
+        with self.lock:
+            if not self.l2.valid:
+                return None
+            return getattr(self.l2, name)(*args)
+
+
+class MarketStream:
+    """
+    OKX public WebSocket: `trades` + `books`/`books5` kanallarına abone olur,
+    sembol başına hafızada order-flow penceresi ve checksum'lı L2 defter tutar.
+    Checksum / sıra hatasında o sembolün book kanalına yeniden abone olunur.
+    Bağlantı koparsa yeniden bağlanır. url parametresiyle yerel sahte
+    sunucuya yönlendirilebilir; record_path verilirse ham mesajlar gzip
+    JSONL olarak kaydedilir ve replay() ile ağsız tekrar oynatılır.
+    """
+
+    def __init__(self, symbols, url=OKX_WS_URL, book_channel=STREAM_BOOK_CHANNEL, channels=None, on_candle=None,
+                 record_path=STREAM_RECORD_PATH):
+        self.symbols = list(dict.fromkeys(symbols))
+        self.url = url
+        self.book_channel = book_channel
+        self.channels = list(channels) if channels else ["trades", book_channel]
+        self.on_candle = on_candle
+        self.record_path = record_path
+        self.state = {inst_id: StreamSymbolState() for inst_id in self.symbols}
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.ws = None
+        self.stats = {"messages": 0, "trades": 0, "books": 0, "resyncs": 0, "reconnects": 0, "errors": 0}
+
+    def start(self):
+        if importlib.util.find_spec("websocket") is None:
+            raise RuntimeError("Akış modu için websocket-client gerekli: pip install websocket-client")
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join(timeout=5)
+
+    def _subscribe(self, ws):
+        args = []
+        for inst_id in self.symbols:
+            for channel in self.channels:
+                args.append({"channel": channel, "instId": inst_id})
+        for i in range(0, len(args), WS_SUBSCRIBE_BATCH):
+            ws.send(json.dumps({"op": "subscribe", "args": args[i:i + WS_SUBSCRIBE_BATCH]}))
+
+    def _resync(self, inst_id):
+        """Geçersiz defter: book kanalından çık, tekrar abone ol (yeni snapshot)."""
+        self.stats["resyncs"] += 1
+        ws = self.ws
+        if ws is None:
+            return
+        arg = [{"channel": self.book_channel, "instId": inst_id}]
+        try:
+            ws.send(json.dumps({"op": "unsubscribe", "args": arg}))
+            ws.send(json.dumps({"op": "subscribe", "args": arg}))
+        except Exception as e:
+            print(f"  {inst_id} book yeniden aboneliği gönderilemedi:", e)
+
+    def _run(self):
+        import websocket
+
+        record = gzip.open(self.record_path, "at", encoding="utf-8") if self.record_path else None
+        backoff = 1.0
+        while not self.stop_event.is_set():
+            ws = None
+            try:
+                ws = websocket.create_connection(self.url, timeout=WS_PING_INTERVAL)
+                self.ws = ws
+                self._subscribe(ws)
+                backoff = 1.0
+                while not self.stop_event.is_set():
+                    try:
+                        raw = ws.recv()
+                    except websocket.WebSocketTimeoutException:
+                        ws.send("ping")
+                        continue
+                    if not raw:
+                        raise ConnectionError("bağlantı kapandı")
+                    if record is not None and raw != "pong":
+                        record.write(raw + "\n")
+                    self.on_message(raw)
+            except Exception as e:
+                if self.stop_event.is_set():
+                    break
+                self.stats["reconnects"] += 1
+                print(f"WS bağlantı hatası ({e}), {backoff:.0f} sn sonra yeniden bağlanılıyor...")
+                self.stop_event.wait(backoff)
+                backoff = min(30.0, backoff * 2)
+            finally:
+                self.ws = None
+                if ws is not None:
+                    try:
+                        ws.close()
+                    except Exception:
+                        pass
+        if record is not None:
+            record.close()
+
+    def replay(self, path):
+        """record_path ile kaydedilmiş ham mesajları sırayla işler (ağ yok)."""
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                line = line.rstrip("\n")
+                if line:
+                    self.on_message(line)
+
+    def on_message(self, raw):
+        if raw == "pong":
+            return
+        try:
+            msg = json.loads(raw)
+        except ValueError:
+            return
+        self.stats["messages"] += 1
+
+        if "event" in msg:
+            if msg["event"] == "error":
+                self.stats["errors"] += 1
+                print("WS hata:", msg.get("msg"))
+            return
+
+        arg = msg.get("arg", {})
+        st = self.state.get(arg.get("instId"))
+        if st is None:
+            return
+        channel = arg.get("channel", "")
+        data = msg.get("data") or []
+        if channel.startswith("candle"):
+            if self.on_candle is not None:
+                self.on_candle(arg["instId"], data, channel[len("candle"):])
+        elif channel == "trades":
+            self.stats["trades"] += st.add_trades(data)
+        elif channel == self.book_channel and data:
+            self.stats["books"] += 1
+            if not st.set_book(msg.get("action"), data[0]):
+                self._resync(arg["instId"])
+
+    def trades(self, inst_id):
+        """Sembolün OrderFlowAggregator'ı (analyze_trades_orderflow doğrudan sorgular)."""
+        st = self.state.get(inst_id)
+        if st is None:
+            return []
+        st.flow.evict(int(time.time() * 1000))
+        return st.flow
+
+    def book(self, inst_id):
+        st = self.state.get(inst_id)
+        return st.get_book() if st else None
+
+    def l2(self, inst_id, name, *args):
+        """
+        Sembolün yerel L2 defterinde sorgu, örn. l2(inst_id, "imbalance", 0.01).
+        Defter WS thread'inde güncellendiği için sorgu sembolün kilidi altında koşar.
+        """
+        st = self.state.get(inst_id)
+        return st.query_book(name, *args) if st else None
+
+    def stats_line(self):
+        st = self.stats
+        return (
+            f"WS akışı → {st['messages']} mesaj, {st['trades']} trade, {st['books']} book "
+            f"({st['resyncs']} yeniden senkron), {st['reconnects']} yeniden bağlanma, {st['errors']} hata"
+        )
+
+
 # ------------ Teknik Hesaplar / Yapı ------------
 
 def ema(values, period):
@@ -281,17 +1900,405 @@ def ema(values, period):
     return ema_val
 
 
+class Ema:
+    """
+    Artımlı üstel ortalama: ilk period değerin SMA'sı ile tohumlanır (ema()
+    ile aynı), sonrası değer başına O(1). wilder=True → alpha = 1/period (RMA).
+    """
+
+    __slots__ = ("period", "alpha", "n", "value", "seed")
+
+    def __init__(self, period, wilder=False, n=0, value=None, seed=0.0):
+        self.period = period
+        self.alpha = 1 / period if wilder else 2 / (period + 1)
+        self.n = n
+        self.value = value
+        self.seed = seed
+
+    def update(self, v):
+        self.n += 1
+        if self.value is None:
+            self.seed += v
+            if self.n == self.period:
+                self.value = self.seed / self.period
+        else:
+            self.value = v * self.alpha + self.value * (1 - self.alpha)
+        return self.value
+
+    def to_list(self):
+        return [self.n, self.value, self.seed]
+
+
+class IndicatorState:
+    """
+    Tek (sembol, bar) için artımlı EMA200 / EMA12 / EMA26 / MACD sinyal(9) /
+    ATR14 / RSI14 (Wilder). Kapanmış bar başına update() O(1); oluşan bar
+    peek() ile durumu bozmadan uygulanır.
+    """
+
+    FIELDS = ("ema200", "ema12", "ema26", "signal", "atr", "gain", "loss")
+
+    def __init__(self):
+        self.last_ts = None
+        self.prev_close = None
+        self.bars = 0
+        self.ema200 = Ema(200)
+        self.ema12 = Ema(12)
+        self.ema26 = Ema(26)
+        self.signal = Ema(9)
+        self.atr = Ema(14, wilder=True)
+        self.gain = Ema(14, wilder=True)
+        self.loss = Ema(14, wilder=True)
+
+    def update(self, c):
+        close = c["close"]
+        self.ema200.update(close)
+        fast = self.ema12.update(close)
+        slow = self.ema26.update(close)
+        if fast is not None and slow is not None:
+            self.signal.update(fast - slow)
+
+        prev = self.prev_close
+        if prev is not None:
+            self.atr.update(max(c["high"] - c["low"], abs(c["high"] - prev), abs(c["low"] - prev)))
+            change = close - prev
+            self.gain.update(max(change, 0.0))
+            self.loss.update(max(-change, 0.0))
+
+        self.prev_close = close
+        self.last_ts = c["ts"]
+        self.bars += 1
+
+    def copy(self):
+        return IndicatorState.from_dict(self.to_dict())
+
+    def peek(self, c):
+        """c (oluşan bar) uygulanmış haliyle değerler; durum değişmez."""
+        tmp = self.copy()
+        tmp.update(c)
+        return tmp.values()
+
+    def values(self):
+        fast, slow = self.ema12.value, self.ema26.value
+        macd = fast - slow if fast is not None and slow is not None else None
+        sig = self.signal.value
+        rsi = None
+        if self.gain.value is not None:
+            if self.loss.value == 0:
+                rsi = 100.0
+            else:
+                rsi = 100 - 100 / (1 + self.gain.value / self.loss.value)
+        atr = self.atr.value
+        return {
+            "ema200": self.ema200.value,
+            "ema12": fast,
+            "ema26": slow,
+            "macd": macd,
+            "macd_signal": sig,
+            "macd_hist": macd - sig if macd is not None and sig is not None else None,
+            "atr": atr,
+            "atr_pct": atr / self.prev_close if atr is not None and self.prev_close else None,
+            "rsi": rsi,
+            "bars": self.bars,
+        }
+
+    def to_dict(self):
+        d = {"last_ts": self.last_ts, "prev_close": self.prev_close, "bars": self.bars}
+        for name in self.FIELDS:
+            d[name] = getattr(self, name).to_list()
+        return d
+
+    @classmethod
+    def from_dict(cls, d):
+        st = cls()
+        st.last_ts = d["last_ts"]
+        st.prev_close = d["prev_close"]
+        st.bars = d["bars"]
+        for name in cls.FIELDS:
+            e = getattr(st, name)
+            e.n, e.value, e.seed = d[name]
+        return st
+
+
+class IndicatorStore:
+    """
+    (instId, bar) → IndicatorState; turlar arasında JSON dosyasında kalıcı.
+    Durum yoksa (veya aradaki barlar kayıpsa) bir kerelik INDICATOR_WARMUP_BARS
+    uzunluğunda geçmişle ısınır; sonrasında her turda sadece yeni kapanan
+    barlar işlenir. path=None → sadece bellek (record / replay).
+    """
+
+    def __init__(self, path=os.path.join(CACHE_DIR, "indicators.json"), warmup_bars=INDICATOR_WARMUP_BARS):
+        self.path = path
+        self.warmup_bars = warmup_bars
+        self.states = None
+        self.lock = threading.Lock()
+        self.stats = {"warmups": 0, "bars": 0}
+
+    def _load(self):
+        if self.states is not None:
+            return
+        states = {}
+        if self.path:
+            try:
+                with open(self.path) as f:
+                    states = {k: IndicatorState.from_dict(v) for k, v in json.load(f)["states"].items()}
+            except Exception:
+                states = {}
+        self.states = states
+
+    def save(self):
+        with self.lock:
+            if not self.path or self.states is None:
+                return
+            payload = {"states": {k: v.to_dict() for k, v in self.states.items()}}
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp = f"{self.path}.tmp"
+            with open(tmp, "w") as f:
+                json.dump(payload, f, separators=(",", ":"))
+            os.replace(tmp, self.path)
+        except Exception as e:
+            print("İndikatör durumu yazılamadı:", e)
+
+    def _apply(self, st, closed):
+        n = 0
+        for c in closed:
+            if st.last_ts is None or c["ts"] > st.last_ts:
+                st.update(c)
+                n += 1
+        return n
+
+    def advance(self, inst_id, bar, closed):
+        """Var olan durumu kapanmış mumlarla ilerletir (ısınma / ağ yok)."""
+        key = f"{inst_id}|{bar}"
+        with self.lock:
+            self._load()
+            st = self.states.get(key)
+            if st is None or st.last_ts is None or not closed or closed[0]["ts"] > st.last_ts + bar_to_ms(bar):
+                return
+            self.stats["bars"] += self._apply(st, closed)
+
+    def indicators(self, inst_id, bar, candles):
+        """
+        candles: kronolojik mumlar (sonuncusu oluşan bar olabilir).
+        Kapanmış barlar duruma işlenir, oluşan bar geçici uygulanır.
+        """
+        if not candles:
+            return None
+        forming_ts = current_bar_open_ms(bar)
+        closed = [c for c in candles if c["ts"] < forming_ts]
+        forming = candles[-1] if candles[-1]["ts"] >= forming_ts else None
+        key = f"{inst_id}|{bar}"
+
+        with self.lock:
+            self._load()
+            st = self.states.get(key)
+        if st is None or st.last_ts is None or (closed and closed[0]["ts"] > st.last_ts + bar_to_ms(bar)):
+            st = self._warm_up(inst_id, bar, closed, forming_ts)
+
+        with self.lock:
+            self.states[key] = st
+            self.stats["bars"] += self._apply(st, closed)
+            return st.peek(forming) if forming else st.values()
+
+    def _warm_up(self, inst_id, bar, closed, forming_ts):
+        """Uzun geçmişten sıfır durum; çekilemezse eldeki mumlarla."""
+        history = []
+        if self.warmup_bars > len(closed):
+            fetched = fetch_candles(inst_id, bar, self.warmup_bars)
+            if fetched:
+                history = [c for c, ok in zip(*fetched) if ok and c["ts"] < forming_ts]
+        st = IndicatorState()
+        self._apply(st, history)
+        self._apply(st, closed)
+        with self.lock:
+            self.stats["warmups"] += 1
+        return st
+
+    def stats_line(self):
+        n = len(self.states or {})
+        return (
+            f"İndikatör durumu → {n} sembol/bar, {self.stats['warmups']} ısınma, "
+            f"{self.stats['bars']} yeni bar işlendi"
+        )
+
+
+INDICATORS = IndicatorStore()
+
+
+def whale_tier(notional, medium_thr, whale_thr, super_thr):
+    """Notional → "X" / "M" / "S" whale seviyesi (eşik altı → None)."""
+    if notional >= super_thr:
+        return "X"
+    if notional >= whale_thr:
+        return "M"
+    if notional >= medium_thr:
+        return "S"
+    return None
+
+
+def whale_of(side, notional, px, sz, ts_raw, medium_thr, whale_thr, super_thr):
+    """
+    Bir tarafın en büyük trade'inden whale dict'i. Tier notional ile monoton
+    olduğundan en büyük trade eşik altındaysa o tarafta whale yoktur.
+    """
+    tier = whale_tier(notional, medium_thr, whale_thr, super_thr)
+    if tier is None:
+        return None
+    return {"px": px, "sz": sz, "usd": notional, "side": side, "tier": tier, "ts": ts_raw}
+
+
+class OrderFlowAggregator:
+    """
+    Artımlı order-flow: trade başına O(1) ekleme, zaman penceresiyle eski
+    trade'lerin düşülmesi ve tradeId ile tekilleştirme (örtüşen REST sayfaları
+    iki kez sayılmaz).
+
+    Alış/satış notional toplamları koşar halde tutulur. Her taraf için monoton
+    deque en büyük notional'lı trade'i pencere içinde hazır tutar; tier
+    notional ile monoton olduğundan en büyük whale = en büyük trade (eşiği
+    geçiyorsa). Eşikler sorgu anında verilir.
+
+    window_ms None ise düşme yapılmaz (geliş sırası önemsizdir); aksi halde
+    trade'lerin kabaca kronolojik geldiği varsayılır.
+    """
+
+    def __init__(self, window_ms=None):
+        self.window_ms = window_ms
+        self.buy_notional = 0.0
+        self.sell_notional = 0.0
+        self.count = 0
+        self.newest_ts = 0
+        self.seq = 0
+        self.entries = deque()
+        self.max_q = {"buy": deque(), "sell": deque()}
+        self.seen = set()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return self.count
+
+    def add(self, t):
+        """OKX trade dict'i ekler; eklendiyse True (geçersiz / tekrar → False)."""
+        try:
+            px = float(t.get("px"))
+            sz = float(t.get("sz"))
+            side = t.get("side", "").lower()
+        except Exception:
+            return False
+
+        trade_id = t.get("tradeId")
+        ts_raw = t.get("ts")
+        try:
+            ts_ms = int(ts_raw)
+        except (TypeError, ValueError):
+            ts_ms = 0
+
+        with self.lock:
+            # pencere dışında kalmış (zaten düşülmüş) trade tekrar sayılmaz
+            if self.window_ms is not None and ts_ms < self.newest_ts - self.window_ms:
+                return False
+            if trade_id is not None:
+                if trade_id in self.seen:
+                    return False
+                self.seen.add(trade_id)
+
+            notional = px * abs(sz)
+            # (seq, ts, side, notional, px, sz, ts_raw, tradeId)
+            entry = (self.seq, ts_ms, side, notional, px, sz, ts_raw, trade_id)
+            self.seq += 1
+            self.count += 1
+
+            if side == "buy":
+                self.buy_notional += notional
+            elif side == "sell":
+                self.sell_notional += notional
+
+            q = self.max_q.get(side)
+            if q is not None:
+                # eşit notional'da önce gelen kalır (analyze_trades_orderflow ile aynı)
+                while q and q[-1][3] < notional:
+                    q.pop()
+                q.append(entry)
+
+            if self.window_ms is not None:
+                self.entries.append(entry)
+                if ts_ms > self.newest_ts:
+                    self.newest_ts = ts_ms
+                self._evict(self.newest_ts - self.window_ms)
+        return True
+
+    def add_many(self, trades):
+        added = 0
+        for t in trades:
+            if self.add(t):
+                added += 1
+        return added
+
+    def _evict(self, cutoff_ms):
+        while self.entries and self.entries[0][1] < cutoff_ms:
+            e = self.entries.popleft()
+            self.count -= 1
+            if e[2] == "buy":
+                self.buy_notional -= e[3]
+            elif e[2] == "sell":
+                self.sell_notional -= e[3]
+            q = self.max_q.get(e[2])
+            if q and q[0][0] == e[0]:
+                q.popleft()
+            if e[7] is not None:
+                self.seen.discard(e[7])
+
+    def evict(self, now_ms):
+        """Pencereyi verilen zamana göre kaydırır (akışta sessiz semboller için)."""
+        if self.window_ms is None:
+            return
+        with self.lock:
+            self._evict(now_ms - self.window_ms)
+
+    def _whale(self, side, medium_thr, whale_thr, super_thr):
+        q = self.max_q[side]
+        if not q:
+            return None
+        _, _, _, notional, px, sz, ts_raw, _ = q[0]
+        return whale_of(side, notional, px, sz, ts_raw, medium_thr, whale_thr, super_thr)
+
+    def query(self, medium_thr, whale_thr, super_thr):
+        """analyze_trades_orderflow ile aynı çıktı, o anki pencere için."""
+        with self.lock:
+            best_buy = self._whale("buy", medium_thr, whale_thr, super_thr)
+            best_sell = self._whale("sell", medium_thr, whale_thr, super_thr)
+            buy_notional = self.buy_notional
+            sell_notional = self.sell_notional
+
+        return {
+            "buy_notional": buy_notional,
+            "sell_notional": sell_notional,
+            "net_delta": buy_notional - sell_notional,
+            "buy_whale": best_buy,
+            "sell_whale": best_sell,
+            "has_buy_whale": best_buy is not None,
+            "has_sell_whale": best_sell is not None,
+        }
+
+
 def analyze_trades_orderflow(trades, medium_thr, whale_thr, super_thr):
     """
     Spot için:
     - Net notional delta (buy_notional - sell_notional)
     - S / M / X seviyesinde en büyük buy whale
     - S / M / X seviyesinde en büyük sell whale
+    trades bir OrderFlowAggregator ise doğrudan sorgulanır (yeniden hesap yok);
+    liste ise tek geçişte toplanır (kilit / pencere / tekilleştirme yükü yok).
     """
+    if isinstance(trades, OrderFlowAggregator):
+        return trades.query(medium_thr, whale_thr, super_thr)
+
     buy_notional = 0.0
     sell_notional = 0.0
-    best_buy = None
-    best_sell = None
+    # tarafın en büyük trade'i: (notional, px, sz, trade); eşitlikte önce gelen kalır
+    best_buy = best_sell = None
 
     for t in trades:
         try:
@@ -302,51 +2309,32 @@ def analyze_trades_orderflow(trades, medium_thr, whale_thr, super_thr):
             continue
 
         notional = px * abs(sz)
-
-        # Whale tier belirle
-        tier = None
-        if notional >= super_thr:
-            tier = "X"
-        elif notional >= whale_thr:
-            tier = "M"
-        elif notional >= medium_thr:
-            tier = "S"
-
         if side == "buy":
             buy_notional += notional
-            if tier:
-                if (best_buy is None) or (notional > best_buy["usd"]):
-                    best_buy = {
-                        "px": px,
-                        "sz": sz,
-                        "usd": notional,
-                        "side": side,
-                        "tier": tier,
-                        "ts": t.get("ts"),
-                    }
+            if best_buy is None or notional > best_buy[0]:
+                best_buy = (notional, px, sz, t)
         elif side == "sell":
             sell_notional += notional
-            if tier:
-                if (best_sell is None) or (notional > best_sell["usd"]):
-                    best_sell = {
-                        "px": px,
-                        "sz": sz,
-                        "usd": notional,
-                        "side": side,
-                        "tier": tier,
-                        "ts": t.get("ts"),
-                    }
+            if best_sell is None or notional > best_sell[0]:
+                best_sell = (notional, px, sz, t)
 
-    net_delta = buy_notional - sell_notional
+    def side_whale(side, best):
+        if best is None:
+            return None
+        notional, px, sz, t = best
+        return whale_of(side, notional, px, sz, t.get("ts"), medium_thr, whale_thr, super_thr)
+
+    buy_whale = side_whale("buy", best_buy)
+    sell_whale = side_whale("sell", best_sell)
 
     return {
         "buy_notional": buy_notional,
         "sell_notional": sell_notional,
-        "net_delta": net_delta,
-        "buy_whale": best_buy,
-        "sell_whale": best_sell,
-        "has_buy_whale": best_buy is not None,
-        "has_sell_whale": best_sell is not None,
+        "net_delta": buy_notional - sell_notional,
+        "buy_whale": buy_whale,
+        "sell_whale": sell_whale,
+        "has_buy_whale": buy_whale is not None,
+        "has_sell_whale": sell_whale is not None,
     }
 
 
@@ -465,19 +2453,457 @@ def check_fvg_rejection(candles, fvg):
     if not touched:
         return False
 
-    # bullish FVG rejection
-    if fvg["type"] == "bullish":
-        if close > op and close > (z_low * (1 + ZONE_BUFFER / 2)):
-            return True
-        return False
+    # bullish FVG rejection
+    if fvg["type"] == "bullish":
+        if close > op and close > (z_low * (1 + ZONE_BUFFER / 2)):
+            return True
+        return False
+
+    # bearish FVG rejection
+    if fvg["type"] == "bearish":
+        if close < op and close < (z_high * (1 - ZONE_BUFFER / 2)):
+            return True
+        return False
+
+    return False
+
+
+# ------------ Yapı Özeti (MSB + FVG + mesafe) ------------
+
+def analyze_structure(candles, lookback=STRUCT_LOOKBACK):
+    """
+    Son mum için MSB + FVG yapısı ve MAX_STRUCTURE_DISTANCE filtresi.
+    structure_long / structure_short mesafe filtresi uygulanmış haldedir.
+    """
+    bullish_msb, bull_level = detect_bullish_msb(candles, lookback)
+    bearish_msb, bear_level = detect_bearish_msb(candles, lookback)
+    fvg = find_recent_fvg(candles, lookback)
+    return structure_from_parts(candles[-1], bullish_msb, bull_level, bearish_msb, bear_level, fvg)
+
+
+def structure_from_parts(last, bullish_msb, bull_level, bearish_msb, bear_level, fvg):
+    """
+    MSB sonuçları + son FVG'den analyze_structure çıktısı (rejection +
+    mesafe filtresi). RollingStructure ile ortak karar mantığı.
+    """
+    last_close = last["close"]
+
+    bullish_fvg_reject = False
+    bearish_fvg_reject = False
+    if fvg:
+        rej = check_fvg_rejection([last], fvg)
+        if rej and fvg["type"] == "bullish":
+            bullish_fvg_reject = True
+        if rej and fvg["type"] == "bearish":
+            bearish_fvg_reject = True
+
+    structure_long = bullish_msb or bullish_fvg_reject
+    structure_short = bearish_msb or bearish_fvg_reject
+
+    # --- EK GÜVENLİK 1: Yapı (MSB / FVG) seviyesinden çok uzaksa LONG/SHORT iptal ---
+
+    if structure_long:
+        ref_level = None
+        # Önce MSB seviyesi
+        if bullish_msb and bull_level:
+            ref_level = bull_level
+        # MSB yoksa, FVG seviyesinin ortasını referans al
+        elif bullish_fvg_reject and fvg and fvg["type"] == "bullish":
+            ref_level = (fvg["low"] + fvg["high"]) / 2.0
+
+        if ref_level:
+            dist = abs(last_close - ref_level) / ref_level
+            if dist > MAX_STRUCTURE_DISTANCE:
+                # Fiyat yapıya göre çok yürümüş → geç sinyal → iptal
+                structure_long = False
+
+    if structure_short:
+        ref_level_s = None
+        if bearish_msb and bear_level:
+            ref_level_s = bear_level
+        elif bearish_fvg_reject and fvg and fvg["type"] == "bearish":
+            ref_level_s = (fvg["low"] + fvg["high"]) / 2.0
+
+        if ref_level_s:
+            dist_s = abs(last_close - ref_level_s) / ref_level_s
+            if dist_s > MAX_STRUCTURE_DISTANCE:
+                # Fiyat yapıya göre çok uzak → tepeden/dipten işlem açma
+                structure_short = False
+
+    return {
+        "bullish_msb": bullish_msb,
+        "bull_level": bull_level,
+        "bearish_msb": bearish_msb,
+        "bear_level": bear_level,
+        "fvg": fvg,
+        "bullish_fvg_reject": bullish_fvg_reject,
+        "bearish_fvg_reject": bearish_fvg_reject,
+        "structure_long": structure_long,
+        "structure_short": structure_short,
+    }
+
+
+# ------------ Kayan Yapı Dedektörü (akış / uzun geçmiş) ------------
+
+class RollingExtremes:
+    """
+    Son `window` değerin max / min'i, monotonic deque ile.
+    push bar başına amortize O(1); max / min O(1).
+    """
+
+    __slots__ = ("window", "maxq", "minq")
+
+    def __init__(self, window):
+        self.window = window
+        self.maxq = deque()   # (indeks, değer), değerler azalan
+        self.minq = deque()   # (indeks, değer), değerler artan
+
+    def _evict(self, i):
+        lo = i - self.window
+        while self.maxq and self.maxq[0][0] <= lo:
+            self.maxq.popleft()
+        while self.minq and self.minq[0][0] <= lo:
+            self.minq.popleft()
+
+    def push(self, i, value):
+        """i. değeri ekler; pencerede [i - window + 1, i] kalır."""
+        self._evict(i)
+        while self.maxq and self.maxq[-1][1] <= value:
+            self.maxq.pop()
+        self.maxq.append((i, value))
+        while self.minq and self.minq[-1][1] >= value:
+            self.minq.pop()
+        self.minq.append((i, value))
+
+    def max(self):
+        return self.maxq[0][1] if self.maxq else None
+
+    def min(self):
+        return self.minq[0][1] if self.minq else None
+
+
+class RollingStructure:
+    """
+    analyze_structure'ın bar bar güncellenen hali; birden çok lookback tek
+    geçişte. Her lookback için önceki kapanışların max / min'i
+    RollingExtremes'te tutulur (MSB seviyeleri), FVG için sadece son iki mum
+    ve görülen en son gap saklanır: find_recent_fvg'nin penceresi hangi
+    lookback olursa olsun en son gap'i döndürür, pencere sadece yaşını sınırlar.
+    update() bar başına lookback sayısıyla orantılı, amortize O(1).
+
+    Sonuçlar analyze_structure(candles[:t + 1], lookback) ile birebir aynıdır.
+    """
+
+    def __init__(self, lookbacks=(STRUCT_LOOKBACK,)):
+        self.lookbacks = tuple(sorted(set(lookbacks)))
+        self.closes = {lb: RollingExtremes(lb) for lb in self.lookbacks}
+        self.n = 0                # görülen mum sayısı
+        self.last_ts = None
+        self.prev = deque(maxlen=2)   # son iki mumun (high, low)
+        self.gap_i = None         # en son gap'in mum indeksi
+        self.gap = None
+        self.last = {}
+
+    def update(self, candle):
+        """Yeni kapanmış mumu ekler; {lookback: analyze_structure sonucu}."""
+        if self.last_ts is not None and candle["ts"] <= self.last_ts:
+            return self.last      # tekrar / geç gelen mum
+        i = self.n
+        self.n += 1
+        self.last_ts = candle["ts"]
+
+        if len(self.prev) == 2:
+            h1, l1 = self.prev[0]
+            gap = None
+            # find_recent_fvg gibi: aynı mumda iki gap varsa bearish kazanır
+            if h1 < candle["low"]:
+                gap = {"type": "bullish", "low": h1, "high": candle["low"]}
+            if l1 > candle["high"]:
+                gap = {"type": "bearish", "low": candle["high"], "high": l1}
+            if gap:
+                self.gap_i, self.gap = i, gap
+        self.prev.append((candle["high"], candle["low"]))
+
+        close = candle["close"]
+        out = {}
+        for lb in self.lookbacks:
+            ext = self.closes[lb]
+            if self.n >= lb + 2:
+                # ext şu an önceki lb kapanışı tutuyor: [i - lb, i - 1]
+                bull_level, bear_level = ext.max(), ext.min()
+                bull = (close > bull_level * 1.001, bull_level)
+                bear = (close < bear_level * 0.999, bear_level)
+            else:
+                bull = bear = (False, None)
+            fvg = None
+            if self.gap_i is not None and self.gap_i >= max(2, self.n - lb):
+                fvg = dict(self.gap)
+            out[lb] = structure_from_parts(candle, *bull, *bear, fvg)
+            ext.push(i, close)
+        self.last = out
+        return out
+
+    def extend(self, candles):
+        """Mumları sırayla ekler; son mumun sonucunu döndürür."""
+        for c in candles:
+            self.update(c)
+        return self.last
+
+    def structure(self, lookback=STRUCT_LOOKBACK):
+        """Son mumun yapısı (henüz mum yoksa None)."""
+        return self.last.get(lookback)
+
+
+# ------------ Kolonsal (NumPy) Mum Temsili ------------
+
+def _require_numpy():
+    if np is None:
+        raise RuntimeError("Bu özellik için numpy gerekli: pip install numpy")
+
+
+class CandleArray:
+    """
+    Kolonsal mum kabı: ts (int64) + open/high/low/close (float64) bitişik diziler.
+    Kronolojik sırada; mum başına dict üretmez.
+    """
+
+    __slots__ = ("ts", "open", "high", "low", "close")
+
+    def __init__(self, ts, open, high, low, close):
+        _require_numpy()
+        self.ts = np.ascontiguousarray(ts, dtype=np.int64)
+        self.open = np.ascontiguousarray(open, dtype=np.float64)
+        self.high = np.ascontiguousarray(high, dtype=np.float64)
+        self.low = np.ascontiguousarray(low, dtype=np.float64)
+        self.close = np.ascontiguousarray(close, dtype=np.float64)
+
+    def __len__(self):
+        return len(self.ts)
+
+    @classmethod
+    def from_dicts(cls, candles):
+        return cls(
+            [c["ts"] for c in candles],
+            [c["open"] for c in candles],
+            [c["high"] for c in candles],
+            [c["low"] for c in candles],
+            [c["close"] for c in candles],
+        )
+
+    @classmethod
+    def from_okx_rows(cls, data):
+        """Ham OKX candle satırları (en yeni en üstte) → CandleArray."""
+        _require_numpy()
+        if not data:
+            return cls([], [], [], [], [])
+        raw = np.array([r[:5] for r in reversed(data)], dtype=object)
+        return cls(
+            raw[:, 0].astype(np.int64),
+            raw[:, 1].astype(np.float64),
+            raw[:, 2].astype(np.float64),
+            raw[:, 3].astype(np.float64),
+            raw[:, 4].astype(np.float64),
+        )
+
+    def to_dicts(self):
+        return [
+            {"ts": int(t), "open": float(o), "high": float(h), "low": float(l), "close": float(c)}
+            for t, o, h, l, c in zip(self.ts, self.open, self.high, self.low, self.close)
+        ]
+
+    def last(self):
+        """Son mum dict olarak (check_fvg_rejection vs ile uyumlu)."""
+        return {
+            "ts": int(self.ts[-1]),
+            "open": float(self.open[-1]),
+            "high": float(self.high[-1]),
+            "low": float(self.low[-1]),
+            "close": float(self.close[-1]),
+        }
+
+
+def ema_np(values, period):
+    """
+    ema() ile aynı sonuç (SMA tohum + üstel ağırlık), döngüsüz.
+    Son eksen boyunca çalışır → 1-D veya (sembol × bar) 2-D dizi kabul eder.
+    """
+    _require_numpy()
+    values = np.asarray(values, dtype=np.float64)
+    n = values.shape[-1]
+    if n < period:
+        return None
+    k = 2 / (period + 1)
+    seed = values[..., :period].mean(axis=-1)
+    rest = values[..., period:]
+    m = rest.shape[-1]
+    # ema_n = seed*(1-k)^m + Σ k*(1-k)^(m-1-j) * v_j
+    weights = k * (1 - k) ** np.arange(m - 1, -1, -1, dtype=np.float64)
+    return seed * (1 - k) ** m + rest @ weights
+
+
+def msb_levels_np(close, lookback=STRUCT_LOOKBACK):
+    """
+    detect_bullish_msb / detect_bearish_msb'nin vektörel hali (son mum için).
+    Dönüş: (bull_break, bull_level, bear_break, bear_level); son eksen = bar.
+    Yeterli mum yoksa None.
+    """
+    _require_numpy()
+    close = np.asarray(close, dtype=np.float64)
+    if close.shape[-1] < lookback + 2:
+        return None
+    window = close[..., -(lookback + 1):-1]
+    last_close = close[..., -1]
+    bull_level = window.max(axis=-1)
+    bear_level = window.min(axis=-1)
+    return (
+        last_close > bull_level * 1.001,
+        bull_level,
+        last_close < bear_level * 0.999,
+        bear_level,
+    )
+
+
+def fvg_scan_np(high, low, lookback=STRUCT_LOOKBACK):
+    """
+    find_recent_fvg'nin vektörel gap taraması (son eksen = bar).
+    Dönüş: (kind, zone_low, zone_high) dizileri; kind: 0 yok, 1 bullish, -1 bearish.
+    Aynı mumda iki gap varsa find_recent_fvg gibi bearish kazanır.
+    """
+    _require_numpy()
+    high = np.asarray(high, dtype=np.float64)
+    low = np.asarray(low, dtype=np.float64)
+    n = high.shape[-1]
+    lead = high.shape[:-1]
+    if n < 3:
+        return np.zeros(lead, dtype=np.int8), np.full(lead, np.nan), np.full(lead, np.nan)
+
+    start = max(2, n - lookback)
+    h1, l1 = high[..., start - 2:n - 2], low[..., start - 2:n - 2]
+    h3, l3 = high[..., start:], low[..., start:]
+    bull = h1 < l3
+    bear = l1 > h3
+    any_gap = bull | bear
+
+    width = any_gap.shape[-1]
+    # son gap'in indeksi: ters çevirip ilk True
+    rev_idx = np.argmax(any_gap[..., ::-1], axis=-1)
+    idx = width - 1 - rev_idx
+
+    def take(a):
+        return np.take_along_axis(a, idx[..., None], axis=-1)[..., 0]
+
+    found = take(any_gap)
+    is_bear = take(bear)
+    zone_low = np.where(is_bear, take(h3), take(h1))
+    zone_high = np.where(is_bear, take(l1), take(l3))
+    kind = np.where(found, np.where(is_bear, -1, 1), 0).astype(np.int8)
+    zone_low = np.where(found, zone_low, np.nan)
+    zone_high = np.where(found, zone_high, np.nan)
+    return kind, zone_low, zone_high
+
+
+def find_recent_fvg_np(arr: "CandleArray", lookback=STRUCT_LOOKBACK):
+    """find_recent_fvg ile aynı dict çıktısı, CandleArray üzerinde."""
+    kind, z_low, z_high = fvg_scan_np(arr.high, arr.low, lookback)
+    if kind == 0:
+        return None
+    return {
+        "type": "bullish" if kind == 1 else "bearish",
+        "low": float(z_low),
+        "high": float(z_high),
+    }
+
+
+def detect_msb_np(arr: "CandleArray", lookback=STRUCT_LOOKBACK):
+    """
+    CandleArray için ((bullish_msb, bull_level), (bearish_msb, bear_level)),
+    detect_bullish_msb / detect_bearish_msb ile aynı biçimde.
+    """
+    res = msb_levels_np(arr.close, lookback)
+    if res is None:
+        return (False, None), (False, None)
+    bull, bull_level, bear, bear_level = res
+    return (bool(bull), float(bull_level)), (bool(bear), float(bear_level))
+
+
+# ---- Çoklu sembol (batch) yapı analizi ----
+
+def stack_candle_arrays(arrays, n_bars=None):
+    """
+    CandleArray listesi → (open, high, low, close, valid) — (sembol × bar) 2-D.
+    Mumlar sağa (son mum) hizalanır; kısa geçmişler soldan NaN ile doldurulur.
+    valid: analiz için yeterli mumu olan semboller (evaluate_symbol eşiği).
+    """
+    _require_numpy()
+    if n_bars is None:
+        n_bars = max((len(a) for a in arrays), default=0)
+    shape = (len(arrays), n_bars)
+    cols = [np.full(shape, np.nan) for _ in range(4)]
+    lengths = np.zeros(len(arrays), dtype=np.int64)
+    for i, a in enumerate(arrays):
+        m = min(len(a), n_bars)
+        lengths[i] = m
+        if m == 0:
+            continue
+        for col, src in zip(cols, (a.open, a.high, a.low, a.close)):
+            col[i, n_bars - m:] = src[-m:]
+    valid = lengths >= STRUCT_LOOKBACK + 3
+    return cols[0], cols[1], cols[2], cols[3], valid
+
+
+def analyze_structure_batch(open_, high, low, close, lookback=STRUCT_LOOKBACK, valid=None):
+    """
+    analyze_structure'ın tüm semboller için tek geçişte vektörel hali.
+    Girdi: (sembol × bar) 2-D diziler. Çıktı: sembol başına 1-D diziler
+    (bool bayraklar + seviyeler; seviye yoksa NaN).
+    """
+    _require_numpy()
+    open_, high, low, close = (np.asarray(x, dtype=np.float64) for x in (open_, high, low, close))
+    n_sym = close.shape[0]
+    if valid is None:
+        valid = np.ones(n_sym, dtype=bool)
+    valid = valid & (close.shape[-1] >= lookback + 2)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        msb = msb_levels_np(close, lookback)
+        if msb is None:
+            nan = np.full(n_sym, np.nan)
+            false = np.zeros(n_sym, dtype=bool)
+            bull_msb, bull_level, bear_msb, bear_level = false, nan, false, nan
+        else:
+            bull_msb, bull_level, bear_msb, bear_level = msb
+        kind, z_low, z_high = fvg_scan_np(high, low, lookback)
+
+        # FVG rejection (check_fvg_rejection ile aynı kural, son mum)
+        l_open, l_high, l_low, l_close = open_[:, -1], high[:, -1], low[:, -1], close[:, -1]
+        touched = ~((l_high < z_low) | (l_low > z_high)) & (kind != 0)
+        bull_rej = touched & (kind == 1) & (l_close > l_open) & (l_close > z_low * (1 + ZONE_BUFFER / 2))
+        bear_rej = touched & (kind == -1) & (l_close < l_open) & (l_close < z_high * (1 - ZONE_BUFFER / 2))
 
-    # bearish FVG rejection
-    if fvg["type"] == "bearish":
-        if close < op and close < (z_high * (1 - ZONE_BUFFER / 2)):
-            return True
-        return False
+        # Mesafe filtresi: önce MSB seviyesi, yoksa FVG orta noktası
+        mid = (z_low + z_high) / 2.0
+        ref_long = np.where(bull_msb & (bull_level != 0), bull_level, np.where(bull_rej, mid, np.nan))
+        ref_short = np.where(bear_msb & (bear_level != 0), bear_level, np.where(bear_rej, mid, np.nan))
+        far_long = np.abs(l_close - ref_long) / ref_long > MAX_STRUCTURE_DISTANCE
+        far_short = np.abs(l_close - ref_short) / ref_short > MAX_STRUCTURE_DISTANCE
 
-    return False
+    structure_long = (bull_msb | bull_rej) & ~far_long & valid
+    structure_short = (bear_msb | bear_rej) & ~far_short & valid
+
+    return {
+        "valid": valid,
+        "bullish_msb": bull_msb & valid,
+        "bull_level": bull_level,
+        "bearish_msb": bear_msb & valid,
+        "bear_level": bear_level,
+        "fvg_kind": kind,
+        "fvg_low": z_low,
+        "fvg_high": z_high,
+        "bullish_fvg_reject": bull_rej & valid,
+        "bearish_fvg_reject": bear_rej & valid,
+        "structure_long": structure_long,
+        "structure_short": structure_short,
+    }
 
 
 # ------------ Yardımcı: Whale yaşı (dakika) ------------
@@ -499,125 +2925,153 @@ def whale_age_minutes(whale, last_candle_ts_ms):
         return None
 
 
-# ------------ Sembol Analizi (LONG + SHORT) ------------
+# ------------ Order-flow Şartları (LONG / SHORT) ------------
 
-def analyze_symbol(inst_id, mcap_map):
-    """
-    Tek coin için:
-    - MCAP sınıfı → HIGH/MID/LOW/MICRO
-    - FVG + MSB yapısı
-    - Orderflow + S/M/X whale + orderbook + net delta ile filtre
-    Hem LONG hem SHORT sinyalleri döndürür.
+def _whale_condition(whale, last_close, last_ts):
+    """Whale şartı + EK GÜVENLİK: fiyat yakınlığı (MAX_WHALE_DISTANCE) ve tazelik."""
+    if not whale:
+        return False
+    # Whale fiyatına uzaklık
+    try:
+        whale_px = float(whale["px"])
+        whale_dist = abs(last_close - whale_px) / whale_px
+    except Exception:
+        whale_dist = None
 
-    Bu versiyonda:
-    - MSB/FVG seviyesinden çok uzaklaşmış sinyaller elenir
-    - Whale fiyatından çok uzaklaşmış sinyaller elenir
-    - Whale işlemi çok eskiyse (4H+) sinyal elenir
-    Böylece tepeden/dipten geç gelen sinyaller büyük oranda süzülür.
-    """
-    candles = get_candles(inst_id)
-    if len(candles) < STRUCT_LOOKBACK + 3:
-        return []
+    # Whale yaşı (dakika)
+    age_min = whale_age_minutes(whale, last_ts)
 
-    last = candles[-1]
-    last_close = last["close"]
-    last_ts = last["ts"]
+    near_enough = (whale_dist is not None and whale_dist <= MAX_WHALE_DISTANCE)
+    fresh_enough = (age_min is None) or (age_min <= MAX_WHALE_AGE_MIN)
+    return near_enough and fresh_enough
 
-    base = inst_id.split("-")[0]
-    mcap_class = classify_mcap(base, mcap_map)
-    medium_thr, whale_thr, super_thr = whale_thresholds(mcap_class)
-    nd_pos_thr, nd_neg_thr = net_delta_thresholds(mcap_class)
 
-    trades = get_trades(inst_id)
-    if not trades:
-        return []
+def long_trade_conditions(last_close, last_ts, of, nd_pos_thr):
+    """LONG için sadece trade verisinden çıkan şartlar: (net delta, whale)."""
+    return of["net_delta"] >= nd_pos_thr, _whale_condition(of["buy_whale"], last_close, last_ts)
 
-    of = analyze_trades_orderflow(trades, medium_thr, whale_thr, super_thr)
-    book = get_orderbook(inst_id)
-    if not book:
-        return []
 
-    bid_n = book["bid_notional"]
-    ask_n = book["ask_notional"]
+def short_trade_conditions(last_close, last_ts, of, nd_neg_thr):
+    """SHORT için sadece trade verisinden çıkan şartlar: (net delta, whale)."""
+    return of["net_delta"] <= nd_neg_thr, _whale_condition(of["sell_whale"], last_close, last_ts)
 
-    # Yapı: MSB + FVG
-    bullish_msb, bull_level = detect_bullish_msb(candles)
-    bearish_msb, bear_level = detect_bearish_msb(candles)
-    fvg = find_recent_fvg(candles)
 
-    bullish_fvg_reject = False
-    bearish_fvg_reject = False
-    if fvg:
-        rej = check_fvg_rejection(candles, fvg)
-        if rej and fvg["type"] == "bullish":
-            bullish_fvg_reject = True
-        if rej and fvg["type"] == "bearish":
-            bearish_fvg_reject = True
+def long_flow_conditions(last_close, last_ts, of, book, nd_pos_thr, ob_factor=None):
+    """
+    LONG için yapı dışı şartlar: (net delta, orderbook baskısı, whale).
+    Whale şartı fiyat yakınlığı (MAX_WHALE_DISTANCE) ve tazeliği içerir.
+    ob_factor verilmezse OB_IMBALANCE_FACTOR kullanılır.
+    """
+    if ob_factor is None:
+        ob_factor = OB_IMBALANCE_FACTOR
+    cond_delta, cond_whale = long_trade_conditions(last_close, last_ts, of, nd_pos_thr)
+    # Orderbook baskısı şartı
+    cond_ob = book["bid_notional"] > book["ask_notional"] * ob_factor
+    return cond_delta, cond_ob, cond_whale
 
-    structure_long = bullish_msb or bullish_fvg_reject
-    structure_short = bearish_msb or bearish_fvg_reject
 
-    # --- EK GÜVENLİK 1: Yapı (MSB / FVG) seviyesinden çok uzaksa LONG/SHORT iptal ---
+def short_flow_conditions(last_close, last_ts, of, book, nd_neg_thr, ob_factor=None):
+    """
+    SHORT için yapı dışı şartlar: (net delta, orderbook baskısı, whale).
+    """
+    if ob_factor is None:
+        ob_factor = OB_IMBALANCE_FACTOR
+    cond_delta_s, cond_whale_s = short_trade_conditions(last_close, last_ts, of, nd_neg_thr)
+    # Orderbook baskısı şartı
+    cond_ob_s = book["ask_notional"] > book["bid_notional"] * ob_factor
+    return cond_delta_s, cond_ob_s, cond_whale_s
 
-    if structure_long:
-        ref_level = None
-        # Önce MSB seviyesi
-        if bullish_msb and bull_level:
-            ref_level = bull_level
-        # MSB yoksa, FVG seviyesinin ortasını referans al
-        elif bullish_fvg_reject and fvg and fvg["type"] == "bullish":
-            ref_level = (fvg["low"] + fvg["high"]) / 2.0
 
-        if ref_level:
-            dist = abs(last_close - ref_level) / ref_level
-            if dist > MAX_STRUCTURE_DISTANCE:
-                # Fiyat yapıya göre çok yürümüş → geç sinyal → iptal
-                structure_long = False
+# ------------ Sembol Analizi (LONG + SHORT) ------------
 
-    if structure_short:
-        ref_level_s = None
-        if bearish_msb and bear_level:
-            ref_level_s = bear_level
-        elif bearish_fvg_reject and fvg and fvg["type"] == "bearish":
-            ref_level_s = (fvg["low"] + fvg["high"]) / 2.0
+def symbol_thresholds(inst_id, mcap_map):
+    """MCAP sınıfı ve ona bağlı whale / net delta eşikleri."""
+    base = inst_id.split("-")[0]
+    mcap_class = classify_mcap(base, mcap_map)
+    return {
+        "mcap_class": mcap_class,
+        "whale": whale_thresholds(mcap_class),
+        "net_delta": net_delta_thresholds(mcap_class),
+    }
 
-        if ref_level_s:
-            dist_s = abs(last_close - ref_level_s) / ref_level_s
-            if dist_s > MAX_STRUCTURE_DISTANCE:
-                # Fiyat yapıya göre çok uzak → tepeden/dipten işlem açma
-                structure_short = False
 
-    signals = []
+def confirm_structure(structure_long, structure_short, confirm_candles, rule=None):
+    """
+    Üst TF yapısını alt TF (CONFIRM_BAR) yapısıyla onaylar.
+    - "align": alt TF ters yönde yapı veriyorsa sinyal iptal
+    - "both":  alt TF aynı yönde yapı vermeli
+    Alt TF verisi yetersizse "align" geçirir, "both" engeller.
+    Dönüş: (structure_long, structure_short, alt TF yönü "LONG"/"SHORT"/None)
+    """
+    rule = rule or MTF_CONFIRM
+    if rule == "off" or confirm_candles is None:
+        return structure_long, structure_short, None
+
+    if len(confirm_candles) < STRUCT_LOOKBACK + 3:
+        if rule == "both":
+            return False, False, None
+        return structure_long, structure_short, None
+
+    low = analyze_structure(confirm_candles)
+    low_long, low_short = low["structure_long"], low["structure_short"]
+    if rule == "both":
+        structure_long = structure_long and low_long
+        structure_short = structure_short and low_short
+    else:
+        structure_long = structure_long and not low_short
+        structure_short = structure_short and not low_long
 
-    # ---------- LONG ---------
-    if structure_long:
-        cond_struct = True
+    low_side = None
+    if low_long and not low_short:
+        low_side = "LONG"
+    elif low_short and not low_long:
+        low_side = "SHORT"
+    return structure_long, structure_short, low_side
 
-        # Net delta şartı
-        cond_delta = of["net_delta"] >= nd_pos_thr
 
-        # Orderbook baskısı şartı
-        cond_ob = bid_n > ask_n * 1.3
+def structure_stage(candles, confirm_candles=None, structure=None):
+    """
+    analyze_structure + alt TF onayı; structure_long / short onaylanmış haldedir.
+    structure verilirse (ör. RollingStructure'dan) yeniden hesaplanmaz.
+    """
+    st = dict(structure) if structure is not None else analyze_structure(candles)
+    st["structure_long"], st["structure_short"], st["confirm_side"] = confirm_structure(
+        st["structure_long"], st["structure_short"], confirm_candles
+    )
+    return st
+
+
+def trades_can_reach(st, of, last, thr):
+    """
+    Trade şartlarından sonra (orderbook henüz yok) MIN_CONDITIONS_STRICT'e
+    en az bir yönde ulaşılabilir mi? Orderbook şartı sağlanmış varsayılır.
+    """
+    nd_pos_thr, nd_neg_thr = thr["net_delta"]
+    if st["structure_long"]:
+        if 2 + sum(long_trade_conditions(last["close"], last["ts"], of, nd_pos_thr)) >= MIN_CONDITIONS_STRICT:
+            return True
+    if st["structure_short"]:
+        if 2 + sum(short_trade_conditions(last["close"], last["ts"], of, nd_neg_thr)) >= MIN_CONDITIONS_STRICT:
+            return True
+    return False
 
-        # Whale şartı + EK GÜVENLİK (fiyat yakınlığı + tazelik)
-        w_buy = of["buy_whale"]
-        cond_whale = False
-        if w_buy:
-            # Whale fiyatına uzaklık
-            try:
-                whale_px = float(w_buy["px"])
-                whale_dist = abs(last_close - whale_px) / whale_px
-            except Exception:
-                whale_dist = None
 
-            # Whale yaşı (dakika)
-            age_min = whale_age_minutes(w_buy, last_ts)
+def build_signals(inst_id, last, thr, st, of, book):
+    """Yapı + order-flow + orderbook şartlarından LONG / SHORT sinyalleri."""
+    last_close = last["close"]
+    last_ts = last["ts"]
+    mcap_class = thr["mcap_class"]
+    nd_pos_thr, nd_neg_thr = thr["net_delta"]
+
+    signals = []
 
-            near_enough = (whale_dist is not None and whale_dist <= MAX_WHALE_DISTANCE)
-            fresh_enough = (age_min is None) or (age_min <= MAX_WHALE_AGE_MIN)
+    # ---------- LONG ---------
+    if st["structure_long"]:
+        cond_struct = True
 
-            if near_enough and fresh_enough:
-                cond_whale = True
+        cond_delta, cond_ob, cond_whale = long_flow_conditions(
+            last_close, last_ts, of, book, nd_pos_thr
+        )
 
         conds = [cond_struct, cond_delta, cond_ob, cond_whale]
         true_count = sum(conds)
@@ -632,41 +3086,22 @@ def analyze_symbol(inst_id, mcap_map):
                 "orderbook": book,
                 "confidence": confidence,
                 "structure": {
-                    "bull_msb": bullish_msb,
-                    "bull_level": bull_level,
-                    "bull_fvg_reject": bullish_fvg_reject,
+                    "bull_msb": st["bullish_msb"],
+                    "bull_level": st["bull_level"],
+                    "bull_fvg_reject": st["bullish_fvg_reject"],
                     "mcap_class": mcap_class,
+                    "confirm_side": st["confirm_side"],
                 },
             }
             signals.append(signal)
 
     # ---------- SHORT ---------
-    if structure_short:
+    if st["structure_short"]:
         cond_struct_s = True
 
-        # Net delta şartı
-        cond_delta_s = of["net_delta"] <= nd_neg_thr
-
-        # Orderbook baskısı şartı
-        cond_ob_s = ask_n > bid_n * 1.3
-
-        # Whale şartı + EK GÜVENLİK (fiyat yakınlığı + tazelik)
-        w_sell = of["sell_whale"]
-        cond_whale_s = False
-        if w_sell:
-            try:
-                whale_px_s = float(w_sell["px"])
-                whale_dist_s = abs(last_close - whale_px_s) / whale_px_s
-            except Exception:
-                whale_dist_s = None
-
-            age_min_s = whale_age_minutes(w_sell, last_ts)
-
-            near_enough_s = (whale_dist_s is not None and whale_dist_s <= MAX_WHALE_DISTANCE)
-            fresh_enough_s = (age_min_s is None) or (age_min_s <= MAX_WHALE_AGE_MIN)
-
-            if near_enough_s and fresh_enough_s:
-                cond_whale_s = True
+        cond_delta_s, cond_ob_s, cond_whale_s = short_flow_conditions(
+            last_close, last_ts, of, book, nd_neg_thr
+        )
 
         conds_s = [cond_struct_s, cond_delta_s, cond_ob_s, cond_whale_s]
         true_count_s = sum(conds_s)
@@ -681,10 +3116,11 @@ def analyze_symbol(inst_id, mcap_map):
                 "orderbook": book,
                 "confidence": confidence_s,
                 "structure": {
-                    "bear_msb": bearish_msb,
-                    "bear_level": bear_level,
-                    "bear_fvg_reject": bearish_fvg_reject,
+                    "bear_msb": st["bearish_msb"],
+                    "bear_level": st["bear_level"],
+                    "bear_fvg_reject": st["bearish_fvg_reject"],
                     "mcap_class": mcap_class,
+                    "confirm_side": st["confirm_side"],
                 },
             }
             signals.append(signal)
@@ -692,29 +3128,121 @@ def analyze_symbol(inst_id, mcap_map):
     return signals
 
 
+def analyze_symbol(inst_id, mcap_map, executor=None, stream=None):
+    """
+    Maliyet sırasına göre aşamalı değerlendirme:
+      candles → yapı (MSB/FVG + mesafe + alt TF onayı) → trades → orderbook.
+    Bir aşamadan sonra MIN_CONDITIONS_STRICT'e ulaşılamıyorsa sonraki
+    (pahalı) uçlar hiç çağrılmaz; her aşamanın geçti/kaldı sayısı METRICS'te.
+    stream verilirse trades/orderbook WebSocket akışından okunur (REST yok).
+    executor verilirse yapı geçtikten sonra trades ve orderbook paralel
+    çekilir (trades aşaması kalırsa orderbook yanıtı kullanılmaz); yoksa
+    tamamen sıralı. Sonuç evaluate_symbol ile aynıdır.
+    """
+    mtf = get_mtf_candles(inst_id)
+    candles = mtf[BAR]
+    if not METRICS.observe_gate("candles", len(candles) >= STRUCT_LOOKBACK + 3):
+        return []
+
+    t0 = time.perf_counter()
+    st = structure_stage(candles, mtf.get(CONFIRM_BAR))
+    cpu = time.perf_counter() - t0
+    if not METRICS.observe_gate("structure", st["structure_long"] or st["structure_short"]):
+        METRICS.observe_symbol(inst_id, cpu)
+        return []
+
+    f_book = None
+    if stream is not None:
+        trades = stream.trades(inst_id)
+    elif executor is not None:
+        f_trades = executor.submit(get_orderflow_trades, inst_id)
+        f_book = executor.submit(get_orderbook, inst_id)
+        trades = f_trades.result()
+    else:
+        trades = get_orderflow_trades(inst_id)
+
+    t0 = time.perf_counter()
+    thr = symbol_thresholds(inst_id, mcap_map)
+    of = analyze_trades_orderflow(trades, *thr["whale"]) if trades else None
+    alive = of is not None and trades_can_reach(st, of, candles[-1], thr)
+    cpu += time.perf_counter() - t0
+    if f_book is not None:
+        # paralel çekilen orderbook kullanılmayacaksa boşa giden çağrı sayılır
+        METRICS.observe_gate("book_prefetch", alive or f_book.cancel())
+    if not METRICS.observe_gate("trades", alive):
+        METRICS.observe_symbol(inst_id, cpu)
+        return []
+
+    if stream is not None:
+        book = stream.book(inst_id)
+    elif f_book is not None:
+        book = f_book.result()
+    else:
+        book = get_orderbook(inst_id)
+    if not METRICS.observe_gate("book", bool(book)):
+        METRICS.observe_symbol(inst_id, cpu)
+        return []
+
+    t0 = time.perf_counter()
+    signals = build_signals(inst_id, candles[-1], thr, st, of, book)
+    METRICS.observe_symbol(inst_id, cpu + time.perf_counter() - t0)
+    METRICS.observe_gate("signal", bool(signals))
+    if signals:
+        # indikatörler sadece mesajda kullanılır: ısınma yalnızca sinyal veren semboller için
+        ind = INDICATORS.indicators(inst_id, BAR, candles)
+        for sig in signals:
+            sig["indicators"] = ind
+    return signals
+
+
+def evaluate_symbol(inst_id, candles, trades, book, mcap_map, confirm_candles=None, structure=None):
+    """
+    Tek coin için (veri hazır verilir, ağ yok):
+    - MCAP sınıfı → HIGH/MID/LOW/MICRO
+    - FVG + MSB yapısı
+    - Orderflow + S/M/X whale + orderbook + net delta ile filtre
+    Hem LONG hem SHORT sinyalleri döndürür.
+
+    Bu versiyonda:
+    - MSB/FVG seviyesinden çok uzaklaşmış sinyaller elenir
+    - Whale fiyatından çok uzaklaşmış sinyaller elenir
+    - Whale işlemi çok eskiyse (4H+) sinyal elenir
+    Böylece tepeden/dipten geç gelen sinyaller büyük oranda süzülür.
+
+    confirm_candles (CONFIRM_BAR mumları) verilirse yapı MTF_CONFIRM
+    kuralıyla alt zaman diliminde onaylanır. structure, candles için önceden
+    hesaplanmış analyze_structure sonucudur (verilmezse hesaplanır).
+    """
+    if len(candles) < STRUCT_LOOKBACK + 3:
+        return []
+    if not trades or not book:
+        return []
+
+    thr = symbol_thresholds(inst_id, mcap_map)
+    of = analyze_trades_orderflow(trades, *thr["whale"])
+    st = structure_stage(candles, confirm_candles, structure)
+    return build_signals(inst_id, candles[-1], thr, st, of, book)
+
+
 # ------------ BTC & ETH Piyasa Özeti ------------
 
-def get_trend_summary(inst_id, mcap_map):
+def get_trend_summary(inst_id, mcap_map, stream=None):
     candles = get_candles(inst_id)
     if len(candles) < 50:
         return None
 
-    closes = [c["close"] for c in candles]
-    last = closes[-1]
+    last = candles[-1]["close"]
 
-    ema200 = ema(closes, 200) if len(closes) >= 200 else None
-    ema_fast = ema(closes, 12)
-    ema_slow = ema(closes, 26)
-
-    macd = None
-    if ema_fast is not None and ema_slow is not None:
-        macd = ema_fast - ema_slow
+    # Artımlı indikatör durumu (uzun geçmişle ısınmış EMA200 / MACD)
+    ind = INDICATORS.indicators(inst_id, BAR, candles)
+    ema200 = ind["ema200"]
+    macd = ind["macd"]
 
     base = inst_id.split("-")[0]
     mcap_class = classify_mcap(base, mcap_map)
     medium_thr, whale_thr, super_thr = whale_thresholds(mcap_class)
 
-    trades = get_trades(inst_id)
+    trades = stream.trades(inst_id) if stream is not None else get_orderflow_trades(inst_id)
     of = analyze_trades_orderflow(trades, medium_thr, whale_thr, super_thr) if trades else None
 
     # Trend yorumu
@@ -758,6 +3286,7 @@ def get_trend_summary(inst_id, mcap_map):
         "delta_txt": delta_txt,
         "whale_txt": whale_txt,
         "mcap_class": mcap_class,
+        "indicators": ind,
     }
 
 
@@ -815,6 +3344,9 @@ def build_telegram_message(btc_info, eth_info, signals):
             if s["structure"].get("bear_fvg_reject"):
                 struct_txt.append("Bearish FVG retest")
 
+        if s["structure"].get("confirm_side") == s["side"]:
+            struct_txt.append(f"{CONFIRM_BAR} onaylı")
+
         struct_str = ", ".join(struct_txt) if struct_txt else "Yapı: N/A"
 
         lines.append(f"\n*{s['inst_id']} ({s['side']})* {mcap_nice_label(mcap_class)}")
@@ -825,6 +3357,9 @@ def build_telegram_message(btc_info, eth_info, signals):
             f"- Orderbook (Bid/Ask notional): `{book['bid_notional']:.0f} / {book['ask_notional']:.0f}`"
         )
         lines.append(f"- Güven puanı: *%{s['confidence']}*")
+        ind = s.get("indicators")
+        if ind and ind["rsi"] is not None and ind["atr_pct"] is not None:
+            lines.append(f"- RSI: `{ind['rsi']:.0f}` · ATR: `%{ind['atr_pct'] * 100:.1f}`")
 
         if w:
             lines.append(
@@ -847,51 +3382,611 @@ def build_telegram_message(btc_info, eth_info, signals):
     return "\n".join(lines)
 
 
+# ------------ Ticker Ön Filtresi ------------
+
+def _ticker_float(ticker, key):
+    try:
+        return float(ticker.get(key) or "")
+    except ValueError:
+        return None
+
+
+def structure_possible(closed, last, high24h=None, low24h=None, partial=None,
+                       lookback=STRUCT_LOOKBACK, margin=PREFILTER_MARGIN):
+    """
+    Kapanmış mumlar + oluşan barın anlık fiyatı (ticker last) ile bu barda
+    analyze_structure'ın structure_long / structure_short verip veremeyeceği.
+    Oluşan barın high/low'u bilinmediği için muhafazakârdır: gerçek sonuç
+    True olabilecekse True döner (yanlış negatif yok, yanlış pozitif olabilir).
+    high24h / low24h verilirse FVG'ye değme ihtimali bu aralıkla sınırlanır.
+    partial: oluşan barın şimdiye kadarki parçaları (örn. kapanmış 1H mumları);
+    bar açılışını ve high/low sınırlarını verir.
+    Dönüş: (long_possible, short_possible)
+    """
+    if len(closed) < lookback + 2:
+        return True, True
+
+    d = MAX_STRUCTURE_DISTANCE
+    up, down = last * (1 + margin), last * (1 - margin)
+    hi = high24h if high24h is not None else float("inf")
+    lo = low24h if low24h is not None else 0.0
+
+    # MSB: seviye kapanmış barlardan kesin bilinir
+    window = [c["close"] for c in closed[-lookback:]]
+    bull_level, bear_level = max(window), min(window)
+    long_ok = up > bull_level * 1.001 and down <= bull_level * (1 + d)
+    short_ok = down < bear_level * 0.999 and up >= bear_level * (1 - d)
+
+    # Oluşan bar: açılış kesin, low en fazla / high en az şimdiye kadarki değer
+    op = partial[0]["open"] if partial else None
+    low_max = min([c["low"] for c in partial or []] + [up])
+    high_min = max([c["high"] for c in partial or []] + [down])
+
+    # Kapanmış barlardaki son FVG: find_recent_fvg'nin oluşan bar hariç aynı
+    # penceresi (oluşan bar yeni bir FVG ile ezebilir → aşağıda)
+    fvg = find_recent_fvg(closed, lookback - 1)
+    if fvg and lo <= fvg["high"] and hi >= fvg["low"]:
+        mid = (fvg["low"] + fvg["high"]) / 2.0
+        near = down <= mid * (1 + d + margin) and up >= mid * (1 - d - margin)
+        if (fvg["type"] == "bullish" and near and up > fvg["low"] * (1 + ZONE_BUFFER / 2)
+                and (op is None or up > op)):
+            long_ok = True
+        if (fvg["type"] == "bearish" and near and down < fvg["high"] * (1 - ZONE_BUFFER / 2)
+                and (op is None or down < op)):
+            short_ok = True
+
+    # Oluşan bar ile c1 = closed[-2] arasında yeni FVG ihtimali
+    c1 = closed[-2]
+    if low_max > c1["high"] and down <= (c1["high"] + low_max) / 2 * (1 + d):
+        long_ok = True
+    if high_min < c1["low"] and up >= (c1["low"] + high_min) / 2 * (1 - d):
+        short_ok = True
+    return long_ok, short_ok
+
+
+def prefilter_symbols(symbols, tickers=None, bar=BAR):
+    """
+    Ticker (last / high24h / low24h) + mum önbelleğindeki kapanmış seviyelerle
+    yapı şartını sağlayamayacak sembolleri eler; kalanlar trades / orderbook
+    aşamasına geçer. Önbellek güncel değilse mumlar çekilir (aynı turda
+    analyze_symbol tekrar çekmez). Şüphede sembol elenmez.
+    Dönüş: elenmemiş semboller (sıra korunur).
+    """
+    if tickers is None:
+        tickers = get_spot_usdt_tickers()
+    forming_ts = current_bar_open_ms(bar)
+    prev_ts = forming_ts - bar_to_ms(bar)
+
+    def keep(inst_id):
+        t = tickers.get(inst_id)
+        last = _ticker_float(t, "last") if t else None
+        if not last:
+            return True
+
+        closed, partial = [], []
+        if CANDLE_STORE is not None and _resample_ratio(bar):
+            base = CANDLE_STORE.peek(inst_id, RESAMPLE_FROM)
+            if base:
+                closed = resample_closed_candles(base, bar)
+                partial = [c for c in base if c["ts"] >= forming_ts]
+        else:
+            closed = cached_closed_candles(inst_id, bar)
+
+        if not closed or closed[-1]["ts"] != prev_ts:
+            # önbellek eski → mumları şimdi çek (aynı turda analiz tekrar çekmez)
+            candles = get_mtf_candles(inst_id)[bar]
+            closed = [c for c in candles if c["ts"] < forming_ts]
+            partial = [c for c in candles if c["ts"] == forming_ts]
+            if not closed or closed[-1]["ts"] != prev_ts:
+                return True
+
+        INDICATORS.advance(inst_id, bar, closed)
+        long_ok, short_ok = structure_possible(
+            closed, last, _ticker_float(t, "high24h"), _ticker_float(t, "low24h"), partial
+        )
+        return long_ok or short_ok
+
+    with ThreadPoolExecutor(max_workers=max(1, SCAN_WORKERS)) as pool:
+        flags = list(pool.map(keep, symbols))
+    return [s for s, ok in zip(symbols, flags) if ok]
+
+
+# ------------ Tarama ------------
+
+def _report_symbol(i, total, inst_id, sigs):
+    print(f"[{i}/{total}] {inst_id} analiz edildi.")
+    for s in sigs:
+        print(f"  → Sinyal bulundu: {inst_id} ({s['side']})  Güven %{s['confidence']}")
+
+
+def scan_symbols(symbols, mcap_map, workers=SCAN_WORKERS, stream=None):
+    """
+    Sembol listesini tarar, sinyalleri sembol sırasına göre döndürür.
+    workers <= 1 → seri tarama, aksi halde sınırlı thread havuzu.
+    Çıktı sırası iki modda da aynıdır (diff alınabilir).
+    stream verilirse trades/orderbook akıştan okunur.
+    """
+    total = len(symbols)
+    all_signals = []
+
+    if workers <= 1:
+        for i, inst_id in enumerate(symbols, start=1):
+            try:
+                sigs = analyze_symbol(inst_id, mcap_map, stream=stream)
+                _report_symbol(i, total, inst_id, sigs)
+                all_signals.extend(sigs)
+            except Exception as e:
+                print(f"  {inst_id} analiz hatası:", e)
+        return all_signals
+
+    # Sembol havuzu ve uç (endpoint) havuzu ayrı: iç içe submit kilitlenmesin
+    with ThreadPoolExecutor(max_workers=workers) as sym_pool, \
+            ThreadPoolExecutor(max_workers=workers * 3) as fetch_pool:
+        futures = [
+            sym_pool.submit(analyze_symbol, inst_id, mcap_map, fetch_pool, stream)
+            for inst_id in symbols
+        ]
+        for i, (inst_id, fut) in enumerate(zip(symbols, futures), start=1):
+            try:
+                sigs = fut.result()
+                _report_symbol(i, total, inst_id, sigs)
+                all_signals.extend(sigs)
+            except Exception as e:
+                print(f"  {inst_id} analiz hatası:", e)
+
+    return all_signals
+
+
 # ------------ MAIN ------------
 
 def main():
     print(f"[{ts()}] Bot çalışıyor...")
+    METRICS.reset()
+    try:
+        run_scan_cycle()
+    finally:
+        METRICS.write_json()
+        METRICS.write_prometheus()
+
+
+def run_scan_cycle(symbols=None):
+    """
+    Tek tarama turu. symbols verilirse ticker listesi çekilmez
+    (daemon sıcak evreni tekrar kullanır). Tur boyunca istek önbelleği açıktır.
+    """
+    with REQUEST_CACHE.scope():
+        _scan_cycle(symbols)
+    INDICATORS.save()
 
-    # MCAP haritası (CoinGecko)
-    print("CoinGecko market cap verisi çekiliyor...")
-    mcap_map = load_mcap_map()
-    print(f"MCAP haritası yüklendi. Sembol sayısı: {len(mcap_map)}")
 
-    # BTC & ETH piyasa özeti
-    btc_info = get_trend_summary("BTC-USDT", mcap_map)
-    eth_info = get_trend_summary("ETH-USDT", mcap_map)
+def _scan_cycle(symbols):
+    # MCAP haritası (CoinGecko)
+    print("CoinGecko market cap verisi yükleniyor (önbellek)...")
+    with METRICS.stage("mcap_load"):
+        mcap_map = MCAP_CACHE.get()
+    age_min = (time.time() - mcap_map.fetched_at) / 60 if mcap_map.fetched_at else 0
+    print(f"MCAP haritası yüklendi. Sembol sayısı: {len(mcap_map)} (yaş: {age_min:.0f} dk)")
 
     # Top 150 USDT spot listesi (OKX hacme göre)
+    if symbols is None:
+        with METRICS.stage("ticker_list"):
+            symbols = get_spot_usdt_top_symbols(limit=TOP_LIMIT)
+    if not symbols:
+        print("Top USDT listesi alınamadı.")
+        return
+
+    all_signals = scan_universe(symbols, mcap_map)
+
+    if not all_signals:
+        print("Bu turda sinyal yok. Telegram'a mesaj gönderilmeyecek.")
+        return
+
+    # BTC & ETH piyasa özeti (sadece gönderilecek mesaj için)
+    with METRICS.stage("trend_summary"):
+        btc_info = get_trend_summary("BTC-USDT", mcap_map)
+        eth_info = get_trend_summary("ETH-USDT", mcap_map)
+
+    msg = build_telegram_message(btc_info, eth_info, all_signals)
+    with METRICS.stage("telegram"):
+        telegram(msg)
+    print("✅ Telegram'a sinyal mesajı gönderildi.")
+
+
+def scan_universe(symbols, mcap_map):
+    """
+    Ön filtre + tarama + tur istatistikleri; sinyalleri döndürür (Telegram'a
+    göndermez). Tek process turu ve shard.py parçaları ortak kullanır.
+    """
+    if PREFILTER_ENABLED:
+        with METRICS.stage("prefilter"):
+            candidates = prefilter_symbols(symbols)
+        print(f"Ön filtre: {len(symbols)} sembolden {len(candidates)} tanesi yapı mesafesinde.")
+        METRICS.set_gauge("symbols_prefiltered_out", len(symbols) - len(candidates))
+        symbols = candidates
+
+    print(f"{len(symbols)} sembol taranıyor... (workers={SCAN_WORKERS})")
+
+    with METRICS.stage("scan"):
+        all_signals = scan_symbols(symbols, mcap_map)
+    METRICS.set_gauge("symbols_scanned", len(symbols))
+    METRICS.set_gauge("signals", len(all_signals))
+    print(METRICS.gates_line())
+    print(OKX_LIMITER.stats_line())
+    print(HTTP.stats_line())
+    print(DATA_SOURCE.stats_line())
+    if CANDLE_STORE is not None:
+        print(CANDLE_STORE.stats_line())
+    print(INDICATORS.stats_line())
+    if REQUEST_CACHE.active:
+        print(REQUEST_CACHE.stats_line())
+        METRICS.set_gauge("request_cache_hits", REQUEST_CACHE.hits)
+        METRICS.set_gauge("request_cache_misses", REQUEST_CACHE.misses)
+    return all_signals
+
+
+def run_stream():
+    """
+    Uzun süre çalışan akış modu: evren için WebSocket aboneliği açılır,
+    her STREAM_SCAN_INTERVAL saniyede bir tarama akıştaki veriden yapılır.
+    """
+    print(f"[{ts()}] Akış modu başlıyor...")
+    mcap_map = MCAP_CACHE.get()
     symbols = get_spot_usdt_top_symbols(limit=TOP_LIMIT)
     if not symbols:
         print("Top USDT listesi alınamadı.")
         return
 
-    print(f"{len(symbols)} sembol taranıyor...")
+    stream = MarketStream(["BTC-USDT", "ETH-USDT"] + symbols)
+    stream.start()
+    print(f"{len(stream.symbols)} sembol için akış açıldı, {STREAM_WARMUP} sn ısınma...")
+    time.sleep(STREAM_WARMUP)
+
+    try:
+        while True:
+            mcap_map = MCAP_CACHE.get()
+            with REQUEST_CACHE.scope():
+                all_signals = scan_symbols(symbols, mcap_map, stream=stream)
+                if all_signals:
+                    btc_info = get_trend_summary("BTC-USDT", mcap_map, stream)
+                    eth_info = get_trend_summary("ETH-USDT", mcap_map, stream)
+                if REQUEST_CACHE.active:
+                    print(REQUEST_CACHE.stats_line())
+            INDICATORS.save()
+            print(stream.stats_line())
+            if all_signals:
+                telegram(build_telegram_message(btc_info, eth_info, all_signals))
+                print("✅ Telegram'a sinyal mesajı gönderildi.")
+            else:
+                print("Bu turda sinyal yok.")
+            time.sleep(STREAM_SCAN_INTERVAL)
+    finally:
+        stream.stop()
+
+
+# ------------ Daemon / Zamanlayıcı ------------
+
+def okx_clock_offset_ms():
+    """OKX sunucu saati - yerel saat (ms). Alınamazsa 0."""
+    t0 = time.time()
+    data = jget_okx("/api/v5/public/time")
+    if not data:
+        return 0
+    try:
+        server_ms = int(data[0]["ts"])
+    except (KeyError, IndexError, TypeError, ValueError):
+        return 0
+    local_ms = int((t0 + time.time()) / 2 * 1000)
+    return server_ms - local_ms
+
+
+def next_bar_close_ms(bars, now_ms):
+    """Verilen barların (örn. ["1H", "4H"]) en yakın kapanış zamanı."""
+    closes = []
+    for bar in bars:
+        bar_ms = bar_to_ms(bar)
+        closes.append(now_ms - now_ms % bar_ms + bar_ms)
+    return min(closes)
+
+
+class Daemon:
+    """
+    Uzun süre çalışan zamanlayıcı: her bar kapanışından DAEMON_CLOSE_DELAY sn
+    sonra bir tarama turu koşar. Turlar arasında sıcak kalan durum:
+    HTTP bağlantı havuzu, mum önbelleği (bellekte), MCAP indeksi (TTL ile)
+    ve sembol evreni (UNIVERSE_REFRESH_S'de bir yenilenir).
+    """
+
+    def __init__(self, bars=None):
+        self.bars = bars or [b.strip() for b in DAEMON_BARS.split(",") if b.strip()]
+        self.stop_event = threading.Event()
+        self.symbols = None
+        self.universe_at = 0.0
+        self.clock_offset_ms = 0
+        self.cycles = 0
+
+    def stop(self, *_):
+        print("Daemon durduruluyor...")
+        self.stop_event.set()
+
+    def now_ms(self):
+        return int(time.time() * 1000) + self.clock_offset_ms
+
+    def refresh_universe(self):
+        if self.symbols and time.time() - self.universe_at < UNIVERSE_REFRESH_S:
+            return
+        with METRICS.stage("ticker_list"):
+            symbols = get_spot_usdt_top_symbols(limit=TOP_LIMIT)
+        if symbols:
+            self.symbols = symbols
+            self.universe_at = time.time()
+            self.clock_offset_ms = okx_clock_offset_ms()
+            print(f"Evren yenilendi: {len(symbols)} sembol (saat farkı {self.clock_offset_ms} ms)")
+
+    def run_cycle(self):
+        self.cycles += 1
+        METRICS.reset()
+        try:
+            self.refresh_universe()
+            if not self.symbols:
+                print("Top USDT listesi alınamadı, tur atlandı.")
+                return
+            run_scan_cycle(self.symbols)
+        except Exception as e:
+            print("Tur hatası:", e)
+        finally:
+            METRICS.set_gauge("daemon_cycles", self.cycles)
+            METRICS.write_json()
+            METRICS.write_prometheus()
+
+    def run(self):
+        print(f"[{ts()}] Daemon başlıyor (tetik barları: {', '.join(self.bars)})")
+        self.refresh_universe()
+        while not self.stop_event.is_set():
+            now = self.now_ms()
+            target = next_bar_close_ms(self.bars, now) + DAEMON_CLOSE_DELAY * 1000
+            wait_s = (target - now) / 1000
+            print(f"Sonraki tur: {wait_s:.0f} sn sonra")
+            if self.stop_event.wait(wait_s):
+                break
+            t0 = time.perf_counter()
+            print(f"[{ts()}] Bar kapanışı → tur #{self.cycles + 1}")
+            self.run_cycle()
+            print(f"Tur süresi: {time.perf_counter() - t0:.1f} sn")
+
+
+def run_daemon():
+    daemon = Daemon()
+    signal.signal(signal.SIGTERM, daemon.stop)
+    signal.signal(signal.SIGINT, daemon.stop)
+    daemon.run()
+
+
+# ------------ Bar Kapanışı Tetikli Değerlendirme ------------
+
+class BarCloseTrigger:
+    """
+    WebSocket candle push'larından sembol başına bar kapanışını yakalar.
+    confirm="1" geldiğinde ya da (sessiz sembollerde) yeni bir bar ts'i
+    görüldüğünde önceki bar için on_close(inst_id, candle) bir kez çağrılır.
+    """
+
+    def __init__(self, on_close):
+        self.on_close = on_close
+        self.last = {}      # inst_id → [ts, candle, fired]
+        self.lock = threading.Lock()
+
+    def on_candle(self, inst_id, rows, bar=None):
+        for row in rows:
+            try:
+                ts_ms = int(row[0])
+                candle = {
+                    "ts": ts_ms,
+                    "open": float(row[1]),
+                    "high": float(row[2]),
+                    "low": float(row[3]),
+                    "close": float(row[4]),
+                }
+            except Exception:
+                continue
+            confirmed = len(row) > 8 and row[8] == "1"
+
+            fire = []
+            with self.lock:
+                prev = self.last.get(inst_id)
+                if prev and ts_ms > prev[0] and not prev[2]:
+                    fire.append(prev[1])       # önceki bar confirm gelmeden kapandı
+                if prev and ts_ms < prev[0]:
+                    continue                   # geç gelen eski push
+                already = bool(prev and prev[0] == ts_ms and prev[2])
+                if confirmed and not already:
+                    fire.append(candle)
+                self.last[inst_id] = [ts_ms, candle, confirmed or already]
+
+            for c in fire:
+                self.on_close(inst_id, c)
+
+
+class BarCloseRunner:
+    """
+    Bar kapanışında sembolü hemen değerlendirir: kapanan mum geçmişe eklenir,
+    trades / orderbook akıştan okunur (REST yok), sinyal varsa Telegram'a
+    anında gider. MSB / FVG yapısı sembol başına RollingStructure ile bar
+    başına O(1) güncellenir. Alt TF onayı için CONFIRM_BAR mumları da aynı
+    candle akışından (sadece kapanmış barlar) tutulur; kapanış yolunda REST
+    yoktur. Kapanış → uyarı gecikmesi METRICS'e yazılır.
+    """
+
+    def __init__(self, symbols, bar=BAR, workers=SCAN_WORKERS):
+        self.symbols = list(dict.fromkeys(symbols))
+        self.bar = bar
+        self.bar_ms = bar_to_ms(bar)
+        self.confirm_bar = CONFIRM_BAR if MTF_CONFIRM != "off" and CONFIRM_BAR != bar else None
+        self.history = {}
+        self.confirm_history = {}
+        self.structures = {}
+        self.lock = threading.Lock()
+        self.confirm_ready = threading.Condition(self.lock)
+        self.pool = ThreadPoolExecutor(max_workers=max(1, workers))
+        self.trigger = BarCloseTrigger(self._submit)
+        self.confirm_trigger = BarCloseTrigger(self._on_confirm_close)
+        self.stream = MarketStream(self.symbols)
+        channels = [f"candle{bar}"] + ([f"candle{self.confirm_bar}"] if self.confirm_bar else [])
+        self.candle_stream = MarketStream(
+            self.symbols, url=OKX_WS_BUSINESS_URL, channels=channels, on_candle=self._on_candle
+        )
+        self.latency = Histogram((0.1, 0.25, 0.5, 1.0, 2.0, 5.0))
+
+    def warm_up(self):
+        """Kapanmış mum geçmişini (BAR + CONFIRM_BAR; önbellek / REST) bir kez yükler."""
+        bars = (self.bar, self.confirm_bar) if self.confirm_bar else (self.bar,)
+        forming = {bar: current_bar_open_ms(bar) for bar in bars}
+        with ThreadPoolExecutor(max_workers=max(1, SCAN_WORKERS)) as pool:
+            for inst_id, mtf in zip(self.symbols, pool.map(lambda i: get_mtf_candles(i, bars), self.symbols)):
+                closed = [c for c in mtf[self.bar] if c["ts"] < forming[self.bar]]
+                self.history[inst_id] = closed
+                self.structures[inst_id] = RollingStructure()
+                self.structures[inst_id].extend(closed)
+                if self.confirm_bar:
+                    self.confirm_history[inst_id] = [
+                        c for c in mtf[self.confirm_bar] if c["ts"] < forming[self.confirm_bar]
+                    ]
+
+    def start(self):
+        self.warm_up()
+        self.stream.start()
+        self.candle_stream.start()
+
+    def stop(self):
+        self.candle_stream.stop()
+        self.stream.stop()
+        self.pool.shutdown(wait=False)
+
+    def _on_candle(self, inst_id, rows, bar):
+        if bar == self.bar:
+            self.trigger.on_candle(inst_id, rows)
+        elif bar == self.confirm_bar:
+            self.confirm_trigger.on_candle(inst_id, rows)
+
+    def _submit(self, inst_id, candle):
+        # WS okuyucu thread'ini bloklamamak için değerlendirme havuzda
+        self.pool.submit(self.evaluate, inst_id, candle)
+
+    def _on_confirm_close(self, inst_id, candle):
+        with self.confirm_ready:
+            hist = self.confirm_history.setdefault(inst_id, [])
+            if hist and hist[-1]["ts"] >= candle["ts"]:
+                return
+            hist.append(candle)
+            del hist[:-CANDLE_LIMIT]
+            self.confirm_ready.notify_all()
+
+    def confirm_candles(self, inst_id, close_ms):
+        """
+        close_ms'e kadar kapanmış CONFIRM_BAR mumları (akıştan, REST yok).
+        BAR ile aynı anda kapanan alt TF mumunun push'u en fazla
+        BAR_CLOSE_CONFIRM_WAIT sn beklenir; gelmezse eldeki kapanmış barlar.
+        """
+        if self.confirm_bar is None:
+            return None
+        last_open = close_ms - bar_to_ms(self.confirm_bar)
+
+        def arrived():
+            hist = self.confirm_history.get(inst_id)
+            return bool(hist) and hist[-1]["ts"] >= last_open
+
+        with self.confirm_ready:
+            self.confirm_ready.wait_for(arrived, timeout=BAR_CLOSE_CONFIRM_WAIT)
+            return [c for c in self.confirm_history.get(inst_id, []) if c["ts"] <= last_open]
+
+    def evaluate(self, inst_id, candle):
+        with self.lock:
+            hist = self.history.setdefault(inst_id, [])
+            if hist and hist[-1]["ts"] >= candle["ts"]:
+                return []
+            hist.append(candle)
+            del hist[:-CANDLE_LIMIT]
+            candles = list(hist)
+            rolling = self.structures.get(inst_id)
+            if rolling is None:
+                rolling = self.structures[inst_id] = RollingStructure()
+                rolling.extend(candles[:-1])
+            structure = rolling.update(candle)[STRUCT_LOOKBACK]
 
-    all_signals = []
-    for i, inst_id in enumerate(symbols, start=1):
-        print(f"[{i}/{len(symbols)}] {inst_id} analiz ediliyor...")
         try:
-            sigs = analyze_symbol(inst_id, mcap_map)
+            confirm = self.confirm_candles(inst_id, candle["ts"] + self.bar_ms)
+            t0 = time.perf_counter()
+            sigs = evaluate_symbol(
+                inst_id, candles, self.stream.trades(inst_id), self.stream.book(inst_id), MCAP_CACHE.get(), confirm,
+                structure,
+            )
+            METRICS.observe_symbol(inst_id, time.perf_counter() - t0)
             if sigs:
-                for s in sigs:
-                    print(
-                        f"  → Sinyal bulundu: {inst_id} ({s['side']})  Güven %{s['confidence']}"
-                    )
-                all_signals.extend(sigs)
+                telegram(build_telegram_message(None, None, sigs))
+            latency = time.time() - (candle["ts"] + self.bar_ms) / 1000
+            with self.lock:
+                self.latency.observe(latency)
+            if sigs:
+                print(f"[{ts()}] {inst_id} bar kapanışı → {len(sigs)} sinyal, gecikme {latency:.2f} sn")
+            return sigs
         except Exception as e:
-            print(f"  {inst_id} analiz hatası:", e)
-        time.sleep(0.15)  # çok hızlı istek atıp ban yememek için küçük bekleme
+            print(f"  {inst_id} kapanış değerlendirme hatası:", e)
+            return []
 
-    if not all_signals:
-        print("Bu turda sinyal yok. Telegram'a mesaj gönderilmeyecek.")
+
+def run_bar_close():
+    """Olay tetikli mod: her sembol kendi bar kapanışında değerlendirilir."""
+    print(f"[{ts()}] Bar kapanışı modu başlıyor ({BAR})...")
+    MCAP_CACHE.get()
+    symbols = get_spot_usdt_top_symbols(limit=TOP_LIMIT)
+    if not symbols:
+        print("Top USDT listesi alınamadı.")
         return
 
-    msg = build_telegram_message(btc_info, eth_info, all_signals)
-    telegram(msg)
-    print("✅ Telegram'a sinyal mesajı gönderildi.")
+    runner = BarCloseRunner(symbols)
+    stop_event = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop_event.set())
+    signal.signal(signal.SIGINT, lambda *_: stop_event.set())
+    runner.start()
+    print(f"{len(runner.symbols)} sembol için candle{BAR} / trades / book akışı açıldı.")
+    try:
+        while not stop_event.wait(STREAM_SCAN_INTERVAL):
+            h = runner.latency.to_dict()
+            if h["count"]:
+                print(f"Kapanış → uyarı gecikmesi: ort {h['avg']:.2f} sn ({h['count']} değerlendirme)")
+            print(runner.stream.stats_line())
+    finally:
+        runner.stop()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="OKX 4H radar")
+    parser.add_argument("--stream", action="store_true", help="WebSocket akış modu (uzun süreli)")
+    parser.add_argument("--daemon", action="store_true", help="bar kapanışlarına hizalı sürekli çalışma")
+    parser.add_argument("--bar-close", action="store_true", help="WS candle kapanışında sembol bazlı anlık değerlendirme")
+    parser.add_argument("--record", metavar="FIXTURE", help="canlı çalış, yanıtları fixture'a kaydet")
+    parser.add_argument("--replay", metavar="FIXTURE", help="ağsız, fixture'dan tekrar oynat")
+    return parser.parse_args(argv)
 
 
 if __name__ == "__main__":
-    main()
+    args = parse_args()
+    if args.record:
+        use_data_source("record", args.record)
+    elif args.replay:
+        use_data_source("replay", args.replay)
+    elif DATA_SOURCE_MODE != "live":
+        use_data_source(DATA_SOURCE_MODE, FIXTURE_PATH)
+    try:
+        if args.stream:
+            run_stream()
+        elif args.daemon:
+            run_daemon()
+        elif args.bar_close:
+            run_bar_close()
+        else:
+            main()
+        if isinstance(DATA_SOURCE, RecordingSource):
+            DATA_SOURCE.save()
+    finally:
+        # stale-while-revalidate: arkadaki MCAP yenilemesi snapshot'ı yazsın
+        MCAP_CACHE.wait(timeout=60)
@@ -0,0 +1,303 @@
+"""
+Parçalı (sharded) tarama: sembol evreni N parçaya bölünür, her parça ayrı
+process'te (veya ayrı makinede) taranır ve kısmi sonucunu JSON olarak yazar;
+merge adımı parçaları birleştirip tek build_telegram_message çıktısı üretir
+(BTC/ETH özeti sadece sinyal varsa merge'de çekilir).
+
+Bölme deterministiktir:
+  hash    → crc32(instId) % N; hacim sırası değişse de sembol aynı parçada
+            kalır, parçanın mum / indikatör önbelleği sıcak kalır (varsayılan)
+  volume  → hacim sırasına göre şeritli (sıra % N); her parçaya benzer
+            sayıda yüksek hacimli (pahalı) sembol düşer
+
+Dosya düzeni (--shard-dir, varsayılan CACHE_DIR/shards):
+  <run_id>/universe.json            → koordinatörün çektiği evren (opsiyonel;
+                                      yoksa her parça evreni kendisi çeker)
+  <run_id>/shard-<i>-of-<N>.json    → parça sonucu (sinyaller, sembol sıraları)
+run_id varsayılan "<BAR>-<bar açılış ms>": aynı bar içinde farklı makineler
+ortak (paylaşılan / kopyalanan) klasörde buluşur.
+
+Aynı IP'den çalışan parçalar OKX limitini paylaşır: yerel koordinatör her
+parçanın rate limiter'ını 1/N'e indirir (worker için --rate-share).
+Parça başına indikatör durumu CACHE_DIR/indicators.shard-<i>-of-<N>.json'da.
+
+Kullanım:
+  python shard.py run --shards 4 --limit 0        # tek makine, 4 process, tüm evren
+  python shard.py worker --index 0 --count 4      # makine başına bir parça
+  python shard.py merge --count 4                 # parçaları birleştir, Telegram'a gönder
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+import main
+
+STRATEGIES = ("hash", "volume")
+SHARD_DIR = os.path.join(main.CACHE_DIR, "shards")
+
+
+# ------------ Bölme ------------
+
+def shard_of(inst_id, count):
+    """instId'nin parça numarası; process / makine / Python sürümünden bağımsız."""
+    return zlib.crc32(inst_id.encode()) % count
+
+
+def partition_symbols(symbols, count, strategy="hash"):
+    """Hacim sıralı evren → count parça; her parça evren sırasını korur."""
+    if strategy not in STRATEGIES:
+        raise ValueError(f"Bilinmeyen shard stratejisi: {strategy}")
+    parts = [[] for _ in range(count)]
+    for rank, inst_id in enumerate(symbols):
+        k = shard_of(inst_id, count) if strategy == "hash" else rank % count
+        parts[k].append(inst_id)
+    return parts
+
+
+# ------------ Dosyalar ------------
+
+def default_run_id(bar=main.BAR):
+    return f"{bar}-{main.current_bar_open_ms(bar)}"
+
+
+def shard_path(run_dir, index, count):
+    return os.path.join(run_dir, f"shard-{index}-of-{count}.json")
+
+
+def _write_json(path, payload):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(payload, f, separators=(",", ":"), ensure_ascii=False)
+    os.replace(tmp, path)   # merge yarım dosya görmesin
+
+
+def _read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def load_universe(run_dir):
+    snap = _read_json(os.path.join(run_dir, "universe.json"))
+    return snap["symbols"] if snap else None
+
+
+def save_universe(run_dir, symbols):
+    _write_json(os.path.join(run_dir, "universe.json"), {"fetched_at": time.time(), "symbols": symbols})
+
+
+def _shard_file(path, index, count):
+    """path'e parça eki: metrics/last_run.json → metrics/last_run.shard-0-of-4.json"""
+    root, ext = os.path.splitext(path)
+    return f"{root}.shard-{index}-of-{count}{ext}"
+
+
+# ------------ Parça (worker) ------------
+
+def _configure(index, count, rate_share):
+    """Process başına ayarlar: veri kaynağı, parça indikatör dosyası, limit payı."""
+    if main.DATA_SOURCE_MODE == "replay" and not isinstance(main.DATA_SOURCE, main.ReplaySource):
+        main.use_data_source("replay", main.FIXTURE_PATH)
+    if main.INDICATORS.path:
+        main.INDICATORS.save()
+        main.INDICATORS = main.IndicatorStore(
+            path=_shard_file(os.path.join(main.CACHE_DIR, "indicators.json"), index, count)
+        )
+    if rate_share < 1:
+        main.OKX_LIMITER = main.RateLimiter(safety=main.RATE_LIMIT_SAFETY * rate_share)
+
+
+def run_shard(index, count, strategy="hash", run_dir=None, limit=main.TOP_LIMIT, rate_share=1.0):
+    """Evrenin index. parçasını tarar, sonucu run_dir'e yazar; dosya yolunu döndürür."""
+    run_dir = run_dir or os.path.join(SHARD_DIR, default_run_id())
+    _configure(index, count, rate_share)
+    main.METRICS.reset()
+    t0 = time.time()
+    print(f"[{main.ts()}] Parça {index}/{count} başlıyor ({strategy})...")
+
+    with main.REQUEST_CACHE.scope():
+        with main.METRICS.stage("mcap_load"):
+            mcap_map = main.MCAP_CACHE.get()
+
+        symbols = load_universe(run_dir)
+        if symbols is None:
+            with main.METRICS.stage("ticker_list"):
+                symbols = main.get_spot_usdt_top_symbols(limit=limit or None) or []
+        mine = partition_symbols(symbols, count, strategy)[index]
+        signals = main.scan_universe(mine, mcap_map) if mine else []
+    main.INDICATORS.save()
+
+    ranks = {s: i for i, s in enumerate(symbols)}
+    path = shard_path(run_dir, index, count)
+    _write_json(path, {
+        "shard": index,
+        "count": count,
+        "strategy": strategy,
+        "universe_size": len(symbols),
+        "symbols": {s: ranks[s] for s in mine},
+        "signals": signals,
+        "duration_s": time.time() - t0,
+    })
+    if main.METRICS_JSON:
+        main.METRICS.write_json(_shard_file(main.METRICS_JSON, index, count))
+    print(f"[{main.ts()}] Parça {index}/{count}: {len(mine)} sembol, {len(signals)} sinyal → {path}")
+    return path
+
+
+# ------------ Birleştirme ------------
+
+def merge_shards(run_dir, count):
+    """
+    Parça sonuçlarını birleştirir; sinyaller tek process taramasındaki gibi
+    evren sırasına dizilir. Dönüş: (signals, eksik parçalar, evren boyu).
+    """
+    ranks = {}
+    signals = []
+    missing = []
+    universe_size = 0
+    for i in range(count):
+        part = _read_json(shard_path(run_dir, i, count))
+        if part is None:
+            missing.append(i)
+            continue
+        ranks.update(part["symbols"])
+        signals.extend(part["signals"])
+        universe_size = max(universe_size, part.get("universe_size", 0))
+
+    # parçalar farklı evren görmüş olabilir (ayrı makineler): aynı sinyal bir kez
+    seen = set()
+    unique = []
+    for s in sorted(signals, key=lambda s: ranks.get(s["inst_id"], len(ranks))):
+        key = (s["inst_id"], s["side"])
+        if key not in seen:
+            seen.add(key)
+            unique.append(s)
+    return unique, missing, universe_size
+
+
+def merge_and_send(run_dir, count):
+    with main.METRICS.stage("merge"):
+        signals, missing, universe_size = merge_shards(run_dir, count)
+    if missing:
+        print(f"⚠ Eksik parçalar: {missing} — mevcut {count - len(missing)} parça ile devam.")
+    main.METRICS.set_gauge("shards", count)
+    main.METRICS.set_gauge("shards_missing", len(missing))
+    main.METRICS.set_gauge("signals", len(signals))
+    if len(missing) == count:
+        print("Hiç parça sonucu yok.")
+        return None
+    if not signals:
+        print("Bu turda sinyal yok. Telegram'a mesaj gönderilmeyecek.")
+        return None
+
+    with main.METRICS.stage("trend_summary"):
+        mcap_map = main.MCAP_CACHE.get()
+        btc_info = main.get_trend_summary("BTC-USDT", mcap_map)
+        eth_info = main.get_trend_summary("ETH-USDT", mcap_map)
+    main.INDICATORS.save()
+
+    main.TOP_LIMIT = universe_size or main.TOP_LIMIT   # mesaj başlığı: taranan evren
+    msg = main.build_telegram_message(btc_info, eth_info, signals)
+    with main.METRICS.stage("telegram"):
+        main.telegram(msg)
+    print(f"✅ {len(signals)} sinyal tek mesajda Telegram'a gönderildi.")
+    return msg
+
+
+# ------------ Yerel Koordinatör ------------
+
+def run_local(count, strategy="hash", limit=main.TOP_LIMIT, shard_dir=SHARD_DIR, run_id=None):
+    """
+    Tek makinede count process: evren bir kez çekilir, parçalar paralel
+    koşar, sonuçlar birleştirilir. Her parça OKX limitinin 1/count'unu kullanır.
+    """
+    run_dir = os.path.join(shard_dir, run_id or default_run_id())
+    main.METRICS.reset()
+    print(f"[{main.ts()}] {count} parçalı tarama ({strategy}) → {run_dir}")
+    if main.DATA_SOURCE_MODE == "replay":
+        main.use_data_source("replay", main.FIXTURE_PATH)
+
+    # parçalar aynı MCAP snapshot'ını ve evreni görsün (CoinGecko'ya N kez gidilmez)
+    main.MCAP_CACHE.get()
+    main.MCAP_CACHE.wait(timeout=60)
+    with main.METRICS.stage("ticker_list"):
+        symbols = main.get_spot_usdt_top_symbols(limit=limit or None)
+    if not symbols:
+        print("Top USDT listesi alınamadı.")
+        return None
+    save_universe(run_dir, symbols)
+    for i in range(count):
+        # önceki denemeden kalan parça dosyası yeni turla karışmasın
+        if os.path.exists(shard_path(run_dir, i, count)):
+            os.remove(shard_path(run_dir, i, count))
+
+    # spawn: parçalar HTTP havuzu / thread'ler kopyalanmadan temiz başlar
+    ctx = multiprocessing.get_context("spawn")
+    with main.METRICS.stage("shards"), ProcessPoolExecutor(max_workers=count, mp_context=ctx) as pool:
+        futures = [
+            pool.submit(run_shard, i, count, strategy, run_dir, limit, 1.0 / count)
+            for i in range(count)
+        ]
+        for i, fut in enumerate(futures):
+            try:
+                fut.result()
+            except Exception as e:
+                print(f"  Parça {i} hatası:", e)
+    main.METRICS.set_gauge("symbols_scanned", len(symbols))
+    return merge_and_send(run_dir, count)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Parçalı (sharded) radar taraması")
+    parser.add_argument("--strategy", choices=STRATEGIES, default="hash")
+    parser.add_argument("--limit", type=int, default=main.TOP_LIMIT, help="evren boyu (0 → tüm USDT spot)")
+    parser.add_argument("--shard-dir", default=SHARD_DIR)
+    parser.add_argument("--run-id", help="parçaların buluştuğu klasör (varsayılan: <BAR>-<bar açılış ms>)")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p_run = sub.add_parser("run", help="tek makinede N process + merge")
+    p_run.add_argument("--shards", type=int, default=os.cpu_count())
+
+    p_worker = sub.add_parser("worker", help="tek parça (ayrı makine / process)")
+    p_worker.add_argument("--index", type=int, required=True)
+    p_worker.add_argument("--count", type=int, required=True)
+    p_worker.add_argument("--rate-share", type=float, default=1.0,
+                          help="aynı IP'yi paylaşan parçalar için OKX limit payı (örn. 0.25)")
+
+    p_merge = sub.add_parser("merge", help="parça sonuçlarını birleştir ve gönder")
+    p_merge.add_argument("--count", type=int, required=True)
+    return parser.parse_args(argv)
+
+
+def cli(argv=None):
+    args = parse_args(argv)
+    run_dir = os.path.join(args.shard_dir, args.run_id or default_run_id())
+    try:
+        if args.cmd == "worker":
+            if not 0 <= args.index < args.count:
+                raise SystemExit(f"--index 0..{args.count - 1} aralığında olmalı")
+            run_shard(args.index, args.count, args.strategy, run_dir, args.limit, args.rate_share)
+            return
+        if args.cmd == "run":
+            run_local(args.shards, args.strategy, args.limit, args.shard_dir, args.run_id)
+        else:
+            main.METRICS.reset()
+            if main.DATA_SOURCE_MODE == "replay":
+                main.use_data_source("replay", main.FIXTURE_PATH)
+            merge_and_send(run_dir, args.count)
+        main.METRICS.write_json()
+        main.METRICS.write_prometheus()
+    finally:
+        main.MCAP_CACHE.wait(timeout=60)
+
+
+if __name__ == "__main__":
+    cli()
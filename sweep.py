@@ -0,0 +1,283 @@
+"""
+Parametre taraması (sweep): analyze_symbol karar mantığını yerel geçmiş üzerinde
+bir eşik ızgarasının her noktası için tekrar oynatır.
+
+Izgara eksenleri:
+  --lookback        STRUCT_LOOKBACK değerleri
+  --min-conditions  MIN_CONDITIONS_STRICT değerleri
+  --whale-scale     whale_thresholds tablosu çarpanları
+  --delta-scale     net_delta_thresholds tablosu çarpanları
+  --ob-factor       orderbook baskı çarpanı (varsayılan 1.3)
+
+Yapı canlı bot gibi CONFIRM_BAR yapısıyla onaylanır (--mtf-confirm, varsayılan
+MTF_CONFIRM). Parametreden bağımsız ara sonuçlar ızgara noktaları arasında paylaşılır:
+mumlar sembol başına bir kez okunur, yapı (MSB / FVG) her lookback için bir
+kez hesaplanır, bar başına order-flow bir kez OrderFlowAggregator'a
+toplanır ve her ızgara noktası sadece eşikleriyle O(1) sorgu yapar.
+Semboller process havuzunda paralel koşar.
+
+Sonuç sıkıştırılmış kolonsal .npz dosyasına yazılır (ızgara noktası × yön satırları).
+Yapıyı geçip trade / book verisi olmayan barlar flow_missing kolonunda sayılır;
+hiçbir sembolün order-flow geçmişi yoksa tarama hata verir (bkz. backtest.py
+--import-stream / --import-fixture).
+
+Kullanım:
+  python sweep.py --history-dir .cache --lookback 10,20,30 --min-conditions 2,3 \\
+      --whale-scale 0.5,1,2 --ob-factor 1.1,1.3,1.5 --out sweep.npz
+"""
+
+import argparse
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import backtest
+import main
+
+SIDES = backtest.SIDES
+
+
+def build_grid(lookbacks, min_conditions, whale_scales, delta_scales, ob_factors):
+    """Izgara noktaları: (lookback, min_cond, whale_scale, delta_scale, ob_factor)."""
+    return list(itertools.product(lookbacks, min_conditions, whale_scales, delta_scales, ob_factors))
+
+
+def _scaled(table, default, mcap_class, scale):
+    return tuple(x * scale for x in table.get(mcap_class, default))
+
+
+def sweep_arrays(inst_id, arr, trades, books, mcap_map, grid, horizons, bar=main.BAR, confirm=None,
+                 mtf_confirm=None):
+    """
+    Tek sembol için tüm ızgara noktalarının istatistikleri; confirm: CONFIRM_BAR mumları.
+    Dönüş: count (G×2), hits / ret_sum / ret_n (G×2×H) ve flow_missing (G×2:
+    yapıyı geçip trade / book verisi olmadığı için değerlendirilemeyen barlar).
+    """
+    g_n, h_n = len(grid), len(horizons)
+    count = np.zeros((g_n, 2), dtype=np.int64)
+    hits = np.zeros((g_n, 2, h_n), dtype=np.int64)
+    ret_sum = np.zeros((g_n, 2, h_n))
+    ret_n = np.zeros((g_n, 2, h_n), dtype=np.int64)
+    missing = np.zeros((g_n, 2), dtype=np.int64)
+    if len(arr) == 0:
+        return count, hits, ret_sum, ret_n, missing
+
+    fwd = backtest.forward_returns(arr.close, horizons)
+    base = inst_id.split("-")[0]
+    mcap_class = main.classify_mcap(base, mcap_map)
+
+    # lookback başına alt TF onaylı yapı (paylaşılan)
+    structs = {}
+    for lb in sorted({g[0] for g in grid}):
+        st = backtest.structure_over_bars(arr, lb)
+        allow_long, allow_short = backtest.confirm_masks(arr.ts, confirm, lb, mtf_confirm or main.MTF_CONFIRM, bar)
+        st["structure_long"] &= allow_long
+        st["structure_short"] &= allow_short
+        structs[lb] = st
+
+    # bar başına order-flow (paylaşılan, tembel)
+    trade_ts = [int(t.get("ts") or 0) for t in trades]
+    book_ts = [int(b.get("ts") or 0) for b in books]
+    bar_ms = main.bar_to_ms(bar)
+    flows = {}
+
+    def flow_at(t):
+        if t not in flows:
+            bar_trades, book = backtest.bar_orderflow_inputs(
+                trades, trade_ts, books, book_ts, int(arr.ts[t]), bar_ms
+            )
+            agg = None
+            if bar_trades and book:
+                agg = main.OrderFlowAggregator()
+                agg.add_many(bar_trades)
+            flows[t] = (agg, book)
+        return flows[t]
+
+    for gi, (lb, min_cond, w_scale, d_scale, ob_factor) in enumerate(grid):
+        st = structs[lb]
+        thr = _scaled(main.WHALE_THRESHOLDS, main.WHALE_THRESHOLDS_DEFAULT, mcap_class, w_scale)
+        nd_pos_thr, nd_neg_thr = _scaled(
+            main.NET_DELTA_THRESHOLDS, main.NET_DELTA_THRESHOLDS_DEFAULT, mcap_class, d_scale
+        )
+        for t in np.flatnonzero(st["structure_long"] | st["structure_short"]):
+            agg, book = flow_at(t)
+            of = agg.query(*thr) if agg is not None else None
+            last_close = float(arr.close[t])
+            last_ts = int(arr.ts[t])
+            for si, side in enumerate(SIDES):
+                if not st["structure_long" if side == "LONG" else "structure_short"][t]:
+                    continue
+                if of is None:
+                    missing[gi, si] += 1
+                    continue
+                if side == "LONG":
+                    conds = main.long_flow_conditions(last_close, last_ts, of, book, nd_pos_thr, ob_factor)
+                else:
+                    conds = main.short_flow_conditions(last_close, last_ts, of, book, nd_neg_thr, ob_factor)
+                if 1 + sum(conds) < min_cond:
+                    continue
+
+                count[gi, si] += 1
+                r = fwd[:, t] * (1.0 if side == "LONG" else -1.0)
+                ok = ~np.isnan(r)
+                ret_n[gi, si] += ok
+                ret_sum[gi, si] += np.where(ok, r, 0.0)
+                hits[gi, si] += ok & (r > 0)
+    return count, hits, ret_sum, ret_n, missing
+
+
+# ------------ Process Havuzu ------------
+
+_WORKER = {}
+
+
+def _init_worker(history_dir, bar, grid, horizons, mtf_confirm):
+    _WORKER.update(
+        history_dir=history_dir,
+        bar=bar,
+        grid=grid,
+        horizons=horizons,
+        mtf_confirm=mtf_confirm,
+        mcap=backtest.load_mcap_index(history_dir),
+    )
+
+
+def _run_symbol(inst_id):
+    w = _WORKER
+    confirm = None
+    try:
+        arr, trades, books = backtest.load_symbol_history(w["history_dir"], inst_id, w["bar"])
+        if w["mtf_confirm"] != "off":
+            confirm = backtest.load_confirm_history(w["history_dir"], inst_id)
+    except Exception as e:
+        print(f"  {inst_id} geçmişi okunamadı:", e)
+        arr, trades, books = main.CandleArray([], [], [], [], []), [], []
+    return sweep_arrays(inst_id, arr, trades, books, w["mcap"], w["grid"], w["horizons"], w["bar"],
+                        confirm, w["mtf_confirm"])
+
+
+def run_sweep(history_dir, grid, symbols=None, bar=main.BAR, horizons=(1, 3, 6), workers=None, mtf_confirm=None):
+    """
+    Hiçbir sembolün order-flow geçmişi yoksa RuntimeError (tüm ızgara count=0 olurdu).
+    mtf_confirm varsayılanı MTF_CONFIRM.
+    """
+    mtf_confirm = mtf_confirm or main.MTF_CONFIRM
+    if symbols is None:
+        symbols = backtest.list_history_symbols(history_dir, bar)
+    with_flow = sum(backtest.has_orderflow_history(history_dir, s) for s in symbols)
+    if symbols and not with_flow:
+        raise RuntimeError(
+            f"{len(symbols)} sembolün hiçbirinde trades/ + books/ geçmişi yok ({history_dir}); "
+            "önce backtest.py --import-stream / --import-fixture ile kayıtları aktarın"
+        )
+    if with_flow < len(symbols):
+        print(f"  UYARI: {len(symbols) - with_flow} / {len(symbols)} sembolde order-flow geçmişi yok")
+    g_n, h_n = len(grid), len(horizons)
+    total = [
+        np.zeros((g_n, 2), dtype=np.int64),
+        np.zeros((g_n, 2, h_n), dtype=np.int64),
+        np.zeros((g_n, 2, h_n)),
+        np.zeros((g_n, 2, h_n), dtype=np.int64),
+        np.zeros((g_n, 2), dtype=np.int64),
+    ]
+    init = (history_dir, bar, grid, tuple(horizons), mtf_confirm)
+
+    if workers == 1:
+        _init_worker(*init)
+        parts = map(_run_symbol, symbols)
+        for part in parts:
+            for acc, p in zip(total, part):
+                acc += p
+        return total
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=init) as pool:
+        for part in pool.map(_run_symbol, symbols, chunksize=max(1, len(symbols) // 64)):
+            for acc, p in zip(total, part):
+                acc += p
+    return total
+
+
+def to_columns(grid, horizons, result):
+    """Sonuç → kolon sözlüğü (ızgara noktası × yön satırları)."""
+    count, hits, ret_sum, ret_n, missing = result
+    g = np.array(grid, dtype=np.float64)
+    rows = len(grid) * 2
+    cols = {
+        "lookback": np.repeat(g[:, 0].astype(np.int32), 2),
+        "min_conditions": np.repeat(g[:, 1].astype(np.int32), 2),
+        "whale_scale": np.repeat(g[:, 2], 2),
+        "delta_scale": np.repeat(g[:, 3], 2),
+        "ob_factor": np.repeat(g[:, 4], 2),
+        "side": np.tile(np.array(SIDES), len(grid)),
+        "count": count.reshape(rows),
+        "flow_missing": missing.reshape(rows),
+    }
+    with np.errstate(invalid="ignore", divide="ignore"):
+        for i, h in enumerate(horizons):
+            n = ret_n[:, :, i].reshape(rows)
+            cols[f"hit_rate_{h}"] = hits[:, :, i].reshape(rows) / n
+            cols[f"mean_ret_{h}"] = ret_sum[:, :, i].reshape(rows) / n
+    return cols
+
+
+def _floats(text):
+    return [float(x) for x in text.split(",")]
+
+
+def _ints(text):
+    return [int(x) for x in text.split(",")]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Strateji eşikleri üzerinde paralel parametre taraması")
+    parser.add_argument("--history-dir", default=main.CACHE_DIR)
+    parser.add_argument("--bar", default=main.BAR)
+    parser.add_argument("--symbols", help="virgülle ayrılmış instId listesi (varsayılan: hepsi)")
+    parser.add_argument("--horizons", type=_ints, default=[1, 3, 6])
+    parser.add_argument("--lookback", type=_ints, default=[main.STRUCT_LOOKBACK])
+    parser.add_argument("--min-conditions", type=_ints, default=[main.MIN_CONDITIONS_STRICT])
+    parser.add_argument("--whale-scale", type=_floats, default=[1.0])
+    parser.add_argument("--delta-scale", type=_floats, default=[1.0])
+    parser.add_argument("--ob-factor", type=_floats, default=[main.OB_IMBALANCE_FACTOR])
+    parser.add_argument("--mtf-confirm", choices=("off", "align", "both"), default=main.MTF_CONFIRM,
+                        help="alt TF (CONFIRM_BAR) onay kuralı (varsayılan: canlı MTF_CONFIRM)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--out", default="sweep.npz", help="kolonsal çıktı (.npz)")
+    return parser.parse_args(argv)
+
+
+def cli(argv=None):
+    args = parse_args(argv)
+    grid = build_grid(args.lookback, args.min_conditions, args.whale_scale, args.delta_scale, args.ob_factor)
+    symbols = args.symbols.split(",") if args.symbols else None
+    print(f"{len(grid)} ızgara noktası taranıyor...")
+
+    try:
+        result = run_sweep(args.history_dir, grid, symbols, args.bar, args.horizons, args.workers, args.mtf_confirm)
+    except RuntimeError as e:
+        raise SystemExit(f"HATA: {e}")
+    cols = to_columns(grid, args.horizons, result)
+    np.savez_compressed(args.out, **cols)
+
+    missing = int(result[4].sum())
+    if missing:
+        print(f"UYARI: ızgara boyunca {missing} yapı barı (nokta × yön) trade / orderbook verisi "
+              "olmadığı için order-flow kapılarında değerlendirilmedi (flow_missing kolonu).")
+
+    h = args.horizons[0]
+    order = np.argsort(-np.nan_to_num(cols[f"mean_ret_{h}"], nan=-np.inf))
+    print(f"En iyi 10 satır (getiri@{h}):")
+    for i in order[:10]:
+        print(
+            f"  lb={cols['lookback'][i]} min={cols['min_conditions'][i]} "
+            f"whale×{cols['whale_scale'][i]:g} delta×{cols['delta_scale'][i]:g} ob={cols['ob_factor'][i]:g} "
+            f"{cols['side'][i]:<5} adet={cols['count'][i]} isabet={cols[f'hit_rate_{h}'][i]:.1%} "
+            f"getiri={cols[f'mean_ret_{h}'][i]:.3%}"
+        )
+    print(f"Sonuç yazıldı: {args.out}")
+
+
+if __name__ == "__main__":
+    cli()